@@ -0,0 +1,24 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Jeton des routes d'administration qui lisent ou écrivent des données en masse
+# (import /admin/import/..., export /admin/orders/export, remboursement /admin/orders/refund, API /api/v1/admin/...)
+#
+# - valeur attendue : ADMIN_TOKEN, dans l'en-tête X-Admin-Token (ou le champ admin_token du formulaire d'import)
+# - ADMIN_TOKEN vide : routes refusées (403), jamais ouvertes par défaut
+#----------------------------------------------------------------------------------------------------------------------#
+import hmac, os
+#----------------------------------------------------------------------------------------------------------------------#
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+ADMIN_HEADER = "x-admin-token"
+
+MESSAGES = {
+	401: "Jeton d'administration invalide",
+	403: "Route désactivée : ADMIN_TOKEN non défini",
+}
+#----------------------------------------------------------------------------------------------------------------------#
+def denied(request, submitted: str | None = None) -> int | None:
+	"""None si la requête porte le bon jeton (en-tête, sinon champ de formulaire `submitted`), sinon 401 / 403."""
+	if not ADMIN_TOKEN:
+		return 403
+	value = request.headers.get(ADMIN_HEADER) or submitted or ""
+	return None if hmac.compare_digest(value.encode(), ADMIN_TOKEN.encode()) else 401
+#----------------------------------------------------------------------------------------------------------------------#
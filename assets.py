@@ -0,0 +1,208 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Fichiers statiques (/static) : empreintes de contenu, variantes compressées, cache long
+#
+# - au démarrage, chaque fichier de static/ est lu une fois : empreinte blake2b du contenu, variantes gzip et brotli
+#   (si le module brotli est installé) gardées en mémoire quand elles sont plus petites
+# - URL à empreinte : /static/styles.<empreinte>.css -> "Cache-Control: immutable", le navigateur du téléphone ne
+#   revalide plus jamais la feuille de style ; un nouveau contenu donne une nouvelle URL
+# - les gabarits (layout.html, pages admin...) gardent "/static/styles.css" : l'URL est réécrite au chargement du
+#   gabarit (TemplateRegistry(rewrite=...)), rien à modifier à la main après un changement de CSS
+# - l'ancienne URL sans empreinte reste servie (revalidation par ETag à chaque page)
+# - variante choisie selon Accept-Encoding (br, sinon gzip, sinon brute), "Vary: Accept-Encoding"
+# - pages HTML générées (layout(), pages admin) : compressées à la volée au-delà de HTML_COMPRESS_MIN_BYTES
+#----------------------------------------------------------------------------------------------------------------------#
+import gzip, hashlib, mimetypes, os, re, threading
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, PlainTextResponse, Response
+from http_cache import etag_matches, not_modified
+
+try:
+	import brotli
+except ImportError:		# variantes gzip seulement
+	brotli = None
+#----------------------------------------------------------------------------------------------------------------------#
+HTML_COMPRESS_MIN_BYTES = int(os.getenv("HTML_COMPRESS_MIN_BYTES", "1024"))	# 0 = pages HTML non compressées
+HTML_GZIP_LEVEL = int(os.getenv("HTML_GZIP_LEVEL", "6"))					# à la volée : rapide plutôt que minimal
+HTML_BROTLI_QUALITY = int(os.getenv("HTML_BROTLI_QUALITY", "4"))
+ASSETS_RELOAD = os.getenv("TEMPLATES_RELOAD", "0") == "1"					# dev : fichiers relus s'ils changent
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, no-cache"
+COMPRESSIBLE = re.compile(r"^(text/|application/(javascript|json|xml)|image/svg\+xml)")
+FINGERPRINT_RE = re.compile(r"^(?P<stem>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[^./]+)?$")
+STATIC_URL_RE = re.compile(r"/static/([\w./-]+\.\w+)")
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+SUFFIXES = {"identity": "", "gzip": "-gz", "br": "-br"}
+#----------------------------------------------------------------------------------------------------------------------#
+def accepted_encodings(header: str) -> set:
+	"""Encodages acceptés par le client (q=0 exclus)."""
+	accepted = set()
+	for part in header.split(","):
+		token, _, params = part.partition(";")
+		token = token.strip().lower()
+		if not token:
+			continue
+		q = 1.0
+		for param in params.split(";"):
+			name, _, value = param.strip().partition("=")
+			if name == "q":
+				try:
+					q = float(value)
+				except ValueError:
+					q = 0.0
+		if q > 0:
+			accepted.add(token)
+	return accepted
+
+def negotiate(header: str, available) -> str:
+	if not header:
+		return "identity"
+	accepted = accepted_encodings(header)
+	for encoding in ENCODINGS:
+		if encoding in available and encoding in accepted:
+			return encoding
+	return "identity"
+#----------------------------------------------------------------------------------------------------------------------#
+class Asset:
+	__slots__ = ("name", "path", "mtime", "media_type", "digest", "url", "variants")
+
+	def __init__(self, name: str, path: str):
+		self.name = name
+		self.path = path
+		self.mtime = os.stat(path).st_mtime_ns
+		with open(path, "rb") as fichier:
+			data = fichier.read()
+		self.media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+		self.digest = hashlib.blake2b(data, digest_size=6).hexdigest()
+		stem, ext = os.path.splitext(name)
+		self.url = f"/static/{stem}.{self.digest}{ext}"
+		self.variants = {"identity": data}
+		if COMPRESSIBLE.match(self.media_type):
+			# compression maximale : une seule fois par démarrage
+			candidates = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+			if brotli is not None:
+				candidates["br"] = brotli.compress(data, quality=11)
+			for encoding, body in candidates.items():
+				if len(body) < len(data):
+					self.variants[encoding] = body
+
+	def etag(self, encoding: str) -> str:
+		return f'"{self.digest}{SUFFIXES[encoding]}"'		# un ETag fort par représentation
+#----------------------------------------------------------------------------------------------------------------------#
+def _mounted_path(scope) -> str:
+	# chemin sous le point de montage ; selon la version de Starlette, "path" contient ou non root_path
+	path, root = scope["path"], scope.get("root_path", "")
+	if root and path.startswith(root):
+		path = path[len(root):]
+	return path.lstrip("/")
+#----------------------------------------------------------------------------------------------------------------------#
+class AssetPipeline:
+	"""Application ASGI montée sur /static ; ne sert que les fichiers relevés au démarrage (pas de chemin arbitraire)."""
+
+	def __init__(self, directory: str = "static", reload: bool = ASSETS_RELOAD):
+		self.directory = directory
+		self.reload = reload
+		self._lock = threading.Lock()
+		self._assets = {}
+		#------------------------------------------------------------------------------#
+		self.served = {"identity": 0, "gzip": 0, "br": 0}
+		self.not_modified = 0
+		self.build()
+	#------------------------------------------------------------------------------#
+	def build(self):
+		assets = {}
+		for root, _, files in os.walk(self.directory):
+			for filename in files:
+				path = os.path.join(root, filename)
+				name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+				assets[name] = Asset(name, path)
+		self._assets = assets
+	#------------------------------------------------------------------------------#
+	def get(self, name: str) -> Asset | None:
+		asset = self._assets.get(name)
+		if asset is not None and self.reload:
+			try:
+				changed = os.stat(asset.path).st_mtime_ns != asset.mtime
+			except OSError:
+				return None
+			if changed:
+				with self._lock:
+					asset = self._assets[name] = Asset(name, asset.path)
+		return asset
+
+	def lookup(self, name: str) -> tuple:
+		"""(fichier, URL à empreinte à jour ?) pour "styles.css" ou "styles.<empreinte>.css"."""
+		asset = self.get(name)
+		if asset is not None:
+			return asset, False
+		match = FINGERPRINT_RE.match(name)
+		if match is None:
+			return None, False
+		asset = self.get(match["stem"] + (match["ext"] or ""))
+		if asset is None:
+			return None, False
+		return asset, match["digest"] == asset.digest
+	#------------------------------------------------------------------------------#
+	def url(self, name: str) -> str:
+		asset = self.get(name)
+		return asset.url if asset is not None else f"/static/{name}"
+
+	def rewrite(self, text: str) -> str:
+		"""Remplace les /static/<fichier> connus par leur URL à empreinte (gabarits HTML)."""
+		return STATIC_URL_RE.sub(lambda m: self.url(m.group(1)), text)
+	#------------------------------------------------------------------------------#
+	async def __call__(self, scope, receive, send):
+		if scope["method"] not in ("GET", "HEAD"):
+			response = PlainTextResponse("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+			await response(scope, receive, send)
+			return
+		request = Request(scope, receive)
+		asset, current = self.lookup(_mounted_path(scope))
+		if asset is None:
+			await PlainTextResponse("Not Found", status_code=404)(scope, receive, send)
+			return
+		#------------------------------------------------------------------------------#
+		# ancienne empreinte (page en cache d'un déploiement précédent) : contenu actuel, sans cache long
+		encoding = negotiate(request.headers.get("accept-encoding", ""), asset.variants)
+		etag = asset.etag(encoding)
+		headers = {"ETag": etag, "Cache-Control": IMMUTABLE if current else REVALIDATE}
+		if len(asset.variants) > 1:
+			headers["Vary"] = "Accept-Encoding"
+		if etag_matches(request, etag):
+			self.not_modified += 1
+			response = not_modified(etag, headers["Cache-Control"])
+			if "Vary" in headers:
+				response.headers["Vary"] = headers["Vary"]
+		else:
+			self.served[encoding] += 1
+			if encoding != "identity":
+				headers["Content-Encoding"] = encoding
+			response = Response(asset.variants[encoding], media_type=asset.media_type, headers=headers)
+		await response(scope, receive, send)
+	#------------------------------------------------------------------------------#
+	def stats(self) -> dict:
+		assets = list(self._assets.values())
+		return {
+			"files": len(assets),
+			"bytes": sum(len(a.variants["identity"]) for a in assets),
+			"gzip_bytes": sum(len(a.variants.get("gzip", a.variants["identity"])) for a in assets),
+			"br_bytes": sum(len(a.variants.get("br", a.variants["identity"])) for a in assets) if brotli else None,
+			"served": dict(self.served),
+			"not_modified": self.not_modified,
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+def html_response(html, request: Request | None, status_code: int = 200) -> HTMLResponse:
+	"""Page HTML générée, compressée à la volée (br / gzip selon le client) au-delà de HTML_COMPRESS_MIN_BYTES."""
+	body = html.encode("utf-8") if isinstance(html, str) else html
+	if request is None or not HTML_COMPRESS_MIN_BYTES or len(body) < HTML_COMPRESS_MIN_BYTES:
+		return HTMLResponse(body, status_code=status_code)
+	headers = {"Vary": "Accept-Encoding"}
+	encoding = negotiate(request.headers.get("accept-encoding", ""), ENCODINGS)
+	if encoding == "br":
+		body = brotli.compress(body, quality=HTML_BROTLI_QUALITY)
+	elif encoding == "gzip":
+		body = gzip.compress(body, compresslevel=HTML_GZIP_LEVEL, mtime=0)
+	if encoding != "identity":
+		headers["Content-Encoding"] = encoding
+	return HTMLResponse(body, status_code=status_code, headers=headers)
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,116 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Benchmark de l'export en flux des commandes (exports.py) : débit et mémoire du processus
+#
+#	DATABASE_SSLMODE=disable python bench/bench_export.py --rows 1000000 [--format ndjson] [--gzip] [--baseline]
+#
+# 1) schéma jetable "bench_export" (database/init_database_JO.sql) rempli de --rows commandes payées
+# 2) export complet via exports.export_orders (le générateur servi par /admin/orders/export), octets comptés
+#	-> lignes/s, Mo/s, pic de mémoire (ru_maxrss) avant / après
+# 3) --baseline : même requête en fetchall() + RealDictCursor (l'ancienne approche), pour comparer le pic
+# Une ligne JSON par mesure.
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, json, os, resource, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCHEMA = "bench_export"
+os.environ["PGOPTIONS"] = f"{os.environ.get('PGOPTIONS', '')} -c search_path={SCHEMA}".strip()
+
+import psycopg2, psycopg2.extras
+import exports, queries
+from db_pool import DATABASE_URL, DATABASE_SSLMODE, get_pool, close_pool
+#----------------------------------------------------------------------------------------------------------------------#
+def parse_args():
+	parser = argparse.ArgumentParser(description="Benchmark de l'export en flux des commandes")
+	parser.add_argument("--rows", type=int, default=1000000)
+	parser.add_argument("--format", choices=sorted(exports.FORMATS), default="csv")
+	parser.add_argument("--gzip", action="store_true")
+	parser.add_argument("--baseline", action="store_true", help="mesurer aussi fetchall() (pic mémoire)")
+	parser.add_argument("--keep", action="store_true", help="ne pas supprimer le schéma de test")
+	return parser.parse_args()
+#----------------------------------------------------------------------------------------------------------------------#
+def load_dataset(cur, rows: int):
+	cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+	cur.execute(f"CREATE SCHEMA {SCHEMA}")
+	cur.execute(f"SET search_path TO {SCHEMA}")
+	with open(os.path.join(ROOT, "database", "init_database_JO.sql"), encoding="utf-8") as fichier:
+		cur.execute(fichier.read())
+	cur.execute("""
+		INSERT INTO users(first_name, last_name, email, password, key1)
+		SELECT 'Prénom', 'Nom', 'user' || i || '@synthetic.local', md5(i::text), md5('k' || i)
+		FROM generate_series(1, 10000) AS i
+	""")
+	cur.execute("""
+		INSERT INTO orders(user_id, offer_id, quantity, status, created_at)
+		SELECT 1 + i %% 10000, (SELECT MIN(id) FROM offers) + i %% 3, 1 + i %% 4, 'paid', NOW() - (i || ' s')::interval
+		FROM generate_series(1, %s) AS i
+	""", (rows,))
+	cur.execute("""
+		INSERT INTO payments(order_id, amount_cents, status, key2, final_key)
+		SELECT id, 100 * quantity, 'success', md5('p' || id), md5('k' || user_id) || md5('p' || id) FROM orders
+	""")
+	cur.execute("ANALYZE")
+#----------------------------------------------------------------------------------------------------------------------#
+def max_rss_mb() -> float:
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024		# Linux : Ko
+#----------------------------------------------------------------------------------------------------------------------#
+def bench_stream(args) -> dict:
+	rss_before = max_rss_mb()
+	started = time.perf_counter()
+	size = 0
+	for chunk in exports.export_orders("paid", "", [], args.format, args.gzip):
+		size += len(chunk)
+	elapsed = time.perf_counter() - started
+	return {
+		"mode": "stream",
+		"format": args.format + (".gz" if args.gzip else ""),
+		"rows": args.rows,
+		"seconds": round(elapsed, 2),
+		"rows_per_s": round(args.rows / elapsed),
+		"mb": round(size / 2**20, 1),
+		"mb_per_s": round(size / 2**20 / elapsed, 1),
+		"max_rss_mb_before": round(rss_before, 1),
+		"max_rss_mb_after": round(max_rss_mb(), 1),
+	}
+#----------------------------------------------------------------------------------------------------------------------#
+def bench_fetchall(args) -> dict:
+	rss_before = max_rss_mb()
+	started = time.perf_counter()
+	with get_pool().connection() as conn:
+		with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+			cur.execute(queries.EXPORT_ORDERS_SQL.format(condition=""), ("paid",))
+			rows = cur.fetchall()
+	elapsed = time.perf_counter() - started
+	count = len(rows)
+	del rows
+	return {
+		"mode": "fetchall",
+		"rows": count,
+		"seconds": round(elapsed, 2),
+		"rows_per_s": round(count / elapsed),
+		"max_rss_mb_before": round(rss_before, 1),
+		"max_rss_mb_after": round(max_rss_mb(), 1),
+	}
+#----------------------------------------------------------------------------------------------------------------------#
+def main():
+	args = parse_args()
+	conn = psycopg2.connect(DATABASE_URL, sslmode=DATABASE_SSLMODE)
+	conn.autocommit = True
+	try:
+		with conn.cursor() as cur:
+			load_dataset(cur, args.rows)
+		# le streaming d'abord : ru_maxrss est un pic, il ne redescend jamais
+		print(json.dumps(bench_stream(args)), flush=True)
+		if args.baseline:
+			print(json.dumps(bench_fetchall(args)), flush=True)
+	finally:
+		close_pool()
+		if not args.keep:
+			with conn.cursor() as cur:
+				cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+		conn.close()
+
+if __name__ == "__main__":
+	main()
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,181 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Benchmark du contrôle des billets (gate.py)
+#
+#	python bench/bench_gate.py --tickets 1000000 --lookups 200000
+#	DATABASE_SSLMODE=disable DB_MODE=async python bench/bench_gate.py --db --tickets 200000 --clients 1 16 64
+#
+# 1) hors ligne (sans base) : instantané de --tickets clés aléatoires, --lookups recherches (moitié de clés
+#	valides, moitié inconnues) -> latence p50 / p99 / max en µs (objectif < 1 ms) et recherches/s ;
+#	même mesure pour le filtre de Bloom (rejet des clés inconnues avant SQL)
+# 2) --db : schéma jetable "bench_gate" rempli de --tickets billets payés, puis --scans scans réels (gate.scan :
+#	vérification + marquage atomique) par --clients clients simultanés -> scans/s et latences
+# Une ligne JSON par mesure.
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, asyncio, gc, json, os, random, secrets, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCHEMA = "bench_gate"
+os.environ["PGOPTIONS"] = f"{os.environ.get('PGOPTIONS', '')} -c search_path={SCHEMA}".strip()
+os.environ.setdefault("GATE_FILTER_REFRESH", "0")
+
+import gate
+#----------------------------------------------------------------------------------------------------------------------#
+def parse_args():
+	parser = argparse.ArgumentParser(description="Benchmark du contrôle des billets")
+	parser.add_argument("--tickets", type=int, default=1000000)
+	parser.add_argument("--lookups", type=int, default=200000)
+	parser.add_argument("--db", action="store_true", help="mesurer aussi les scans en base")
+	parser.add_argument("--scans", type=int, default=20000, help="scans par mesure (--db)")
+	parser.add_argument("--clients", type=int, nargs="*", default=[1, 16, 64], help="clients simultanés (--db)")
+	parser.add_argument("--keep", action="store_true", help="ne pas supprimer le schéma de test")
+	return parser.parse_args()
+#----------------------------------------------------------------------------------------------------------------------#
+def percentiles(samples: list) -> dict:
+	samples.sort()
+	pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+	return {"p50_us": round(pick(0.5), 2), "p99_us": round(pick(0.99), 2), "max_us": round(samples[-1], 2)}
+#----------------------------------------------------------------------------------------------------------------------#
+def bench_offline(args):
+	keys = [secrets.token_hex(32) for _ in range(args.tickets)]
+	path = os.path.join(tempfile.gettempdir(), "bench_gate.snapshot")
+	started = time.perf_counter()
+	gate.write_snapshot(((k, i, 1, False) for i, k in enumerate(keys, 1)), path)
+	written = time.perf_counter() - started
+	snapshot = gate.Snapshot(path)
+	probes = [random.choice(keys) if i % 2 else secrets.token_hex(32) for i in range(args.lookups)]
+	#------------------------------------------------------------------------------#
+	samples = []
+	found = 0
+	gc.disable()		# pauses du ramasse-miettes (liste des mesures) hors des latences mesurées
+	started = time.perf_counter()
+	for key in probes:
+		t = time.perf_counter_ns()
+		found += snapshot.lookup(key) is not None
+		samples.append((time.perf_counter_ns() - t) / 1000)
+	elapsed = time.perf_counter() - started
+	gc.enable()
+	print(json.dumps({
+		"mode": "snapshot",
+		"tickets": args.tickets,
+		"file_mb": round(os.path.getsize(path) / 2**20, 1),
+		"write_s": round(written, 2),
+		"lookups": args.lookups,
+		"found": found,
+		"lookups_per_s": round(args.lookups / elapsed),
+		**percentiles(samples),
+	}), flush=True)
+	snapshot.close()
+	os.remove(path)
+	#------------------------------------------------------------------------------#
+	bloom = gate.BloomFilter(args.tickets)
+	for key in keys:
+		bloom.add(key)
+	samples = []
+	false_positives = 0
+	gc.disable()
+	for i, key in enumerate(probes):
+		t = time.perf_counter_ns()
+		hit = key in bloom
+		samples.append((time.perf_counter_ns() - t) / 1000)
+		false_positives += hit and i % 2 == 0
+	gc.enable()
+	print(json.dumps({
+		"mode": "bloom",
+		"tickets": args.tickets,
+		"size_mb": round(len(bloom.bits) / 2**20, 1),
+		"false_positive_rate": round(false_positives / (args.lookups / 2), 4),
+		**percentiles(samples),
+	}), flush=True)
+#----------------------------------------------------------------------------------------------------------------------#
+def load_dataset(tickets: int) -> list:
+	import psycopg2
+	from db_pool import DATABASE_URL, DATABASE_SSLMODE
+	conn = psycopg2.connect(DATABASE_URL, sslmode=DATABASE_SSLMODE)
+	conn.autocommit = True
+	with conn.cursor() as cur:
+		cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+		cur.execute(f"CREATE SCHEMA {SCHEMA}")
+		cur.execute(f"SET search_path TO {SCHEMA}")
+		with open(os.path.join(ROOT, "database", "init_database_JO.sql"), encoding="utf-8") as fichier:
+			cur.execute(fichier.read())
+		cur.execute("""
+			INSERT INTO users(first_name, last_name, email, password, key1)
+			SELECT 'Prénom', 'Nom', 'user' || i || '@synthetic.local', md5(i::text), md5('k' || i)
+			FROM generate_series(1, 10000) AS i
+		""")
+		cur.execute("""
+			INSERT INTO orders(user_id, offer_id, quantity, status)
+			SELECT 1 + i %% 10000, (SELECT MIN(id) FROM offers) + i %% 3, 1, 'paid' FROM generate_series(1, %s) AS i
+		""", (tickets,))
+		cur.execute("""
+			INSERT INTO payments(order_id, amount_cents, status, key2, final_key)
+			SELECT o.id, 100, 'success', md5('p' || o.id), u.key1 || md5('p' || o.id)
+			FROM orders o JOIN users u ON u.id = o.user_id
+		""")
+		cur.execute("ANALYZE")
+		cur.execute("SELECT final_key FROM payments ORDER BY random()")
+		keys = [r[0] for r in cur.fetchall()]
+	conn.close()
+	return keys
+#----------------------------------------------------------------------------------------------------------------------#
+async def bench_db(args, keys: list):
+	from db_async import open_async_pool, close_async_pool
+	from db_pool import close_pool
+	await open_async_pool()
+	await asyncio.get_running_loop().run_in_executor(None, gate.ticket_filter.refresh)
+	try:
+		cursor = 0
+		for clients in args.clients:
+			batch = keys[cursor:cursor + args.scans]
+			cursor += args.scans
+			queue = iter(batch)
+			samples, results = [], {}
+
+			async def client():
+				for key in queue:
+					t = time.perf_counter_ns()
+					result = (await gate.scan(key))["result"]
+					samples.append((time.perf_counter_ns() - t) / 1000)
+					results[result] = results.get(result, 0) + 1
+
+			started = time.perf_counter()
+			await asyncio.gather(*(client() for _ in range(clients)))
+			elapsed = time.perf_counter() - started
+			print(json.dumps({
+				"mode": "db",
+				"db_mode": os.getenv("DB_MODE", "sync"),
+				"clients": clients,
+				"scans": len(batch),
+				"scans_per_s": round(len(batch) / elapsed),
+				"results": results,
+				**percentiles(samples),
+			}), flush=True)
+	finally:
+		await close_async_pool()
+		close_pool()
+#----------------------------------------------------------------------------------------------------------------------#
+def main():
+	args = parse_args()
+	bench_offline(args)
+	if not args.db:
+		return
+	keys = load_dataset(args.tickets)
+	if len(keys) < args.scans * len(args.clients):
+		print(f"--tickets trop petit pour {len(args.clients)} x {args.scans} scans sans doublon", file=sys.stderr)
+	try:
+		asyncio.run(bench_db(args, keys))
+	finally:
+		if not args.keep:
+			import psycopg2
+			from db_pool import DATABASE_URL, DATABASE_SSLMODE
+			conn = psycopg2.connect(DATABASE_URL, sslmode=DATABASE_SSLMODE)
+			conn.autocommit = True
+			with conn.cursor() as cur:
+				cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+			conn.close()
+
+if __name__ == "__main__":
+	main()
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,149 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Coût des métriques (metrics.py) sur le chemin de chaque requête
+#
+#	DATABASE_SSLMODE=disable python bench/bench_metrics.py --requests 20000 --queries 5000
+#
+#	middleware : requête ASGI sur une route FastAPI triviale, avec / sans MetricsMiddleware (appel direct de
+#	             l'application, sans serveur ni réseau : le surcoût n'est pas noyé dans le bruit)
+#	middleware_bare : même chose autour d'une application ASGI vide (coût du middleware seul)
+#	cursor     : "SELECT 1" sur une connexion psycopg2 simple / TimedConnection (comme les connexions du pool)
+#	fingerprint: observe_query() d'un texte déjà vu (cache) et normalize() d'un texte nouveau
+#	render     : GET /metrics avec --series séries HTTP et SQL
+# Une ligne JSON par mesure (µs par opération ; avec / sans alternés --rounds fois, meilleure mesure retenue :
+# Postgres et le benchmark se partagent la machine, la médiane reste trop bruitée pour des écarts de quelques µs).
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, asyncio, json, os, sys, time, types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psycopg2
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+import metrics, queries
+from db_pool import DATABASE_URL, DATABASE_SSLMODE
+#----------------------------------------------------------------------------------------------------------------------#
+def parse_args():
+	parser = argparse.ArgumentParser(description="Surcoût des métriques par requête HTTP / SQL")
+	parser.add_argument("--requests", type=int, default=20000)
+	parser.add_argument("--queries", type=int, default=5000)
+	parser.add_argument("--series", type=int, default=500, help="séries exposées pour la mesure de /metrics")
+	parser.add_argument("--rounds", type=int, default=7, help="mesures alternées, meilleure retenue")
+	return parser.parse_args()
+#----------------------------------------------------------------------------------------------------------------------#
+def timed(call, count: int) -> float:
+	started = time.perf_counter()
+	for _ in range(count):
+		call()
+	return (time.perf_counter() - started) / count * 1e6
+#----------------------------------------------------------------------------------------------------------------------#
+def fastapi_app():
+	app = FastAPI()
+
+	@app.get("/items/{item_id}")
+	async def item(item_id: int):
+		return PlainTextResponse("ok")
+	return app
+
+BARE_ROUTE = types.SimpleNamespace(path="/items/{item_id}")
+
+async def bare_app(scope, receive, send):
+	scope["route"] = BARE_ROUTE
+	await send({"type": "http.response.start", "status": 200, "headers": []})
+	await send({"type": "http.response.body", "body": b"ok"})
+#----------------------------------------------------------------------------------------------------------------------#
+def bench_middleware(args, mode: str, app) -> dict:
+	instrumented = metrics.MetricsMiddleware(app)
+	loop = asyncio.new_event_loop()
+
+	async def receive():
+		return {"type": "http.request", "body": b"", "more_body": False}
+
+	async def send(message):
+		pass
+
+	def request(target):
+		scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+			"path": "/items/42", "raw_path": b"/items/42", "root_path": "", "query_string": b"", "headers": [],
+			"client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}
+		return target(scope, receive, send)
+
+	async def run(target, count):
+		started = time.perf_counter()
+		for _ in range(count):
+			await request(target)
+		return (time.perf_counter() - started) / count * 1e6
+
+	loop.run_until_complete(run(app, 1000))		# échauffement (routeur, pile de middlewares construite)
+	plain, measured = [], []
+	for _ in range(args.rounds):
+		plain.append(loop.run_until_complete(run(app, args.requests)))
+		measured.append(loop.run_until_complete(run(instrumented, args.requests)))
+	loop.close()
+	return summary(mode, plain, measured)
+#----------------------------------------------------------------------------------------------------------------------#
+def bench_cursor(args) -> dict:
+	plain_conn = psycopg2.connect(DATABASE_URL, sslmode=DATABASE_SSLMODE)
+	timed_conn = psycopg2.connect(DATABASE_URL, sslmode=DATABASE_SSLMODE, connection_factory=metrics.TimedConnection)
+	try:
+		def select(conn):
+			def call():
+				with conn.cursor() as cur:
+					cur.execute("SELECT 1")
+					cur.fetchall()
+			return call
+		plain, measured = [], []
+		for _ in range(args.rounds):
+			plain.append(timed(select(plain_conn), args.queries))
+			measured.append(timed(select(timed_conn), args.queries))
+		return summary("cursor", plain, measured)
+	finally:
+		plain_conn.close()
+		timed_conn.close()
+#----------------------------------------------------------------------------------------------------------------------#
+def bench_fingerprint(args) -> list:
+	sql = queries.MY_ORDERS_SQL
+	metrics.observe_query(sql, 0.001, 3)
+	hit = min(timed(lambda: metrics.observe_query(sql, 0.001, 3), args.queries) for _ in range(args.rounds))
+	miss = min(timed(lambda: metrics.normalize(sql), args.queries) for _ in range(args.rounds))
+	return [
+		{"mode": "fingerprint_cached", "us_per_op": round(hit, 3)},
+		{"mode": "fingerprint_normalize", "us_per_op": round(miss, 3)},
+	]
+#----------------------------------------------------------------------------------------------------------------------#
+def bench_render(args) -> dict:
+	for i in range(args.series):
+		child = metrics.HTTP_REQUESTS.labels("GET", f"/bench/route{i % 50}", str(200 + i // 50))
+		metrics.HTTP_REQUESTS.observe(child, 0.01)
+		metrics.observe_query(f"SELECT {i} FROM bench_table_{i}", 0.001, 1)
+	started = time.perf_counter()
+	text = metrics.registry.render()
+	return {
+		"mode": "render",
+		"series": sum(len(f.children) for f in metrics.registry.families.values()),
+		"ms": round((time.perf_counter() - started) * 1000, 3),
+		"bytes": len(text.encode()),
+	}
+#----------------------------------------------------------------------------------------------------------------------#
+def summary(mode: str, plain: list, measured: list) -> dict:
+	base, with_metrics = min(plain), min(measured)
+	return {
+		"mode": mode,
+		"us_plain": round(base, 3),
+		"us_metrics": round(with_metrics, 3),
+		"overhead_us": round(with_metrics - base, 3),
+		"overhead_pct": round(100 * (with_metrics - base) / base, 1),
+	}
+#----------------------------------------------------------------------------------------------------------------------#
+def main():
+	args = parse_args()
+	print(json.dumps(bench_middleware(args, "middleware", fastapi_app())), flush=True)
+	print(json.dumps(bench_middleware(args, "middleware_bare", bare_app)), flush=True)
+	print(json.dumps(bench_cursor(args)), flush=True)
+	for line in bench_fingerprint(args):
+		print(json.dumps(line), flush=True)
+	print(json.dumps(bench_render(args)), flush=True)
+
+if __name__ == "__main__":
+	main()
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,104 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Benchmark du hachage des mots de passe (passwords.py) : connexions/s par cœur selon le facteur de travail
+#
+#	python bench/bench_passwords.py --scrypt 12 13 14 15 --pbkdf2 100000 300000 600000 --workers 4
+#
+# Pour chaque (algorithme, facteur de travail) :
+#	- "inline" : vérifications successives dans ce processus -> latence d'une connexion, connexions/s sur 1 cœur
+#	- "pool"   : --logins vérifications simultanées via PasswordHasher(--workers) -> débit total et par worker
+# puis une rafale de --burst connexions simultanées sur une file limitée (--queue) : nombre de refus immédiats
+# (HashingBusy -> 503) et latence maximale des connexions acceptées.
+# Les mots de passe stockés sont générés au facteur de travail mesuré (l'ancien SHA-256 est mesuré aussi).
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, asyncio, hashlib, json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import passwords
+from passwords import PasswordHasher, HashingBusy
+#----------------------------------------------------------------------------------------------------------------------#
+PASSWORD = "Motdepasse2024"
+#----------------------------------------------------------------------------------------------------------------------#
+def parse_args():
+	parser = argparse.ArgumentParser(description="Benchmark du hachage des mots de passe")
+	parser.add_argument("--scrypt", type=int, nargs="*", default=[12, 13, 14, 15], help="log2 N")
+	parser.add_argument("--pbkdf2", type=int, nargs="*", default=[100000, 300000, 600000], help="itérations")
+	parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+	parser.add_argument("--logins", type=int, default=40, help="vérifications par mesure")
+	parser.add_argument("--queue", type=int, default=passwords.PASSWORD_HASH_QUEUE)
+	parser.add_argument("--burst", type=int, default=200, help="connexions simultanées de la rafale")
+	return parser.parse_args()
+#----------------------------------------------------------------------------------------------------------------------#
+def stored_hash(algo: str, cost: int) -> str:
+	if algo == "sha256_legacy":
+		return hashlib.sha256((passwords.LEGACY_SALT + PASSWORD).encode()).hexdigest()
+	return passwords.hash_password(PASSWORD, algo, cost)
+#----------------------------------------------------------------------------------------------------------------------#
+def bench_inline(stored: str, logins: int) -> float:
+	started = time.perf_counter()
+	for _ in range(logins):
+		assert passwords.verify_password(PASSWORD, stored)
+	return (time.perf_counter() - started) / logins
+#----------------------------------------------------------------------------------------------------------------------#
+async def bench_pool(hasher: PasswordHasher, stored: str, logins: int) -> float:
+	# le facteur de travail est lu dans le hash stocké : les workers n'ont pas besoin de la configuration
+	started = time.perf_counter()
+	results = await asyncio.gather(*(hasher._run(passwords.verify_password, PASSWORD, stored) for _ in range(logins)))
+	assert all(results)
+	return time.perf_counter() - started
+#----------------------------------------------------------------------------------------------------------------------#
+async def bench_burst(hasher: PasswordHasher, stored: str, burst: int) -> dict:
+	async def one():
+		started = time.perf_counter()
+		try:
+			await hasher._run(passwords.verify_password, PASSWORD, stored)
+			return time.perf_counter() - started
+		except HashingBusy:
+			return None
+
+	latencies = await asyncio.gather(*(one() for _ in range(burst)))
+	accepted = [l for l in latencies if l is not None]
+	return {
+		"burst": burst,
+		"accepted": len(accepted),
+		"rejected": burst - len(accepted),
+		"accepted_max_ms": round(max(accepted) * 1000, 1) if accepted else None,
+	}
+#----------------------------------------------------------------------------------------------------------------------#
+async def main():
+	args = parse_args()
+	factors = [("sha256_legacy", 0)]
+	factors += [("scrypt", c) for c in args.scrypt]
+	factors += [("pbkdf2_sha256", c) for c in args.pbkdf2]
+
+	hasher = PasswordHasher(workers=args.workers, queue=max(args.logins, args.queue))
+	hasher.start()
+	# démarrage des processus (spawn) hors mesure
+	warmup = stored_hash("sha256_legacy", 0)
+	await asyncio.gather(*(hasher._run(passwords.verify_password, PASSWORD, warmup) for _ in range(args.workers)))
+	try:
+		for algo, cost in factors:
+			stored = stored_hash(algo, cost)
+			per_login = bench_inline(stored, max(1, args.logins // 4))
+			elapsed = await bench_pool(hasher, stored, args.logins)
+			#------------------------------------------------------------------------------#
+			burst_hasher = PasswordHasher(workers=args.workers, queue=args.queue)
+			burst_hasher._executor = hasher._executor			# mêmes processus, file limitée à --queue
+			burst = await bench_burst(burst_hasher, stored, args.burst)
+			#------------------------------------------------------------------------------#
+			print(json.dumps({
+				"algo": algo,
+				"cost": cost,
+				"verify_ms": round(per_login * 1000, 2),
+				"logins_per_s_per_core": round(1 / per_login, 1),
+				"workers": args.workers,
+				"pool_logins_per_s": round(args.logins / elapsed, 1),
+				"pool_logins_per_s_per_worker": round(args.logins / elapsed / args.workers, 1),
+				**burst,
+			}))
+	finally:
+		hasher.shutdown()
+
+if __name__ == "__main__":
+	asyncio.run(main())
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,117 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Benchmark de concurrence du moteur de réservation (reservations.py) contre une base PostgreSQL locale
+#
+#	DATABASE_SSLMODE=disable DB_MODE=async python bench/bench_reservations.py --capacity 2000 --clients 1 4 16 64
+#
+# Pour chaque nombre de clients : une offre neuve de capacité --capacity, puis chaque client enchaîne
+# "commande draft + hold + commit" jusqu'à épuisement du stock. On vérifie ensuite :
+#	- survente nulle : places vendues <= capacité
+#	- conservation : SUM(remaining) + SUM(seats non released) = capacité
+# et on affiche le débit (réservations/s). --shards 1 reproduit la ligne "chaude" unique pour comparaison.
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, asyncio, json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+#----------------------------------------------------------------------------------------------------------------------#
+def parse_args():
+	parser = argparse.ArgumentParser(description="Benchmark des réservations de places")
+	parser.add_argument("--capacity", type=int, default=2000)
+	parser.add_argument("--seats", type=int, default=1, help="places par commande")
+	parser.add_argument("--shards", type=int, default=None, help="défaut : RESERVATION_SHARDS")
+	parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16, 64])
+	return parser.parse_args()
+
+args = parse_args()
+# le pool doit pouvoir servir tous les clients à la fois
+os.environ.setdefault("DB_POOL_MAX", str(max(args.clients)))
+os.environ.setdefault("DB_ASYNC_POOL_MAX", str(max(args.clients)))
+
+import reservations
+from reservations import SoldOut
+from db_pool import get_pool
+from db_async import DB_MODE, get_async_connection, open_async_pool, close_async_pool
+#----------------------------------------------------------------------------------------------------------------------#
+def setup(capacity: int, shards: int) -> tuple[dict, int]:
+	with get_pool().connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute(
+				"INSERT INTO users(first_name, last_name, email, password, key1) "
+				"VALUES ('bench', 'bench', 'bench-' || md5(random()::text) || '@bench.local', '-', '-') RETURNING id"
+			)
+			user_id = cur.fetchone()[0]
+			cur.execute("INSERT INTO offers(name, nbr_ticket, prix) VALUES ('bench', 1, 1) RETURNING id")
+			offer_id = cur.fetchone()[0]
+			reservations.provision(cur, offer_id, capacity, shards)
+	return {"id": offer_id, "name": "bench", "capacity": capacity}, user_id
+#----------------------------------------------------------------------------------------------------------------------#
+def check(offer_id: int) -> dict:
+	with get_pool().connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute("SELECT COALESCE(SUM(remaining), 0) FROM offer_stock_shards WHERE offer_id=%s", (offer_id,))
+			remaining = cur.fetchone()[0]
+			cur.execute(
+				"SELECT COALESCE(SUM(seats), 0) FROM seat_holds WHERE offer_id=%s AND status='committed'",
+				(offer_id,)
+			)
+			committed = cur.fetchone()[0]
+	return {"remaining": remaining, "committed": committed}
+#----------------------------------------------------------------------------------------------------------------------#
+def cleanup(offer_id: int, user_id: int):
+	with get_pool().connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute("DELETE FROM users WHERE id=%s", (user_id,))		# cascade : orders, seat_holds
+			cur.execute("DELETE FROM offers WHERE id=%s", (offer_id,))
+#----------------------------------------------------------------------------------------------------------------------#
+async def client(offer: dict, user_id: int, seats: int, stats: dict):
+	while True:
+		try:
+			async with get_async_connection() as conn:
+				row = await conn.fetchone(
+					"INSERT INTO orders(user_id, offer_id, quantity, status) VALUES(%s, %s, %s, 'draft') RETURNING id",
+					(user_id, offer["id"], seats)
+				)
+				await reservations.hold(conn, offer, row["id"], seats)
+				await reservations.commit(conn, offer, row["id"], seats)
+				await conn.execute("UPDATE orders SET status='paid' WHERE id=%s", (row["id"],))
+		except SoldOut:
+			stats["sold_out"] += 1
+			return
+		stats["ok"] += 1
+#----------------------------------------------------------------------------------------------------------------------#
+async def run(nb_clients: int, shards: int) -> dict:
+	offer, user_id = await asyncio.to_thread(setup, args.capacity, shards)
+	stats = {"ok": 0, "sold_out": 0}
+	start = time.perf_counter()
+	await asyncio.gather(*(client(offer, user_id, args.seats, stats) for _ in range(nb_clients)))
+	elapsed = time.perf_counter() - start
+	result = await asyncio.to_thread(check, offer["id"])
+	await asyncio.to_thread(cleanup, offer["id"], user_id)
+	sold = stats["ok"] * args.seats
+	return {
+		"mode": DB_MODE,
+		"clients": nb_clients,
+		"shards": shards,
+		"capacity": args.capacity,
+		"sold": sold,
+		"oversell": max(0, sold - args.capacity),
+		"conserved": result["remaining"] + result["committed"] == args.capacity and result["committed"] == sold,
+		"seconds": round(elapsed, 3),
+		"reservations_per_s": round(stats["ok"] / elapsed, 1) if elapsed else None,
+	}
+#----------------------------------------------------------------------------------------------------------------------#
+async def main():
+	await open_async_pool()
+	shards = args.shards or reservations.RESERVATION_SHARDS
+	failed = False
+	try:
+		for nb_clients in args.clients:
+			result = await run(nb_clients, shards)
+			print(json.dumps(result))
+			failed |= result["oversell"] > 0 or not result["conserved"]
+	finally:
+		await close_async_pool()
+	sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+	asyncio.run(main())
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,123 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Latence des requêtes SQL des pages selon le volume de données (jeu de tools/gen_dataset.py)
+#
+#	DATABASE_SSLMODE=disable python bench/bench_routes.py --schema dataset --iterations 300
+#	DATABASE_SSLMODE=disable python bench/bench_routes.py --scale 100000 1000000 10000000 [--partitioned]
+#
+# Pour chaque page, les requêtes qu'elle exécute (textes de queries.py / sales_stats.py), avec des paramètres tirés
+# au hasard à chaque itération (client quelconque, client très actif, page de curseur au hasard, mois au hasard)
+# -> p50 / p95 / p99 en ms, une ligne JSON par page et par volume.
+# --scale : génère successivement un jeu de N commandes (N / 10 clients) dans --schema puis mesure ; permet de voir
+# comment chaque page se dégrade quand les données grossissent (à comparer : p95 à 100 k, 1 M, 10 M).
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, json, os, random, subprocess, sys, time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psycopg2, psycopg2.extras
+import partitions, queries, sales_stats
+from db_pool import DATABASE_URL, DATABASE_SSLMODE
+from pagination import PAGE_SIZE_DEFAULT, encode_cursor, keyset_clause
+#----------------------------------------------------------------------------------------------------------------------#
+def parse_args():
+	parser = argparse.ArgumentParser(description="Latence des requêtes des pages selon le volume")
+	parser.add_argument("--schema", default="dataset")
+	parser.add_argument("--iterations", type=int, default=300, help="exécutions mesurées par page")
+	parser.add_argument("--scale", type=int, nargs="*", help="nombres de commandes à générer puis mesurer")
+	parser.add_argument("--partitioned", action="store_true", help="avec --scale : jeux partitionnés par mois")
+	parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="avec --scale : workers du COPY")
+	parser.add_argument("--seed", type=int, default=42)
+	return parser.parse_args()
+#----------------------------------------------------------------------------------------------------------------------#
+def routes(users: int, max_order_id: int) -> dict:
+	"""{page : fonction(rng) -> [(sql, paramètres)]} : les requêtes d'un affichage de la page."""
+	page = PAGE_SIZE_DEFAULT + 1
+
+	def my_orders(user_id):
+		return [(queries.MY_ORDERS_SQL, {"user_id": user_id})]
+
+	def admin_orders(status, after=None, since=None, until=None):
+		condition, params = partitions.created_range_clause("o.created_at", since, until)
+		keyset, order, keyset_params, _ = keyset_clause("o.id", f"orders:{status}", after, None)
+		sql = queries.ADMIN_ORDERS_SQL.format(condition=condition + " " + keyset, order=order)
+		return [(sql, (status, *params, *keyset_params, page))]
+
+	def admin_users(after=None):
+		condition, order, params, _ = keyset_clause("id", "users", after, None)
+		return [(queries.ADMIN_USERS_SQL.format(condition=condition, order=order), (*params, page))]
+
+	def random_month(rng):
+		month = (date.today() - timedelta(days=rng.randrange(30, 600))).replace(day=1)
+		return month, (month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+	return {
+		"/my/orders": lambda rng: my_orders(rng.randint(1, users)),
+		# gen_dataset : les plus petits ids ont le plus de commandes
+		"/my/orders (client actif)": lambda rng: my_orders(rng.randint(1, max(1, users // 1000))),
+		"/admin": lambda rng: [("SELECT id, name, nbr_ticket, prix, capacity FROM offers ORDER BY id ASC", None),
+			(sales_stats.DASHBOARD_SQL, None)],
+		"/admin/orders": lambda rng: admin_orders(rng.choice(("paid", "draft", "canceled"))),
+		"/admin/orders (curseur)": lambda rng: admin_orders(
+			"paid", encode_cursor("orders:paid", rng.randint(1, max_order_id))
+		),
+		"/admin/orders (1 mois)": lambda rng: admin_orders("paid", None, *random_month(rng)),
+		"/admin/users/list": lambda rng: admin_users(),
+		"/admin/users/list (curseur)": lambda rng: admin_users(encode_cursor("users", rng.randint(1, users))),
+	}
+#----------------------------------------------------------------------------------------------------------------------#
+def measure(args, label: dict):
+	conn = psycopg2.connect(DATABASE_URL, sslmode=DATABASE_SSLMODE, options=f"-c search_path={args.schema}")
+	conn.autocommit = True
+	try:
+		with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+			cur.execute("SELECT (SELECT COUNT(*) FROM users) AS users, (SELECT COUNT(*) FROM orders) AS orders, "
+				"(SELECT COALESCE(MAX(id), 1) FROM orders) AS max_order_id")
+			size = cur.fetchone()
+			rng = random.Random(args.seed)
+			for route, build in routes(size["users"], size["max_order_id"]).items():
+				for sql, params in build(rng):		# échauffement (cache des plans, pages en mémoire)
+					cur.execute(sql, params)
+					cur.fetchall()
+				samples = []
+				for _ in range(args.iterations):
+					statements = build(rng)
+					started = time.perf_counter()
+					for sql, params in statements:
+						cur.execute(sql, params)
+						cur.fetchall()
+					samples.append((time.perf_counter() - started) * 1000)
+				samples.sort()
+				pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))], 3)
+				print(json.dumps({
+					**label,
+					"users": size["users"],
+					"orders": size["orders"],
+					"route": route,
+					"p50_ms": pick(0.50),
+					"p95_ms": pick(0.95),
+					"p99_ms": pick(0.99),
+					"max_ms": round(samples[-1], 3),
+				}, ensure_ascii=False), flush=True)
+	finally:
+		conn.close()
+#----------------------------------------------------------------------------------------------------------------------#
+def main():
+	args = parse_args()
+	if not args.scale:
+		measure(args, {"schema": args.schema})
+		return
+	for orders in args.scale:
+		command = [
+			sys.executable, os.path.join(ROOT, "tools", "gen_dataset.py"), "--schema", args.schema,
+			"--orders", str(orders), "--users", str(max(100, orders // 10)), "--workers", str(args.workers),
+			"--seed", str(args.seed),
+		] + (["--partitioned"] if args.partitioned else [])
+		generated = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)
+		print(json.dumps({"dataset": generated}), flush=True)
+		measure(args, {"schema": args.schema, "partitioned": args.partitioned})
+
+if __name__ == "__main__":
+	main()
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,75 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Benchmark du rendu des QR codes des e-billets (tickets.py), sans base
+#
+#	python bench/bench_tickets.py --tickets 500 [--baseline]
+#
+# Pour chaque format (svg, png) et --tickets clés aléatoires :
+#	render : premier affichage (matrice QR + encodage + écriture disque)
+#	memory : réaffichage servi par le LRU du worker
+#	disk   : réaffichage après redémarrage du worker (LRU vide, fichier du cache disque)
+#	--baseline : même image via les fabriques de qrcode (SvgPathImage / PyPNGImage), pour comparer
+# Une ligne JSON par mesure (latences en ms).
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, io, json, os, secrets, shutil, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import tickets
+#----------------------------------------------------------------------------------------------------------------------#
+def parse_args():
+	parser = argparse.ArgumentParser(description="Benchmark du rendu des QR codes des billets")
+	parser.add_argument("--tickets", type=int, default=500)
+	parser.add_argument("--baseline", action="store_true", help="mesurer aussi les fabriques d'images de qrcode")
+	return parser.parse_args()
+#----------------------------------------------------------------------------------------------------------------------#
+def measure(label: str, fmt: str, call, keys: list) -> dict:
+	samples = []
+	size = 0
+	for key in keys:
+		t = time.perf_counter()
+		size += len(call(key))
+		samples.append((time.perf_counter() - t) * 1000)
+	samples.sort()
+	return {
+		"mode": label,
+		"format": fmt,
+		"tickets": len(keys),
+		"p50_ms": round(samples[len(samples) // 2], 3),
+		"p99_ms": round(samples[min(len(samples) - 1, int(0.99 * len(samples)))], 3),
+		"avg_bytes": round(size / len(keys)),
+	}
+#----------------------------------------------------------------------------------------------------------------------#
+def baseline(fmt: str):
+	import qrcode.image.pure, qrcode.image.svg
+	factory = qrcode.image.svg.SvgPathImage if fmt == "svg" else qrcode.image.pure.PyPNGImage
+
+	def render(key):
+		qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=tickets.QR_BORDER,
+			box_size=tickets.TICKET_PNG_SCALE)
+		qr.add_data(key)
+		qr.make(fit=True)
+		out = io.BytesIO()
+		qr.make_image(image_factory=factory).save(out)
+		return out.getvalue()
+	return render
+#----------------------------------------------------------------------------------------------------------------------#
+def main():
+	args = parse_args()
+	directory = tempfile.mkdtemp(prefix="bench_tickets_")
+	try:
+		for fmt in tickets.MEDIA_TYPES:
+			keys = [secrets.token_hex(32) for _ in range(args.tickets)]
+			images = tickets.TicketImages(directory=directory)
+			print(json.dumps(measure("render", fmt, lambda k: images.render(k, fmt), keys)), flush=True)
+			print(json.dumps(measure("memory", fmt, lambda k: images.render(k, fmt), keys)), flush=True)
+			restarted = tickets.TicketImages(directory=directory)
+			print(json.dumps(measure("disk", fmt, lambda k: restarted.render(k, fmt), keys)), flush=True)
+			if args.baseline:
+				print(json.dumps(measure("qrcode_factory", fmt, baseline(fmt), keys)), flush=True)
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	main()
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,333 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Test de charge de bout en bout du parcours d'achat (client HTTP asyncio : httpx)
+#
+#	uvicorn app:app --workers 4 &
+#	python bench/loadtest.py --url http://127.0.0.1:8000 --rate 20 --duration 60 --out run.json
+#	python bench/loadtest.py --rate 20 --duration 60 --compare run.json		# code retour 1 si régression
+#
+# Modèle ouvert : de nouveaux visiteurs arrivent selon un processus de Poisson (--rate par seconde), quel que soit
+# le temps de réponse du serveur (une file qui grossit se voit donc dans les latences, au lieu d'être masquée
+# par des clients qui attendent). Chaque visiteur suit un parcours tiré selon --mix, avec un temps de réflexion
+# exponentiel de moyenne --think secondes entre deux pages :
+#	buyer   : /auth/register -> /offers -> /offers/validate -> /pay -> /payments/confirm -> /my/orders -> QR du billet
+#	abandon : /auth/login (compte créé plus tôt dans le test) -> /offers -> /offers/validate -> /pay, puis s'en va
+#	browser : / -> /offers (puis revalidation ETag) -> /offers/validate sans être connecté (-> /login)
+#	admin   : /admin -> /admin/orders (+ page suivante) -> /admin/users/list
+# Au-delà de --max-users visiteurs simultanés, les arrivées sont comptées "dropped" (serveur saturé).
+#
+# Sortie JSON (--out, sinon stdout) : par route, nombre de requêtes, débit, p50 / p95 / p99 / max, histogramme
+# (bornes en ms), codes HTTP et taux d'erreur ; parcours démarrés / terminés / arrêtés (offre complète) / en échec.
+# À lancer contre une base dédiée : les comptes (@loadtest.local) et commandes créés restent en base.
+# Dépendance : httpx (pip install httpx).
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, asyncio, bisect, json, random, re, secrets, sys, time
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from http.cookies import SimpleCookie
+import httpx
+#----------------------------------------------------------------------------------------------------------------------#
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+OFFER_RE = re.compile(r'name="offer_id" value="(\d+)"')
+IDEMPOTENCY_RE = re.compile(r'name="idempotency_key" value="([^"]+)"')
+ORDER_ID_RE = re.compile(r"order_id=(\d+)")
+TICKET_RE = re.compile(r'src="(/tickets/[0-9a-f]{64}\.svg)"')
+NEXT_PAGE_RE = re.compile(r'href="(/admin/(?:orders|users/list)\?[^"]*after=[^"]*)"')
+#----------------------------------------------------------------------------------------------------------------------#
+def parse_args():
+	parser = argparse.ArgumentParser(description="Test de charge du parcours d'achat")
+	parser.add_argument("--url", default="http://127.0.0.1:8000")
+	parser.add_argument("--rate", type=float, default=10, help="nouveaux visiteurs par seconde (Poisson)")
+	parser.add_argument("--duration", type=float, default=60, help="secondes d'arrivées (les parcours en cours finissent)")
+	parser.add_argument("--think", type=float, default=1.0, help="temps de réflexion moyen entre deux pages (s)")
+	parser.add_argument("--mix", default="buyer=60,abandon=10,browser=25,admin=5", help="poids des parcours")
+	parser.add_argument("--max-users", type=int, default=1000, help="visiteurs simultanés au plus")
+	parser.add_argument("--connections", type=int, default=200, help="connexions HTTP simultanées au plus")
+	parser.add_argument("--timeout", type=float, default=30)
+	parser.add_argument("--seed", type=int, default=None)
+	parser.add_argument("--out", help="fichier JSON du résultat (défaut : stdout)")
+	parser.add_argument("--compare", help="résultat de référence : code retour 1 si une route régresse")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="hausse de p95 tolérée (--compare), 0.25 = +25 %%")
+	args = parser.parse_args()
+	try:
+		args.mix = {name: float(weight) for name, weight in (item.split("=") for item in args.mix.split(","))}
+	except ValueError:
+		parser.error("--mix attendu sous la forme buyer=60,browser=40")
+	unknown = set(args.mix) - set(SCENARIOS)
+	if unknown:
+		parser.error(f"parcours inconnus : {', '.join(sorted(unknown))} (connus : {', '.join(SCENARIOS)})")
+	return args
+#----------------------------------------------------------------------------------------------------------------------#
+class JourneyFailed(Exception):
+	pass
+
+class SoldOut(JourneyFailed):
+	"""Offre complète : résultat métier normal (page 200 "Offre complète"), pas une erreur du serveur."""
+#----------------------------------------------------------------------------------------------------------------------#
+class Stats:
+	def __init__(self):
+		self.routes = {}			# route -> {"samples": [ms], "codes": {code: n}, "errors": n}
+		self.journeys = {}			# parcours -> {"started", "completed", "sold_out", "failed"}
+		self.failures = {}			# motif d'échec -> n (les premiers suffisent à diagnostiquer)
+		self.dropped = 0
+
+	def record(self, route: str, ms: float, code: str, error: bool):
+		entry = self.routes.setdefault(route, {"samples": [], "codes": {}, "errors": 0})
+		entry["samples"].append(ms)
+		entry["codes"][code] = entry["codes"].get(code, 0) + 1
+		entry["errors"] += error
+
+	def journey(self, name: str, outcome: str):
+		entry = self.journeys.setdefault(name, {"started": 0, "completed": 0, "sold_out": 0, "failed": 0})
+		entry[outcome] += 1
+
+	def fail(self, reason: str):
+		self.failures[reason] = self.failures.get(reason, 0) + 1
+	#------------------------------------------------------------------------------#
+	@staticmethod
+	def summarize(samples: list, codes: dict, errors: int, elapsed: float) -> dict:
+		samples = sorted(samples)
+		pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))], 2)
+		histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+		for ms in samples:
+			histogram[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, ms)] += 1
+		return {
+			"requests": len(samples),
+			"rps": round(len(samples) / elapsed, 2),
+			"p50_ms": pick(0.50),
+			"p95_ms": pick(0.95),
+			"p99_ms": pick(0.99),
+			"max_ms": round(samples[-1], 2),
+			"error_rate": round(errors / len(samples), 4),
+			"codes": dict(sorted(codes.items())),
+			"histogram_ms": {
+				f"<={bound}" if i < len(HISTOGRAM_BOUNDS_MS) else f">{HISTOGRAM_BOUNDS_MS[-1]}": count
+				for i, (bound, count) in enumerate(zip(HISTOGRAM_BOUNDS_MS + (None,), histogram))
+			},
+		}
+
+	def report(self, args, elapsed: float) -> dict:
+		everything, codes, errors = [], {}, 0
+		routes = {}
+		for route, entry in sorted(self.routes.items()):
+			routes[route] = self.summarize(entry["samples"], entry["codes"], entry["errors"], elapsed)
+			everything += entry["samples"]
+			errors += entry["errors"]
+			for code, n in entry["codes"].items():
+				codes[code] = codes.get(code, 0) + n
+		return {
+			"config": {
+				"url": args.url, "rate": args.rate, "duration": args.duration, "think": args.think,
+				"mix": args.mix, "max_users": args.max_users, "seed": args.seed,
+			},
+			"elapsed_s": round(elapsed, 2),
+			"dropped_arrivals": self.dropped,
+			"journeys": self.journeys,
+			"failures": dict(sorted(self.failures.items(), key=lambda kv: -kv[1])[:20]),
+			"total": self.summarize(everything, codes, errors, elapsed) if everything else None,
+			"routes": routes,
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+class Visitor:
+	"""Un visiteur : ses cookies (gérés à la main, le client HTTP est partagé) et ses mesures."""
+
+	def __init__(self, client: httpx.AsyncClient, stats: Stats, args):
+		self.client = client
+		self.stats = stats
+		self.think_mean = args.think
+		self.cookies = {}
+	#------------------------------------------------------------------------------#
+	async def think(self):
+		if self.think_mean > 0:
+			await asyncio.sleep(random.expovariate(1 / self.think_mean))
+	#------------------------------------------------------------------------------#
+	async def request(self, method: str, path: str, route: str, expect=(200,), headers=None, **kwargs):
+		headers = dict(headers or {})
+		if self.cookies:
+			headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+		started = time.perf_counter()
+		try:
+			resp = await self.client.request(method, path, headers=headers, **kwargs)
+		except httpx.HTTPError as e:
+			self.stats.record(route, (time.perf_counter() - started) * 1000, type(e).__name__, True)
+			raise JourneyFailed(f"{route}: {type(e).__name__}")
+		ms = (time.perf_counter() - started) * 1000
+		ok = resp.status_code in expect
+		self.stats.record(route, ms, str(resp.status_code), not ok)
+		if not ok:
+			raise JourneyFailed(f"{route}: HTTP {resp.status_code}")
+		for header in resp.headers.get_list("set-cookie"):
+			for name, morsel in SimpleCookie(header).items():
+				if morsel.value and morsel["max-age"] != "0":
+					self.cookies[name] = morsel.value
+				else:
+					self.cookies.pop(name, None)
+		return resp
+	#------------------------------------------------------------------------------#
+	async def offers(self) -> list:
+		resp = await self.request("GET", "/offers", "GET /offers")
+		offer_ids = OFFER_RE.findall(resp.text)
+		if not offer_ids:
+			raise JourneyFailed("GET /offers: aucune offre")
+		return offer_ids
+	#------------------------------------------------------------------------------#
+	async def validate(self, offer_ids: list) -> str:
+		resp = await self.request(
+			"POST", "/offers/validate", "POST /offers/validate", expect=(200, 303),
+			data={"offer_id": random.choice(offer_ids)},
+		)
+		if resp.status_code == 200 and "Offre complète" in resp.text:
+			raise SoldOut()
+		match = ORDER_ID_RE.search(resp.headers.get("location", ""))
+		if not match:
+			raise JourneyFailed("POST /offers/validate: pas de commande (complet ?)")
+		return match.group(1)
+#----------------------------------------------------------------------------------------------------------------------#
+# Parcours : fonctions async (visiteur, comptes déjà créés) ; JourneyFailed = parcours en échec
+ACCOUNTS = []		# (email, mot de passe) créés par les parcours "buyer", réutilisés par "abandon"
+RUN_ID = secrets.token_hex(3)
+
+async def buyer(v: Visitor):
+	email = f"load-{RUN_ID}-{secrets.token_hex(6)}@loadtest.local"
+	password = "Charge" + str(random.randrange(10**6, 10**7))
+	await v.request("GET", "/register", "GET /register")
+	await v.think()
+	await v.request(
+		"POST", "/auth/register", "POST /auth/register", expect=(303,),
+		data={"first_name": "Charge", "last_name": "Test", "email": email, "password": password},
+	)
+	if "user_id" not in v.cookies:
+		raise JourneyFailed("POST /auth/register: compte non créé")
+	ACCOUNTS.append((email, password))
+	offer_ids = await v.offers()
+	await v.think()
+	order_id = await v.validate(offer_ids)
+	resp = await v.request("GET", f"/pay?order_id={order_id}", "GET /pay")
+	match = IDEMPOTENCY_RE.search(resp.text)
+	await v.think()
+	resp = await v.request(
+		"POST", "/payments/confirm", "POST /payments/confirm",
+		data={"order_id": order_id, "idempotency_key": match.group(1) if match else ""},
+	)
+	ticket = TICKET_RE.search(resp.text)
+	if ticket:
+		await v.request("GET", ticket.group(1), "GET /tickets/{key}.svg")
+	await v.think()
+	await v.request("GET", "/my/orders", "GET /my/orders")
+
+async def abandon(v: Visitor):
+	if not ACCOUNTS:
+		return await buyer(v)
+	email, password = random.choice(ACCOUNTS)
+	await v.request("POST", "/auth/login", "POST /auth/login", expect=(303,), data={"email": email, "password": password})
+	offer_ids = await v.offers()
+	await v.think()
+	order_id = await v.validate(offer_ids)
+	await v.request("GET", f"/pay?order_id={order_id}", "GET /pay")
+	# panier laissé en 'draft' : expiré par draft_sweeper.py
+
+async def browser(v: Visitor):
+	await v.request("GET", "/", "GET /")
+	await v.think()
+	resp = await v.request("GET", "/offers", "GET /offers")
+	offer_ids = OFFER_RE.findall(resp.text)
+	etag = resp.headers.get("etag")
+	await v.think()
+	if etag:
+		# retour sur la page : le navigateur revalide son cache
+		await v.request("GET", "/offers", "GET /offers (If-None-Match)", expect=(200, 304), headers={"If-None-Match": etag})
+	if offer_ids:
+		await v.request(
+			"POST", "/offers/validate", "POST /offers/validate (anonyme)", expect=(303,),
+			data={"offer_id": random.choice(offer_ids)},
+		)
+
+async def admin(v: Visitor):
+	await v.request("GET", "/admin", "GET /admin")
+	await v.think()
+	resp = await v.request("GET", f"/admin/orders?status={random.choice(['paid', 'paid', 'draft', 'canceled'])}", "GET /admin/orders")
+	match = NEXT_PAGE_RE.search(resp.text)
+	if match:
+		await v.think()
+		await v.request("GET", match.group(1).replace("&amp;", "&"), "GET /admin/orders (page suivante)")
+	await v.think()
+	await v.request("GET", "/admin/users/list", "GET /admin/users/list")
+
+SCENARIOS = {"buyer": buyer, "abandon": abandon, "browser": browser, "admin": admin}
+#----------------------------------------------------------------------------------------------------------------------#
+async def run(args) -> dict:
+	stats = Stats()
+	names, weights = list(args.mix), list(args.mix.values())
+	active = set()
+	limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+
+	async def journey(client, name):
+		stats.journey(name, "started")
+		try:
+			await SCENARIOS[name](Visitor(client, stats, args))
+		except SoldOut:
+			stats.journey(name, "sold_out")
+		except JourneyFailed as e:
+			stats.journey(name, "failed")
+			stats.fail(str(e))
+		else:
+			stats.journey(name, "completed")
+
+	# client partagé (pool de connexions) : sa boîte à cookies refuse tout, chaque visiteur gère les siens
+	no_cookies = CookieJar(DefaultCookiePolicy(allowed_domains=[]))
+	async with httpx.AsyncClient(
+		base_url=args.url, timeout=args.timeout, limits=limits, cookies=no_cookies
+	) as client:
+		started = time.perf_counter()
+		next_arrival = started
+		while next_arrival - started < args.duration:
+			delay = next_arrival - time.perf_counter()
+			if delay > 0:
+				await asyncio.sleep(delay)
+			if len(active) >= args.max_users:
+				stats.dropped += 1
+			else:
+				task = asyncio.create_task(journey(client, random.choices(names, weights)[0]))
+				active.add(task)
+				task.add_done_callback(active.discard)
+			next_arrival += random.expovariate(args.rate)
+		if active:
+			await asyncio.gather(*active)
+		elapsed = time.perf_counter() - started
+	return stats.report(args, elapsed)
+#----------------------------------------------------------------------------------------------------------------------#
+def regressions(result: dict, reference: dict, tolerance: float) -> list:
+	"""Routes dont le p95 dépasse la référence de plus de `tolerance`, ou dont le taux d'erreur augmente."""
+	found = []
+	for route, ref in reference.get("routes", {}).items():
+		cur = result["routes"].get(route)
+		if cur is None:
+			continue
+		# on ignore les écarts de quelques ms sur les routes très rapides (bruit de mesure)
+		if cur["p95_ms"] > ref["p95_ms"] * (1 + tolerance) and cur["p95_ms"] - ref["p95_ms"] > 5:
+			found.append(f"{route}: p95 {ref['p95_ms']} -> {cur['p95_ms']} ms")
+		if cur["error_rate"] > ref["error_rate"] + 0.01:
+			found.append(f"{route}: erreurs {ref['error_rate']:.2%} -> {cur['error_rate']:.2%}")
+	return found
+#----------------------------------------------------------------------------------------------------------------------#
+def main():
+	args = parse_args()
+	if args.seed is not None:
+		random.seed(args.seed)
+	result = asyncio.run(run(args))
+	output = json.dumps(result, indent=2, ensure_ascii=False)
+	if args.out:
+		with open(args.out, "w", encoding="utf-8") as fichier:
+			fichier.write(output + "\n")
+	else:
+		print(output)
+	#------------------------------------------------------------------------------#
+	if args.compare:
+		with open(args.compare, encoding="utf-8") as fichier:
+			found = regressions(result, json.load(fichier), args.tolerance)
+		for line in found:
+			print(f"RÉGRESSION {line}", file=sys.stderr)
+		if found:
+			sys.exit(1)
+
+if __name__ == "__main__":
+	main()
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,346 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Import en masse : offres et billets de groupe (ventes entreprises / délégations)
+#
+# - entrée CSV (ligne d'en-tête) ou NDJSON (un objet JSON par ligne), lue en flux
+#	offers  : name, nbr_ticket, prix, capacity (vide = illimitée)
+#	tickets : email (ou user_id), offer_id, quantity (défaut 1) -> commande 'paid' + paiement + clé finale
+# - chaque ligne est validée en Python ; les lignes valides partent par COPY dans une table temporaire, puis
+#   quelques requêtes ensemblistes vérifient ce qui dépend de la base (utilisateur / offre inconnus, nom déjà pris,
+#   places disponibles) et insèrent le lot d'un coup
+# - une transaction par lot de BULK_IMPORT_CHUNK lignes : un lot en échec est annulé seul, ses lignes sont
+#   signalées dans le rapport et l'import continue
+# - rapport : lignes lues / importées / rejetées, lignes par seconde et erreurs ligne par ligne
+#
+# CLI : python bulk_import.py offers|tickets FICHIER [--format csv|ndjson] [--chunk 5000] [--errors erreurs.ndjson]
+# HTTP : POST /admin/import/offers | /admin/import/tickets (champ de fichier "file", voir /admin)
+#----------------------------------------------------------------------------------------------------------------------#
+import csv, decimal, io, json, os, secrets, time
+import reservations
+from sales_stats import AMOUNT_CENTS_SQL, record_from, random_shard
+#----------------------------------------------------------------------------------------------------------------------#
+BULK_IMPORT_CHUNK = int(os.getenv("BULK_IMPORT_CHUNK", "5000"))			# lignes par transaction
+BULK_IMPORT_MAX_ERRORS = int(os.getenv("BULK_IMPORT_MAX_ERRORS", "1000"))	# erreurs détaillées renvoyées par HTTP
+
+INT_MAX = 2**31 - 1
+#----------------------------------------------------------------------------------------------------------------------#
+def detect_format(filename: str | None, fmt: str | None = None) -> str:
+	if fmt in ("csv", "ndjson"):
+		return fmt
+	if filename and filename.lower().endswith((".ndjson", ".jsonl")):
+		return "ndjson"
+	return "csv"
+#----------------------------------------------------------------------------------------------------------------------#
+def read_records(stream, fmt: str):
+	"""(numéro de ligne, dict) par enregistrement ; dict remplacé par un message si la ligne est illisible."""
+	if fmt == "ndjson":
+		for line, text in enumerate(stream, 1):
+			if not text.strip():
+				continue
+			try:
+				record = json.loads(text)
+			except ValueError as e:
+				yield line, f"JSON invalide : {e}"
+				continue
+			yield line, record if isinstance(record, dict) else "objet JSON attendu"
+	else:
+		reader = csv.DictReader(stream)
+		for record in reader:
+			if None in record:
+				yield reader.line_num, "trop de colonnes"
+			else:
+				yield reader.line_num, record
+#----------------------------------------------------------------------------------------------------------------------#
+def _text(record: dict, field: str, required: bool = True) -> str | None:
+	value = record.get(field)
+	value = str(value).strip() if value is not None else ""
+	if not value:
+		if required:
+			raise ValueError(f"{field} manquant")
+		return None
+	return value
+
+def _int(record: dict, field: str, minimum: int = 0, required: bool = True, default: int | None = None) -> int | None:
+	value = _text(record, field, required and default is None)
+	if value is None:
+		return default
+	try:
+		number = decimal.Decimal(value)		# exact, sans OverflowError ("1e400", "inf" : rejetés ci-dessous)
+	except decimal.InvalidOperation:
+		raise ValueError(f"{field} : nombre attendu ({value!r})") from None
+	if not number.is_finite() or number != number.to_integral_value():
+		raise ValueError(f"{field} : nombre entier attendu ({value!r})")
+	if not minimum <= number <= INT_MAX:
+		raise ValueError(f"{field} : hors limites ({value})")
+	return int(number)
+#----------------------------------------------------------------------------------------------------------------------#
+class BulkImport:
+	"""Import d'un type d'enregistrement : table temporaire, validation d'une ligne, application d'un lot."""
+	kind = ""
+	table = ""
+	staging = ""			# CREATE de la table temporaire (ON COMMIT DROP) ; première colonne = numéro de ligne
+	columns = ()
+
+	def validate(self, record: dict) -> tuple:
+		raise NotImplementedError
+
+	def apply(self, cur) -> tuple:
+		"""Applique le lot chargé dans la table temporaire -> (lignes importées, [(ligne, erreur)])."""
+		raise NotImplementedError
+	#------------------------------------------------------------------------------#
+	def _load(self, cur, rows: list):
+		cur.execute(self.staging)
+		buffer = io.StringIO()
+		csv.writer(buffer).writerows(rows)		# None -> champ vide -> NULL
+		buffer.seek(0)
+		cur.copy_expert(f"COPY {self.table} (line, {', '.join(self.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+	#------------------------------------------------------------------------------#
+	def run(self, conn, records, chunk: int = BULK_IMPORT_CHUNK) -> dict:
+		"""Importe `records` ((ligne, dict) de read_records) par lots ; conn = connexion psycopg2 (commit par lot)."""
+		chunk = max(1, chunk)
+		started = time.perf_counter()
+		report = {"kind": self.kind, "rows": 0, "imported": 0, "rejected": 0, "chunks": 0, "errors": []}
+		raw = {}
+		rows = []
+
+		def error(line, message):
+			report["rejected"] += 1
+			report["errors"].append({"line": line, "error": message, "row": raw.get(line)})
+
+		def flush():
+			if not rows:
+				return
+			report["chunks"] += 1
+			try:
+				with conn.cursor() as cur:
+					self._load(cur, rows)
+					imported, rejected = self.apply(cur)
+				conn.commit()
+			except Exception as e:
+				conn.rollback()
+				imported, rejected = 0, [(row[0], f"lot annulé : {str(e).strip()}") for row in rows]
+			report["imported"] += imported
+			for line, message in rejected:
+				error(line, message)
+			rows.clear()
+			raw.clear()
+		#------------------------------------------------------------------------------#
+		for line, record in records:
+			report["rows"] += 1
+			raw[line] = record if isinstance(record, dict) else None
+			if not isinstance(record, dict):
+				error(line, record)
+				continue
+			try:
+				rows.append((line, *self.validate(record)))
+			except ValueError as e:
+				error(line, str(e))
+				continue
+			if len(rows) >= chunk:
+				flush()
+		flush()
+		#------------------------------------------------------------------------------#
+		seconds = time.perf_counter() - started
+		report["seconds"] = round(seconds, 3)
+		report["rows_per_s"] = round(report["rows"] / seconds, 1) if seconds > 0 else None
+		report["errors"].sort(key=lambda e: e["line"])
+		return report
+#----------------------------------------------------------------------------------------------------------------------#
+class OfferImport(BulkImport):
+	kind = "offers"
+	table = "bulk_offers"
+	staging = """
+		CREATE TEMP TABLE bulk_offers (
+			line INT PRIMARY KEY, name TEXT, nbr_ticket INT, prix INT, capacity INT
+		) ON COMMIT DROP
+	"""
+	columns = ("name", "nbr_ticket", "prix", "capacity")
+
+	# noms déjà en base ou répétés dans le lot (la première occurrence est gardée)
+	REJECT_DUPLICATES_SQL = """
+		DELETE FROM bulk_offers b
+		WHERE b.name IN (SELECT name FROM offers)
+		   OR EXISTS (SELECT 1 FROM bulk_offers d WHERE d.name = b.name AND d.line < b.line)
+		RETURNING b.line, CASE WHEN b.name IN (SELECT name FROM offers)
+			THEN 'offre déjà existante' ELSE 'nom en double dans le fichier' END
+	"""
+	# offres + stock réparti sur les shards (même répartition que reservations.provision)
+	INSERT_SQL = """
+		WITH new_offers AS (
+			INSERT INTO offers(name, nbr_ticket, prix, capacity)
+			SELECT name, nbr_ticket, prix, capacity FROM bulk_offers ORDER BY line
+			RETURNING id, capacity
+		), stock AS (
+			INSERT INTO offer_stock_shards(offer_id, shard, remaining)
+			SELECT id, g, capacity / %(shards)s + (g < capacity %% %(shards)s)::int
+			FROM new_offers, generate_series(0, %(shards)s - 1) AS g
+			WHERE capacity IS NOT NULL
+		)
+		SELECT COUNT(*) FROM new_offers
+	"""
+
+	def validate(self, record: dict) -> tuple:
+		name = _text(record, "name")
+		if len(name) > 200:
+			raise ValueError("name : 200 caractères maximum")
+		return (
+			name,
+			_int(record, "nbr_ticket", minimum=1),
+			_int(record, "prix"),
+			_int(record, "capacity", required=False),
+		)
+
+	def apply(self, cur) -> tuple:
+		cur.execute(self.REJECT_DUPLICATES_SQL)
+		rejected = cur.fetchall()
+		cur.execute(self.INSERT_SQL, {"shards": max(1, reservations.RESERVATION_SHARDS)})
+		return cur.fetchone()[0], rejected
+#----------------------------------------------------------------------------------------------------------------------#
+class TicketImport(BulkImport):
+	kind = "tickets"
+	table = "bulk_tickets"
+	staging = """
+		CREATE TEMP TABLE bulk_tickets (
+			line INT PRIMARY KEY, email TEXT, user_id INT, offer_id INT, quantity INT, key2 TEXT
+		) ON COMMIT DROP
+	"""
+	columns = ("email", "user_id", "offer_id", "quantity", "key2")
+
+	RESOLVE_USERS_SQL = """
+		UPDATE bulk_tickets b SET user_id = u.id
+		FROM users u
+		WHERE b.user_id IS NULL AND u.email = b.email
+	"""
+	REJECT_UNKNOWN_SQL = """
+		DELETE FROM bulk_tickets b
+		WHERE b.user_id IS NULL
+		   OR NOT EXISTS (SELECT 1 FROM users u WHERE u.id = b.user_id)
+		   OR NOT EXISTS (SELECT 1 FROM offers of WHERE of.id = b.offer_id)
+		RETURNING b.line, CASE WHEN EXISTS (SELECT 1 FROM offers of WHERE of.id = b.offer_id)
+			THEN 'utilisateur inconnu' ELSE 'offre inconnue' END
+	"""
+	# offres limitées : shards verrouillés jusqu'au commit, lignes servies dans l'ordre du fichier tant qu'il reste
+	# des places (invariant de reservations.py conservé)
+	REJECT_SOLD_OUT_SQL = """
+		WITH stock AS (
+			SELECT offer_id, SUM(remaining) AS remaining
+			FROM (
+				SELECT offer_id, remaining FROM offer_stock_shards
+				WHERE offer_id IN (
+					SELECT b.offer_id FROM bulk_tickets b JOIN offers of ON of.id = b.offer_id
+					WHERE of.capacity IS NOT NULL
+				)
+				ORDER BY offer_id, shard
+				FOR UPDATE
+			) AS locked
+			GROUP BY offer_id
+		), demand AS (
+			SELECT
+				b.line,
+				SUM(b.quantity) OVER (PARTITION BY b.offer_id ORDER BY b.line) AS cumulated,
+				COALESCE(stock.remaining, 0) AS remaining
+			FROM bulk_tickets b
+			JOIN offers of ON of.id = b.offer_id AND of.capacity IS NOT NULL
+			LEFT JOIN stock ON stock.offer_id = b.offer_id
+		)
+		DELETE FROM bulk_tickets b USING demand d
+		WHERE b.line = d.line AND d.cumulated > d.remaining
+		RETURNING b.line, 'plus assez de places pour l''offre ' || b.offer_id
+	"""
+	# commandes payées + paiements (clé finale = key1 || key2, comme /payments/confirm) + places vendues
+	# (shards débités dans l'ordre, une ligne seat_holds 'committed' par commande) + statistiques de ventes
+	ISSUE_SQL = f"""
+		WITH numbered AS (
+			SELECT
+				b.line, nextval(pg_get_serial_sequence('orders', 'id')) AS order_id,
+				b.user_id, b.offer_id, b.quantity, b.key2, u.key1, of.prix, of.capacity
+			FROM bulk_tickets b
+			JOIN users u ON u.id = b.user_id
+			JOIN offers of ON of.id = b.offer_id
+		), new_orders AS (
+			INSERT INTO orders(id, user_id, offer_id, quantity, status)
+			SELECT order_id, user_id, offer_id, quantity, 'paid' FROM numbered
+		), new_payments AS (
+			INSERT INTO payments(order_id, amount_cents, status, key2, final_key)
+			SELECT order_id, {AMOUNT_CENTS_SQL}, 'success', key2, key1 || key2 FROM numbered
+		), need AS (
+			SELECT offer_id, SUM(quantity) AS seats FROM numbered WHERE capacity IS NOT NULL GROUP BY offer_id
+		), take AS (
+			SELECT
+				s.offer_id, s.shard,
+				LEAST(s.remaining, GREATEST(0, need.seats - (SUM(s.remaining) OVER w - s.remaining))) AS seats,
+				COUNT(*) OVER (PARTITION BY s.offer_id) AS shards
+			FROM offer_stock_shards s
+			JOIN need ON need.offer_id = s.offer_id
+			WINDOW w AS (PARTITION BY s.offer_id ORDER BY s.shard)
+		), debit AS (
+			UPDATE offer_stock_shards s SET remaining = s.remaining - take.seats
+			FROM take
+			WHERE s.offer_id = take.offer_id AND s.shard = take.shard AND take.seats > 0
+		), holds AS (
+			INSERT INTO seat_holds(order_id, offer_id, shard, seats, status)
+			SELECT n.order_id, n.offer_id, n.order_id %% t.shards, n.quantity, 'committed'
+			FROM numbered n
+			JOIN (SELECT DISTINCT offer_id, shards FROM take) AS t ON t.offer_id = n.offer_id
+		), stats AS ({record_from(
+			"SELECT offer_id, %(stats_shard)s, SUM(quantity), SUM(quantity * prix) FROM numbered GROUP BY offer_id"
+		)})
+		SELECT COUNT(*) FROM numbered
+	"""
+
+	def validate(self, record: dict) -> tuple:
+		user_id = _int(record, "user_id", minimum=1, required=False)
+		email = _text(record, "email", required=user_id is None)
+		return (
+			email,
+			user_id,
+			_int(record, "offer_id", minimum=1),
+			_int(record, "quantity", minimum=1, default=1),
+			secrets.token_hex(16),
+		)
+
+	def apply(self, cur) -> tuple:
+		cur.execute(self.RESOLVE_USERS_SQL)
+		cur.execute(self.REJECT_UNKNOWN_SQL)
+		rejected = cur.fetchall()
+		cur.execute(self.REJECT_SOLD_OUT_SQL)
+		rejected += cur.fetchall()
+		cur.execute(self.ISSUE_SQL, {"stats_shard": random_shard()})
+		return cur.fetchone()[0], rejected
+#----------------------------------------------------------------------------------------------------------------------#
+IMPORTERS = {"offers": OfferImport, "tickets": TicketImport}
+#----------------------------------------------------------------------------------------------------------------------#
+if __name__ == "__main__":
+	import argparse, sys
+	from db_pool import get_pool
+
+	parser = argparse.ArgumentParser(description="Import en masse d'offres ou de billets de groupe (CSV / NDJSON)")
+	parser.add_argument("kind", choices=sorted(IMPORTERS))
+	parser.add_argument("file", help="fichier à importer, - = entrée standard")
+	parser.add_argument("--format", choices=["csv", "ndjson"], help="défaut : selon l'extension (.ndjson/.jsonl)")
+	parser.add_argument("--chunk", type=int, default=BULK_IMPORT_CHUNK, help="lignes par transaction")
+	parser.add_argument("--errors", help="rapport d'erreurs ligne par ligne (NDJSON)")
+	args = parser.parse_args()
+
+	fmt = detect_format(args.file, args.format)
+	if args.file == "-":
+		stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+	else:
+		stream = open(args.file, encoding="utf-8-sig", newline="")
+	with stream, get_pool().connection() as conn:
+		report = IMPORTERS[args.kind]().run(conn, read_records(stream, fmt), args.chunk)
+
+	errors = report.pop("errors")
+	if args.errors:
+		with open(args.errors, "w", encoding="utf-8") as fichier:
+			for e in errors:
+				fichier.write(json.dumps(e, ensure_ascii=False) + "\n")
+	else:
+		for e in errors[:20]:
+			print(f"ligne {e['line']} : {e['error']}", file=sys.stderr)
+		if len(errors) > 20:
+			print(f"... {len(errors) - 20} autre(s) erreur(s) (--errors pour le rapport complet)", file=sys.stderr)
+	print(json.dumps(report))
+	if args.kind == "offers" and report["imported"]:
+		print("NB : catalogue en cache des workers rafraîchi sous CATALOG_CACHE_TTL", file=sys.stderr)
+	sys.exit(1 if errors else 0)
+#----------------------------------------------------------------------------------------------------------------------#
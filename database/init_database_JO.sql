@@ -16,8 +16,10 @@ CREATE TABLE IF NOT EXISTS offers (
 	id				SERIAL PRIMARY KEY,
 	name			TEXT NOT NULL,
 	nbr_ticket		INT	 NOT NULL,			-- nb de personnes incluses (1/2/4/...)
-	prix			INT	 NOT NULL			-- prix en euro
+	prix			INT	 NOT NULL,			-- prix en euro
+	capacity		INT						-- billets vendables (unité de orders.quantity), NULL = illimité
 );
+ALTER TABLE offers ADD COLUMN IF NOT EXISTS capacity INT;
 
 ------------- COMMANDE ------------
 CREATE TABLE IF NOT EXISTS orders (
@@ -38,8 +40,60 @@ CREATE TABLE IF NOT EXISTS payments (
 	status			TEXT NOT NULL,			-- success | failed | refunded (selon besoins)
 	key2			TEXT,
 	final_key		TEXT,
+	idempotency_key	TEXT,					-- clé du formulaire /pay (ou en-tête Idempotency-Key) : rejeu = même billet
+	used_at			TIMESTAMPTZ,			-- billet scanné à l'entrée (/gate/scan), NULL = pas encore utilisé
 	created_at		TIMESTAMPTZ DEFAULT NOW()
 );
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS used_at TIMESTAMPTZ;
+
+------------ STOCK (offres à capacité limitée) -------------
+-- stock restant réparti sur plusieurs lignes (shards) pour éviter une ligne "chaude" unique
+CREATE TABLE IF NOT EXISTS offer_stock_shards (
+	offer_id		INT NOT NULL REFERENCES offers(id) ON DELETE CASCADE,
+	shard			INT NOT NULL,
+	remaining		INT NOT NULL,
+	PRIMARY KEY (offer_id, shard),
+	CONSTRAINT offer_stock_shards_remaining_chk CHECK (remaining >= 0)
+);
+
+-- places bloquées par commande : held (panier) -> committed (payé) | released (annulé)
+CREATE TABLE IF NOT EXISTS seat_holds (
+	order_id		INT PRIMARY KEY REFERENCES orders(id) ON DELETE CASCADE,
+	offer_id		INT NOT NULL REFERENCES offers(id) ON DELETE CASCADE,
+	shard			INT NOT NULL,
+	seats			INT NOT NULL,
+	status			TEXT NOT NULL DEFAULT 'held',
+	created_at		TIMESTAMPTZ DEFAULT NOW(),
+	CONSTRAINT seat_holds_status_chk CHECK (status IN ('held','committed','released'))
+);
+
+------------ STATISTIQUES DE VENTES -------------
+-- maintenues dans la transaction de paiement / d'annulation (voir sales_stats.py)
+CREATE TABLE IF NOT EXISTS offer_sales_stats (
+	offer_id		INT NOT NULL REFERENCES offers(id) ON DELETE CASCADE,
+	shard			INT NOT NULL,
+	total_packs		BIGINT NOT NULL DEFAULT 0,
+	total_turnover	BIGINT NOT NULL DEFAULT 0,		-- en euros
+	PRIMARY KEY (offer_id, shard)
+);
+
+-- ventes des commandes archivées (partitions.py archive) : ajoutées aux commandes payées par
+-- sales_stats.py verify / rebuild
+CREATE TABLE IF NOT EXISTS offer_sales_archived (
+	offer_id		INT PRIMARY KEY REFERENCES offers(id) ON DELETE CASCADE,
+	total_packs		BIGINT NOT NULL DEFAULT 0,
+	total_turnover	BIGINT NOT NULL DEFAULT 0		-- en euros, au prix de l'offre lors de l'archivage
+);
+
+-- base existante : premier remplissage depuis les commandes déjà payées
+INSERT INTO offer_sales_stats(offer_id, shard, total_packs, total_turnover)
+SELECT o.offer_id, 0, SUM(o.quantity), SUM(o.quantity * of.prix)
+FROM orders o
+JOIN offers of ON of.id = o.offer_id
+WHERE o.status = 'paid'
+  AND NOT EXISTS (SELECT 1 FROM offer_sales_stats)
+GROUP BY o.offer_id;
 
 ------------ INDEX/CONTRAINTES -------------
 -- 1 seul panier 'draft' par utilisateur
@@ -48,15 +102,33 @@ CREATE TABLE IF NOT EXISTS payments (
 --WHERE status = 'draft';
 
 -- éviter plusieurs paiements 'success' pour la même commande
-CREATE UNIQUE INDEX IF NOT EXISTS payments_one_success_per_order
-ON payments(order_id)
-WHERE status = 'success';
+-- + contrôle d'un billet par sa clé finale (clé aléatoire : unique)
+-- base partitionnée (partitions.py) : index non uniques de même nom, unicité portée par les tables
+-- payment_success_orders / payment_final_keys (triggers créés par la migration) -> rien à faire ici
+DO $$
+BEGIN
+	IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('payments')) THEN
+		CREATE UNIQUE INDEX IF NOT EXISTS payments_one_success_per_order
+		ON payments(order_id)
+		WHERE status = 'success';
+		CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_final_key ON payments(final_key);
+	END IF;
+END $$;
 
--- Index pratiques
+-- Index pratiques (clés étrangères : suppression en cascade d'un utilisateur, suppression d'une offre)
 CREATE INDEX IF NOT EXISTS idx_orders_user	  ON orders(user_id);
 CREATE INDEX IF NOT EXISTS idx_orders_offer	  ON orders(offer_id);
 CREATE INDEX IF NOT EXISTS idx_payments_order ON payments(order_id);
 
+-- Index des requêtes chaudes (plans vérifiés par tools/explain_check.py)
+-- panier d'un utilisateur (/my/orders) + annulation de ses anciens paniers (/offers/validate, /auth/login)
+CREATE INDEX IF NOT EXISTS idx_orders_user_draft ON orders(user_id, id) WHERE status = 'draft';
+-- billets payés d'un utilisateur (/my/orders)
+CREATE INDEX IF NOT EXISTS idx_orders_user_paid	 ON orders(user_id, id) WHERE status = 'paid';
+-- pagination par curseur de /admin/orders : WHERE status = ? AND id > ? ORDER BY id
+CREATE INDEX IF NOT EXISTS idx_orders_status_id	 ON orders(status, id);
+CREATE INDEX IF NOT EXISTS idx_seat_holds_offer ON seat_holds(offer_id) WHERE status <> 'released';
+
 ------------- DONNEES ORGANISATEUR --------- 
 INSERT INTO offers(name, nbr_ticket, prix)
 SELECT 'Solo', 1, 50
@@ -0,0 +1,204 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Accès base "async" pour les routes chaudes (/offers, /offers/validate, /my/orders, /pay, /payments/confirm, /auth/login)
+#
+# DB_MODE=sync  (défaut) : psycopg2 + pool de db_pool.py, chaque requête SQL part dans le thread pool anyio
+#                          (comportement historique : ~40 requêtes en vol par processus)
+# DB_MODE=async          : psycopg 3 (AsyncConnection) + son propre AsyncConnectionPool, aucune attente bloquante
+#
+# Les deux modes exposent la même interface, ce qui permet de les comparer avec le même code de routes :
+#	async with get_async_connection() as conn:
+#		row = await conn.fetchone("SELECT ... WHERE id=%s", (id,))
+# Lecture pure : get_async_connection(readonly=True) -> réplica si DATABASE_REPLICA_URLS (voir replicas.py)
+#----------------------------------------------------------------------------------------------------------------------#
+import contextlib, os, time
+from contextlib import asynccontextmanager
+import psycopg2
+import psycopg2.extras
+from starlette.concurrency import run_in_threadpool
+import metrics
+from db_pool import (
+	DATABASE_URL, DATABASE_SSLMODE, DB_POOL_TIMEOUT, DB_POOL_MAX_LIFETIME, PoolTimeout, connection_lost, get_pool,
+)
+from replicas import REPLICA_POOL_TIMEOUT, replica_set
+
+try:
+	import psycopg
+	from psycopg.rows import dict_row, tuple_row
+	import psycopg_pool
+except ImportError:		# psycopg 3 n'est nécessaire qu'en DB_MODE=async
+	psycopg = None
+#----------------------------------------------------------------------------------------------------------------------#
+DB_MODE = os.getenv("DB_MODE", "sync").lower()				# sync | async
+DB_ASYNC_POOL_MIN = int(os.getenv("DB_ASYNC_POOL_MIN", "2"))
+DB_ASYNC_POOL_MAX = int(os.getenv("DB_ASYNC_POOL_MAX", "20"))
+#----------------------------------------------------------------------------------------------------------------------#
+class _ThreadedConnection:
+	"""Mode sync : connexion psycopg2 du pool, chaque appel est exécuté dans le thread pool."""
+
+	def __init__(self, conn):
+		self._conn = conn
+
+	def _run(self, sql, params, fetch, as_dict):
+		factory = psycopg2.extras.RealDictCursor if as_dict else None
+		with self._conn.cursor(cursor_factory=factory) as cur:
+			cur.execute(sql, params)
+			if fetch == "one":
+				return cur.fetchone()
+			if fetch == "all":
+				return cur.fetchall()
+			return cur.rowcount
+
+	async def execute(self, sql: str, params=None) -> int:
+		return await run_in_threadpool(self._run, sql, params, None, False)
+
+	async def fetchone(self, sql: str, params=None, as_dict: bool = True):
+		return await run_in_threadpool(self._run, sql, params, "one", as_dict)
+
+	async def fetchall(self, sql: str, params=None, as_dict: bool = True):
+		return await run_in_threadpool(self._run, sql, params, "all", as_dict)
+#----------------------------------------------------------------------------------------------------------------------#
+class _AsyncConnection:
+	"""Mode async : connexion psycopg 3 non bloquante."""
+
+	def __init__(self, conn):
+		self._conn = conn
+
+	async def _run(self, sql, params, fetch, as_dict):
+		async with self._conn.cursor(row_factory=dict_row if as_dict else tuple_row) as cur:
+			if metrics.METRICS_ENABLED:
+				# même chronométrage que les curseurs psycopg2 du pool (metrics.TimedConnection)
+				started = time.perf_counter()
+				try:
+					await cur.execute(sql, params)
+				except BaseException:
+					metrics.observe_query(sql, time.perf_counter() - started, 0, True, sql, params)
+					raise
+				metrics.observe_query(sql, time.perf_counter() - started, cur.rowcount, False, sql, params)
+			else:
+				await cur.execute(sql, params)
+			if fetch == "one":
+				return await cur.fetchone()
+			if fetch == "all":
+				return await cur.fetchall()
+			return cur.rowcount
+
+	async def execute(self, sql: str, params=None) -> int:
+		return await self._run(sql, params, None, False)
+
+	async def fetchone(self, sql: str, params=None, as_dict: bool = True):
+		return await self._run(sql, params, "one", as_dict)
+
+	async def fetchall(self, sql: str, params=None, as_dict: bool = True):
+		return await self._run(sql, params, "all", as_dict)
+#----------------------------------------------------------------------------------------------------------------------#
+_async_pool = None
+
+def _new_async_pool(dsn: str, name: str, timeout: float = DB_POOL_TIMEOUT):
+	if psycopg is None:
+		raise RuntimeError("DB_MODE=async nécessite psycopg[binary,pool] (voir requirements.txt)")
+	return psycopg_pool.AsyncConnectionPool(
+		dsn,
+		kwargs={"sslmode": DATABASE_SSLMODE},
+		min_size=DB_ASYNC_POOL_MIN,
+		max_size=max(DB_ASYNC_POOL_MIN, DB_ASYNC_POOL_MAX),
+		timeout=timeout,
+		max_lifetime=DB_POOL_MAX_LIFETIME,
+		check=psycopg_pool.AsyncConnectionPool.check_connection,
+		name=name,
+		open=False,
+	)
+
+async def open_async_pool():
+	"""Ouvre le pool psycopg 3 (au démarrage de l'application, en DB_MODE=async uniquement)."""
+	global _async_pool
+	if DB_MODE != "async" or _async_pool is not None:
+		return
+	_async_pool = _new_async_pool(DATABASE_URL, "async")
+	await _async_pool.open(wait=False)
+
+async def close_async_pool():
+	global _async_pool
+	if _async_pool is not None:
+		await _async_pool.close()
+		_async_pool = None
+	for replica in replica_set.replicas:
+		if replica.async_pool is not None:
+			await replica.async_pool.close()
+			replica.async_pool = None
+#----------------------------------------------------------------------------------------------------------------------#
+async def _getconn_async(pool):
+	started = time.perf_counter()
+	conn = await pool.getconn()
+	if metrics.METRICS_ENABLED:
+		metrics.observe_acquire(pool.name, time.perf_counter() - started)
+	return conn
+
+async def _acquire_async(replica):
+	"""(pool, connexion) : sur le réplica choisi, ou le serveur principal s'il n'y en a pas / s'il ne répond pas."""
+	if replica is not None:
+		if replica.async_pool is None:
+			replica.async_pool = _new_async_pool(replica.dsn, replica.name, REPLICA_POOL_TIMEOUT)
+			await replica.async_pool.open(wait=False)
+		try:
+			return replica.async_pool, await _getconn_async(replica.async_pool)
+		except (psycopg_pool.PoolTimeout, psycopg.OperationalError) as e:
+			replica.mark_down(e)
+			replica_set.fallbacks += 1
+	if _async_pool is None:
+		await open_async_pool()
+	try:
+		return _async_pool, await _getconn_async(_async_pool)
+	except psycopg_pool.PoolTimeout as e:
+		raise PoolTimeout(str(e)) from e
+
+async def _acquire_sync(replica):
+	if replica is not None:
+		try:
+			return replica.pool, await run_in_threadpool(replica.pool.getconn)
+		except (psycopg2.OperationalError, PoolTimeout) as e:
+			replica.mark_down(e)
+			replica_set.fallbacks += 1
+	pool = get_pool()
+	return pool, await run_in_threadpool(pool.getconn)
+#----------------------------------------------------------------------------------------------------------------------#
+@asynccontextmanager
+async def get_async_connection(readonly: bool = False):
+	"""Une transaction : commit à la sortie du bloc, rollback si exception.
+
+	readonly=True : lecture pure, servie par un réplica sain s'il y en a (voir replicas.py)."""
+	replica = replica_set.choose() if readonly else None
+	if DB_MODE == "async":
+		pool, conn = await _acquire_async(replica)
+		try:
+			yield _AsyncConnection(conn)
+			await conn.commit()
+		except BaseException:
+			with contextlib.suppress(Exception):
+				await conn.rollback()
+			raise
+		finally:
+			await pool.putconn(conn)		# connexion cassée : le pool psycopg 3 la remplace
+		return
+	#------------------------------------------------------------------------------#
+	pool, item = await _acquire_sync(replica)
+	discard = False
+	try:
+		yield _ThreadedConnection(item.conn)
+		await run_in_threadpool(item.conn.commit)
+	except BaseException as e:
+		discard = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)) and connection_lost(item.conn, e)
+		if discard and pool is not get_pool():
+			replica.mark_down(e)		# réplica tombé entre deux contrôles : lectures suivantes sur le principal
+		try:
+			await run_in_threadpool(item.conn.rollback)
+		except Exception:
+			discard = True
+		raise
+	finally:
+		pool.putconn(item, discard)
+#----------------------------------------------------------------------------------------------------------------------#
+def async_pool_stats() -> dict | None:
+	if _async_pool is None:
+		return None
+	return _async_pool.get_stats()
+#----------------------------------------------------------------------------------------------------------------------#
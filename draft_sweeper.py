@@ -0,0 +1,145 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Expiration des paniers abandonnés (commandes 'draft' plus vieilles que DRAFT_TTL)
+#
+# - tâche de fond du processus web (toutes les DRAFT_SWEEP_INTERVAL s, 0 = désactivée) et CLI
+# - par lots de DRAFT_SWEEP_BATCH commandes, une transaction courte par lot : FOR UPDATE SKIP LOCKED saute les
+#   paniers en cours de paiement / d'annulation (et les lots des autres workers), pause DRAFT_SWEEP_PAUSE entre
+#   deux lots pour laisser passer le trafic
+# - les places bloquées des paniers expirés sont rendues au stock (seat_holds -> released)
+#
+# CLI : python draft_sweeper.py [--ttl 1800] [--batch 500] [--pause 0.05] [--loop]
+#----------------------------------------------------------------------------------------------------------------------#
+import asyncio, os, time
+from db_async import get_async_connection
+from reservations import release_canceled_cte
+#----------------------------------------------------------------------------------------------------------------------#
+DRAFT_TTL = int(os.getenv("DRAFT_TTL", "1800"))							# secondes
+DRAFT_SWEEP_INTERVAL = float(os.getenv("DRAFT_SWEEP_INTERVAL", "60"))	# secondes, 0 = pas de tâche de fond
+DRAFT_SWEEP_BATCH = int(os.getenv("DRAFT_SWEEP_BATCH", "500"))
+DRAFT_SWEEP_PAUSE = float(os.getenv("DRAFT_SWEEP_PAUSE", "0.05"))		# secondes entre deux lots
+DRAFT_SWEEP_LOCK_TIMEOUT = os.getenv("DRAFT_SWEEP_LOCK_TIMEOUT", "2s")	# attente max d'un shard de stock
+#----------------------------------------------------------------------------------------------------------------------#
+# Les plus anciens paniers d'abord : parcours de idx_orders_status_id dans l'ordre des id (croissants avec
+# created_at), arrêt dès que le lot est plein ; jointure sur (id, created_at) = clé primaire d'une table partitionnée
+# (partitions.py) : une seule partition sondée par panier
+EXPIRE_BATCH_SQL = f"""
+	WITH expired AS (
+		SELECT id, created_at FROM orders
+		WHERE status = 'draft' AND created_at < NOW() - make_interval(secs => %(ttl)s)
+		ORDER BY id
+		LIMIT %(batch)s
+		FOR UPDATE SKIP LOCKED
+	), canceled AS (
+		UPDATE orders SET status='canceled' FROM expired
+		WHERE orders.id = expired.id AND orders.created_at = expired.created_at
+		RETURNING orders.id
+	), {release_canceled_cte()}
+	SELECT
+		(SELECT COUNT(*) FROM canceled) AS expired,
+		(SELECT COALESCE(SUM(seats), 0) FROM drafts_released) AS seats
+"""
+#----------------------------------------------------------------------------------------------------------------------#
+class DraftSweeper:
+	def __init__(self, ttl: int = DRAFT_TTL, batch: int = DRAFT_SWEEP_BATCH, pause: float = DRAFT_SWEEP_PAUSE):
+		self.ttl = ttl
+		self.batch = max(1, batch)
+		self.pause = pause
+		self._task = None
+		#------------------------------------------------------------------------------#
+		self.runs = 0
+		self.errors = 0
+		self.last_run = None
+	#------------------------------------------------------------------------------#
+	async def _expire_batch(self) -> tuple:
+		async with get_async_connection() as conn:
+			await conn.execute(f"SET LOCAL lock_timeout = '{DRAFT_SWEEP_LOCK_TIMEOUT}'")
+			row = await conn.fetchone(EXPIRE_BATCH_SQL, {"ttl": self.ttl, "batch": self.batch})
+		return int(row["expired"]), int(row["seats"])
+	#------------------------------------------------------------------------------#
+	async def run_once(self) -> dict:
+		"""Un passage complet (lots successifs jusqu'à un lot incomplet) -> compteurs du passage."""
+		started = time.monotonic()
+		expired = seats = batches = 0
+		while True:
+			count, released = await self._expire_batch()
+			expired += count
+			seats += released
+			batches += 1
+			if count < self.batch:
+				break
+			await asyncio.sleep(self.pause)
+		#------------------------------------------------------------------------------#
+		self.runs += 1
+		self.last_run = {
+			"expired": expired,
+			"seats_released": seats,
+			"batches": batches,
+			"seconds": round(time.monotonic() - started, 3),
+			"at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		}
+		return self.last_run
+	#------------------------------------------------------------------------------#
+	async def _loop(self, interval: float):
+		while True:
+			try:
+				result = await self.run_once()
+				if result["expired"]:
+					print(f"[draft_sweeper] {result}")
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				# base indisponible, lock_timeout... : on réessaie au prochain intervalle
+				self.errors += 1
+				print(f"[draft_sweeper] passage interrompu : {e}")
+			await asyncio.sleep(interval)
+	#------------------------------------------------------------------------------#
+	def start(self, interval: float = DRAFT_SWEEP_INTERVAL):
+		if interval > 0 and self._task is None:
+			self._task = asyncio.get_running_loop().create_task(self._loop(interval))
+	#------------------------------------------------------------------------------#
+	async def stop(self):
+		task, self._task = self._task, None
+		if task is not None:
+			task.cancel()
+			try:
+				await task
+			except asyncio.CancelledError:
+				pass
+	#------------------------------------------------------------------------------#
+	def stats(self) -> dict:
+		return {
+			"ttl_s": self.ttl,
+			"batch": self.batch,
+			"running": self._task is not None,
+			"runs": self.runs,
+			"errors": self.errors,
+			"last_run": self.last_run,
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+draft_sweeper = DraftSweeper()
+#----------------------------------------------------------------------------------------------------------------------#
+if __name__ == "__main__":
+	import argparse, json
+	from db_async import open_async_pool, close_async_pool
+
+	parser = argparse.ArgumentParser(description="Expiration des paniers abandonnés")
+	parser.add_argument("--ttl", type=int, default=DRAFT_TTL, help="âge maximal d'un panier (s)")
+	parser.add_argument("--batch", type=int, default=DRAFT_SWEEP_BATCH)
+	parser.add_argument("--pause", type=float, default=DRAFT_SWEEP_PAUSE, help="pause entre deux lots (s)")
+	parser.add_argument("--loop", action="store_true", help=f"recommencer toutes les {DRAFT_SWEEP_INTERVAL:g} s")
+	args = parser.parse_args()
+
+	async def main():
+		await open_async_pool()
+		sweeper = DraftSweeper(args.ttl, args.batch, args.pause)
+		try:
+			while True:
+				print(json.dumps(await sweeper.run_once()), flush=True)
+				if not args.loop:
+					break
+				await asyncio.sleep(DRAFT_SWEEP_INTERVAL)
+		finally:
+			await close_async_pool()
+
+	asyncio.run(main())
+#----------------------------------------------------------------------------------------------------------------------#
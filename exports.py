@@ -0,0 +1,77 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Export des commandes en flux (CSV / NDJSON, gzip optionnel) : /admin/orders/export
+#
+# - curseur serveur nommé (DECLARE ... CURSOR) : Postgres envoie les lignes par paquets de EXPORT_FETCH_SIZE,
+#   jamais tout le résultat d'un coup ; tuples simples (pas de RealDictCursor)
+# - sortie par blocs d'environ EXPORT_CHUNK_BYTES, compressés au fil de l'eau si gzip demandé
+# -> mémoire du worker constante quel que soit le nombre de lignes (mesure : python bench/bench_export.py)
+#
+# La connexion reste empruntée au pool pendant tout le téléchargement (une transaction de lecture).
+#----------------------------------------------------------------------------------------------------------------------#
+import csv, io, json, os, zlib
+from db_pool import get_pool
+import queries
+#----------------------------------------------------------------------------------------------------------------------#
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "5000"))			# lignes par aller-retour du curseur
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", "65536"))		# taille des blocs envoyés au client
+
+ORDER_COLUMNS = (
+	"order_id", "status", "created_at", "email", "offer_id", "offer_name",
+	"nbr_ticket", "quantity", "prix", "total", "final_key",
+)
+#----------------------------------------------------------------------------------------------------------------------#
+def _csv_chunks(rows):
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	writer.writerow(ORDER_COLUMNS)
+	for row in rows:
+		writer.writerow(row)
+		if buffer.tell() >= EXPORT_CHUNK_BYTES:
+			yield buffer.getvalue().encode()
+			buffer.seek(0)
+			buffer.truncate()
+	yield buffer.getvalue().encode()
+
+def _ndjson_chunks(rows):
+	lines = []
+	size = 0
+	for row in rows:
+		record = dict(zip(ORDER_COLUMNS, row))
+		record["created_at"] = record["created_at"].isoformat() if record["created_at"] else None
+		line = json.dumps(record, ensure_ascii=False)
+		lines.append(line)
+		size += len(line) + 1
+		if size >= EXPORT_CHUNK_BYTES:
+			yield ("\n".join(lines) + "\n").encode()
+			lines.clear()
+			size = 0
+	if lines:
+		yield ("\n".join(lines) + "\n").encode()
+
+FORMATS = {
+	"csv": (_csv_chunks, "text/csv; charset=utf-8"),
+	"ndjson": (_ndjson_chunks, "application/x-ndjson"),
+}
+#----------------------------------------------------------------------------------------------------------------------#
+def _gzip(chunks):
+	compressor = zlib.compressobj(6, zlib.DEFLATED, 31)		# wbits 31 = format gzip
+	for chunk in chunks:
+		data = compressor.compress(chunk)
+		if data:
+			yield data
+	yield compressor.flush()
+#----------------------------------------------------------------------------------------------------------------------#
+def export_orders(status: str, condition: str, params: list, fmt: str = "csv", gzip: bool = False):
+	"""Générateur d'octets de l'export ; le premier élément (b"") est produit une fois la connexion obtenue.
+
+	L'appelant l'avance d'un cran avant de répondre : PoolTimeout (503) est levée avant l'envoi des en-têtes.
+	"""
+	encode, _ = FORMATS[fmt]
+	with get_pool().connection() as conn:
+		yield b""
+		with conn.cursor(name="orders_export") as cur:
+			cur.itersize = EXPORT_FETCH_SIZE
+			cur.execute(queries.EXPORT_ORDERS_SQL.format(condition=condition), (status, *params))
+			chunks = encode(cur)
+			yield from _gzip(chunks) if gzip else chunks
+#----------------------------------------------------------------------------------------------------------------------#
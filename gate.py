@@ -0,0 +1,454 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Contrôle des billets à l'entrée du site (scan de payments.final_key)
+#
+# - POST /gate/scan : vérifie le billet et le marque utilisé (payments.used_at) en une requête atomique ;
+#   deux scans simultanés du même billet -> un seul "ok", l'autre "used"
+# - filtre de Bloom en mémoire des clés émises (GATE_FILTER_BITS_PER_KEY bits par clé, ~1 % de faux positifs) :
+#   une clé absente du filtre (billets inventés, QR mal lus) est rejetée après une seule lecture d'index, le dernier
+#   id de paiement ; s'il est plus récent que le filtre, rafraîchi en incrémental toutes les GATE_FILTER_REFRESH s,
+#   le billet a pu être payé sur un autre worker entre-temps : contrôle complet en base
+# - instantané hors ligne : fichier trié d'empreintes (blake2b 128 bits, pas les clés elles-mêmes) ouvert en
+#   mmap, recherche dichotomique. Si la base est injoignable, /gate/scan continue sur l'instantané GATE_SNAPSHOT
+#   et journalise les scans (GATE_JOURNAL, fichier partagé par les workers sous flock : un billet n'est accepté
+#   qu'une fois) ; "python gate.py sync" les reporte en base au retour. En attendant, le scan en ligne relit le
+#   journal : un billet passé hors ligne est marqué utilisé en base (heure du journal) avant d'être contrôlé
+#
+# CLI : python gate.py snapshot billets.gate		-> instantané des billets valides
+#       python gate.py check billets.gate <clé>	-> contrôle hors ligne d'une clé
+#       python gate.py sync gate_journal.ndjson	-> report des scans hors ligne
+# Benchmark : python bench/bench_gate.py
+#----------------------------------------------------------------------------------------------------------------------#
+import asyncio, bisect, datetime, fcntl, hashlib, json, mmap, os, re, struct, threading, time
+import psycopg2
+from starlette.concurrency import run_in_threadpool
+from db_async import get_async_connection
+from db_pool import PoolTimeout, get_pool
+
+try:
+	import psycopg
+except ImportError:		# psycopg 3 n'est nécessaire qu'en DB_MODE=async
+	psycopg = None
+#----------------------------------------------------------------------------------------------------------------------#
+GATE_TOKEN = os.getenv("GATE_TOKEN", "")									# en-tête X-Gate-Token exigé si défini
+GATE_FILTER_REFRESH = float(os.getenv("GATE_FILTER_REFRESH", "5"))			# secondes, 0 = pas de filtre
+GATE_FILTER_BITS_PER_KEY = int(os.getenv("GATE_FILTER_BITS_PER_KEY", "10"))
+GATE_FILTER_OVERLAP = int(os.getenv("GATE_FILTER_OVERLAP", "10000"))		# ids relus (transactions validées en retard)
+GATE_SNAPSHOT = os.getenv("GATE_SNAPSHOT", "")								# instantané du mode hors ligne
+GATE_JOURNAL = os.getenv("GATE_JOURNAL", "gate_journal.ndjson")
+
+FINAL_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Base injoignable ou pool saturé -> instantané hors ligne ; toute autre erreur (requête, bug) remonte
+DB_UNAVAILABLE = (PoolTimeout, psycopg2.OperationalError, psycopg2.InterfaceError)
+if psycopg is not None:
+	DB_UNAVAILABLE += (psycopg.OperationalError, psycopg.InterfaceError)
+
+SNAPSHOT_MAGIC = b"JOGATE01"
+SNAPSHOT_HEADER = struct.Struct("<8sQd")		# magic, nombre de billets, date de génération (epoch)
+SNAPSHOT_RECORD = struct.Struct("<16sIHBx")		# empreinte, order_id, personnes, déjà utilisé
+#----------------------------------------------------------------------------------------------------------------------#
+# Billet + marquage : l'UPDATE ne touche que les billets payés non utilisés ; en cas de scan concurrent, le
+# second attend le verrou de ligne puis ne trouve plus used_at IS NULL -> scanned_at NULL
+SCAN_SQL = """
+	WITH ticket AS (
+		SELECT p.order_id, p.used_at, o.status, o.quantity, of.name, of.nbr_ticket
+		FROM payments p
+		JOIN orders o ON o.id = p.order_id
+		JOIN offers of ON of.id = o.offer_id
+		WHERE p.final_key = %(final_key)s AND p.status = 'success'
+	), used AS (
+		UPDATE payments p SET used_at = NOW()
+		FROM ticket
+		WHERE p.final_key = %(final_key)s AND p.status = 'success' AND p.used_at IS NULL AND ticket.status = 'paid'
+		RETURNING p.used_at
+	)
+	SELECT ticket.*, (SELECT used_at FROM used) AS scanned_at FROM ticket
+"""
+
+FINAL_KEYS_SINCE_SQL = "SELECT id, final_key FROM payments WHERE id > %s AND status = 'success'"
+
+# Dernier paiement émis (fin de l'index de la clé primaire) : le filtre est-il à jour ?
+NEWEST_PAYMENT_SQL = "SELECT MAX(id) FROM payments WHERE status = 'success'"
+
+SNAPSHOT_SQL = """
+	SELECT p.final_key, p.order_id, o.quantity * of.nbr_ticket, p.used_at IS NOT NULL
+	FROM payments p
+	JOIN orders o ON o.id = p.order_id
+	JOIN offers of ON of.id = o.offer_id
+	WHERE p.status = 'success' AND o.status = 'paid'
+"""
+
+SYNC_SQL = """
+	UPDATE payments p SET used_at = COALESCE(p.used_at, j.used_at::timestamptz)
+	FROM (VALUES %s) AS j(final_key, used_at)
+	WHERE p.final_key = j.final_key AND p.status = 'success'
+"""
+
+SYNC_ONE_SQL = """
+	UPDATE payments SET used_at = COALESCE(used_at, %(used_at)s::timestamptz)
+	WHERE final_key = %(final_key)s AND status = 'success'
+"""
+#----------------------------------------------------------------------------------------------------------------------#
+def digest(final_key: str) -> bytes:
+	return hashlib.blake2b(final_key.encode(), digest_size=16).digest()
+#----------------------------------------------------------------------------------------------------------------------#
+class BloomFilter:
+	"""Filtre de Bloom (double hachage sur l'empreinte de la clé) : pas de faux négatif."""
+
+	def __init__(self, capacity: int, bits_per_key: int = GATE_FILTER_BITS_PER_KEY):
+		self.capacity = max(1024, capacity)
+		self.size = self.capacity * max(1, bits_per_key)
+		self.hashes = max(1, round(bits_per_key * 0.693))		# k optimal = bits par clé x ln 2
+		self.bits = bytearray((self.size + 7) // 8)
+		self.count = 0
+
+	def _positions(self, key: str):
+		d = digest(key)
+		h1 = int.from_bytes(d[:8], "little")
+		h2 = int.from_bytes(d[8:], "little") | 1
+		return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+	def add(self, key: str, count: bool = True):
+		for p in self._positions(key):
+			self.bits[p >> 3] |= 1 << (p & 7)
+		self.count += count
+
+	def __contains__(self, key: str) -> bool:
+		bits = self.bits
+		return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+#----------------------------------------------------------------------------------------------------------------------#
+class TicketFilter:
+	"""Filtre des clés émises, reconstruit au démarrage puis complété par les nouveaux paiements."""
+
+	def __init__(self, bits_per_key: int = GATE_FILTER_BITS_PER_KEY, overlap: int = GATE_FILTER_OVERLAP):
+		self.bits_per_key = bits_per_key
+		self.overlap = overlap
+		self._bloom = None			# None = pas encore chargé : toutes les clés vont en base
+		self._max_id = 0
+		self._lock = threading.Lock()
+		self._task = None
+		#------------------------------------------------------------------------------#
+		self.rejected = 0
+		self.stale_misses = 0		# clés absentes d'un filtre en retard sur les paiements : contrôlées en base
+		self.refreshes = 0
+		self.errors = 0
+		self.last_refresh = None
+	#------------------------------------------------------------------------------#
+	def might_contain(self, final_key: str) -> bool:
+		bloom = self._bloom
+		return bloom is None or final_key in bloom
+	#------------------------------------------------------------------------------#
+	def covers(self, newest_id: int | None) -> bool:
+		"""Le filtre contient les clés de tous les paiements jusqu'à `newest_id` : une clé absente est inconnue."""
+		return newest_id is None or newest_id <= self._max_id
+	#------------------------------------------------------------------------------#
+	def add(self, final_key: str):
+		"""Billet émis par ce processus (/payments/confirm) : visible tout de suite."""
+		with self._lock:
+			if self._bloom is not None:
+				self._bloom.add(final_key)
+	#------------------------------------------------------------------------------#
+	def _load_all(self, conn):
+		# premier chargement ou filtre saturé : nouveau filtre deux fois plus grand que nécessaire, puis bascule
+		with conn.cursor() as cur:
+			cur.execute("SELECT COUNT(*) FROM payments WHERE status = 'success'")
+			bloom = BloomFilter(2 * cur.fetchone()[0] + 100000, self.bits_per_key)
+		max_id = 0
+		with conn.cursor(name="gate_filter") as cur:
+			cur.itersize = 50000
+			cur.execute(FINAL_KEYS_SINCE_SQL, (0,))
+			for payment_id, final_key in cur:
+				bloom.add(final_key)
+				max_id = max(max_id, payment_id)
+		with self._lock:
+			self._bloom, self._max_id = bloom, max_id
+	#------------------------------------------------------------------------------#
+	def refresh(self):
+		"""Ajoute les clés des paiements d'id > dernier id vu - overlap (commits tardifs), reconstruit si plein."""
+		started = time.monotonic()
+		with get_pool().connection() as conn:
+			bloom = self._bloom
+			if bloom is None:
+				self._load_all(conn)
+			else:
+				with conn.cursor() as cur:
+					cur.execute(FINAL_KEYS_SINCE_SQL, (max(0, self._max_id - self.overlap),))
+					rows = cur.fetchall()
+				if bloom.count + len(rows) > bloom.capacity:
+					self._load_all(conn)
+				else:
+					with self._lock:
+						for payment_id, final_key in rows:
+							if payment_id > self._max_id:
+								bloom.add(final_key)
+								self._max_id = payment_id
+							else:
+								bloom.add(final_key, count=False)		# déjà vu ou validé en retard
+		self.refreshes += 1
+		self.last_refresh = {
+			"keys": self._bloom.count,
+			"max_id": self._max_id,
+			"seconds": round(time.monotonic() - started, 3),
+			"at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		}
+	#------------------------------------------------------------------------------#
+	async def _loop(self, interval: float):
+		while True:
+			try:
+				await run_in_threadpool(self.refresh)
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				# base indisponible : on garde le filtre courant
+				self.errors += 1
+				print(f"[gate] rafraîchissement du filtre impossible : {e}")
+			await asyncio.sleep(interval)
+	#------------------------------------------------------------------------------#
+	def start(self, interval: float = GATE_FILTER_REFRESH):
+		if interval > 0 and self._task is None:
+			self._task = asyncio.get_running_loop().create_task(self._loop(interval))
+	#------------------------------------------------------------------------------#
+	async def stop(self):
+		task, self._task = self._task, None
+		if task is not None:
+			task.cancel()
+			try:
+				await task
+			except asyncio.CancelledError:
+				pass
+	#------------------------------------------------------------------------------#
+	def stats(self) -> dict:
+		bloom = self._bloom
+		return {
+			"running": self._task is not None,
+			"keys": bloom.count if bloom else None,
+			"capacity": bloom.capacity if bloom else None,
+			"size_kb": len(bloom.bits) // 1024 if bloom else None,
+			"rejected": self.rejected,
+			"stale_misses": self.stale_misses,
+			"refreshes": self.refreshes,
+			"errors": self.errors,
+			"last_refresh": self.last_refresh,
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+def write_snapshot(rows, path: str) -> int:
+	"""Instantané des billets (final_key, order_id, personnes, utilisé) ; écrit sous un nom temporaire puis renommé."""
+	records = []
+	for final_key, order_id, persons, used in rows:
+		records.append(SNAPSHOT_RECORD.pack(digest(final_key), order_id, min(persons or 0, 0xFFFF), used))
+	records.sort()		# l'empreinte est en tête de l'enregistrement : tri = tri par empreinte
+	with open(path + ".tmp", "wb") as f:
+		f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(records), time.time()))
+		f.writelines(records)
+	os.replace(path + ".tmp", path)
+	return len(records)
+#----------------------------------------------------------------------------------------------------------------------#
+class Snapshot:
+	"""Instantané ouvert en mmap : recherche dichotomique, O(log n) lectures de 16 octets, rien n'est chargé."""
+
+	class _Digests:
+		# séquence des empreintes pour bisect (lecture directe dans le mmap)
+		def __init__(self, mm, count):
+			self.mm, self.count = mm, count
+
+		def __len__(self):
+			return self.count
+
+		def __getitem__(self, i):
+			offset = SNAPSHOT_HEADER.size + i * SNAPSHOT_RECORD.size
+			return self.mm[offset:offset + 16]
+
+	def __init__(self, path: str):
+		self.path = path
+		with open(path, "rb") as f:
+			self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, self.count, self.generated_at = SNAPSHOT_HEADER.unpack_from(self._mm, 0)
+		if magic != SNAPSHOT_MAGIC:
+			raise ValueError(f"{path} : pas un instantané de billets")
+		self._digests = self._Digests(self._mm, self.count)
+
+	def lookup(self, final_key: str):
+		"""(order_id, personnes, déjà utilisé) ou None."""
+		d = digest(final_key)
+		i = bisect.bisect_left(self._digests, d)
+		if i < self.count and self._digests[i] == d:
+			_, order_id, persons, used = SNAPSHOT_RECORD.unpack_from(self._mm, SNAPSHOT_HEADER.size + i * SNAPSHOT_RECORD.size)
+			return order_id, persons, bool(used)
+		return None
+
+	def close(self):
+		self._mm.close()
+#----------------------------------------------------------------------------------------------------------------------#
+class ScanJournal:
+	"""Journal (NDJSON) des scans hors ligne : billet -> heure du passage, pour "gate.py sync" et le retour en ligne.
+
+	Le journal est partagé par les workers : sous verrou exclusif du fichier (flock), chaque scan relit d'abord les
+	lignes ajoutées par les autres depuis sa dernière lecture, puis ajoute la sienne -> un billet n'est accepté
+	qu'une fois hors ligne, quel que soit le worker.
+	"""
+
+	def __init__(self, path: str):
+		self.path = path
+		self._used = {}
+		self._file = None			# (device, inode) du fichier lu : journal remplacé -> relu depuis le début
+		self._offset = 0			# octets du journal déjà lus
+		self._lock = threading.Lock()
+
+	def _catch_up(self, f):
+		st = os.fstat(f.fileno())
+		if (st.st_dev, st.st_ino) != self._file or st.st_size < self._offset:
+			self._file, self._offset = (st.st_dev, st.st_ino), 0
+		f.seek(self._offset)
+		data = f.read()
+		self._offset += len(data)
+		for line in data.splitlines():
+			if line.strip():
+				scan = json.loads(line)
+				self._used.setdefault(scan["final_key"], scan["used_at"])
+
+	def behind(self) -> bool:
+		"""Le journal a changé depuis la dernière lecture (un simple stat, sans verrou)."""
+		try:
+			st = os.stat(self.path)
+		except FileNotFoundError:
+			return False
+		return (st.st_dev, st.st_ino) != self._file or st.st_size != self._offset
+
+	def catch_up(self):
+		"""Relit les lignes ajoutées par les autres workers (verrou partagé : jamais une ligne à moitié écrite)."""
+		with self._lock:
+			try:
+				with open(self.path, "rb") as f:
+					fcntl.flock(f, fcntl.LOCK_SH)
+					self._catch_up(f)
+			except FileNotFoundError:
+				pass
+
+	def used_at(self, final_key: str) -> str | None:
+		"""Heure du passage hors ligne du billet, None s'il n'est pas au journal (lu au dernier catch_up)."""
+		return self._used.get(final_key)
+
+	def record(self, final_key: str) -> str | None:
+		"""Journalise le passage -> heure, ou None si le billet est déjà passé hors ligne."""
+		with self._lock, open(self.path, "a+b") as f:
+			fcntl.flock(f, fcntl.LOCK_EX)		# libéré à la fermeture
+			self._catch_up(f)
+			if final_key in self._used:
+				return None
+			now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+			f.write((json.dumps({"final_key": final_key, "used_at": now}) + "\n").encode())
+			f.flush()
+			self._offset = f.tell()
+			self._used[final_key] = now
+		return now
+#----------------------------------------------------------------------------------------------------------------------#
+class OfflineGate:
+	"""Contrôle sur l'instantané ; passages enregistrés dans le journal partagé."""
+
+	def __init__(self, snapshot_path: str, journal: ScanJournal):
+		self.snapshot = Snapshot(snapshot_path)
+		self.journal = journal
+
+	def scan(self, final_key: str) -> dict:
+		found = self.snapshot.lookup(final_key)
+		if found is None:
+			return {"result": "unknown", "offline": True}
+		order_id, persons, used = found
+		if used:
+			return {"result": "used", "order_id": order_id, "persons": persons, "offline": True}
+		now = self.journal.record(final_key)
+		if now is None:
+			return {"result": "used", "order_id": order_id, "persons": persons, "offline": True}
+		return {"result": "ok", "order_id": order_id, "persons": persons, "used_at": now, "offline": True}
+#----------------------------------------------------------------------------------------------------------------------#
+ticket_filter = TicketFilter()
+scan_journal = ScanJournal(GATE_JOURNAL)
+_offline_gate = None
+
+def offline_gate() -> OfflineGate | None:
+	global _offline_gate
+	if _offline_gate is None and GATE_SNAPSHOT:
+		_offline_gate = OfflineGate(GATE_SNAPSHOT, scan_journal)
+	return _offline_gate
+#----------------------------------------------------------------------------------------------------------------------#
+async def scan(final_key: str) -> dict:
+	"""Contrôle + marquage -> {"result": ok | used | canceled | unknown | invalid, ...}."""
+	final_key = final_key.strip().lower()
+	if not FINAL_KEY_RE.match(final_key):
+		return {"result": "invalid"}
+	missed = not ticket_filter.might_contain(final_key)
+	# billet déjà passé hors ligne (pas encore reporté par "gate.py sync") : son passage est d'abord écrit en base,
+	# le scan le trouve alors utilisé
+	offline_at = None
+	if GATE_SNAPSHOT:
+		if scan_journal.behind():
+			await run_in_threadpool(scan_journal.catch_up)
+		offline_at = scan_journal.used_at(final_key)
+	try:
+		async with get_async_connection() as conn:
+			if missed:
+				# clé absente du filtre : inconnue, sauf si un paiement plus récent que le dernier rafraîchissement
+				# existe (billet payé sur un autre worker entre-temps) -> contrôle complet
+				newest = await conn.fetchone(NEWEST_PAYMENT_SQL, as_dict=False)
+				if ticket_filter.covers(newest[0]):
+					ticket_filter.rejected += 1
+					return {"result": "unknown"}
+				ticket_filter.stale_misses += 1
+			if offline_at is not None:
+				await conn.execute(SYNC_ONE_SQL, {"final_key": final_key, "used_at": offline_at})
+			row = await conn.fetchone(SCAN_SQL, {"final_key": final_key})
+	except DB_UNAVAILABLE:
+		# base injoignable (ou pool saturé) : instantané hors ligne s'il est configuré
+		gate = offline_gate()
+		if gate is None:
+			raise
+		return await run_in_threadpool(gate.scan, final_key)
+	#------------------------------------------------------------------------------#
+	if row is None:
+		return {"result": "unknown"}
+	ticket = {"order_id": row["order_id"], "offer": row["name"], "persons": (row["quantity"] or 1) * row["nbr_ticket"]}
+	if row["status"] != "paid":
+		return {"result": "canceled", **ticket}
+	if row["scanned_at"] is None:
+		used_at = row["used_at"]
+		return {"result": "used", **ticket, "used_at": used_at.isoformat() if used_at else None}
+	return {"result": "ok", **ticket, "used_at": row["scanned_at"].isoformat()}
+#----------------------------------------------------------------------------------------------------------------------#
+def sync_journal(cur, path: str) -> int:
+	"""Reporte en base les scans hors ligne (premier passage conservé si le billet a aussi été scanné en ligne)."""
+	import psycopg2.extras
+	with open(path, encoding="utf-8") as f:
+		scans = [json.loads(line) for line in f if line.strip()]
+	psycopg2.extras.execute_values(cur, SYNC_SQL, [(s["final_key"], s["used_at"]) for s in scans], page_size=1000)
+	return len(scans)
+#----------------------------------------------------------------------------------------------------------------------#
+if __name__ == "__main__":
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Contrôle des billets (instantané hors ligne)")
+	sub = parser.add_subparsers(dest="command", required=True)
+	p = sub.add_parser("snapshot", help="écrire l'instantané des billets valides")
+	p.add_argument("path")
+	p = sub.add_parser("check", help="contrôler une clé sur un instantané (sans la marquer)")
+	p.add_argument("path")
+	p.add_argument("final_key")
+	p = sub.add_parser("sync", help="reporter en base un journal de scans hors ligne")
+	p.add_argument("journal")
+	args = parser.parse_args()
+
+	if args.command == "check":
+		snapshot = Snapshot(args.path)
+		started = time.perf_counter()
+		found = snapshot.lookup(args.final_key.strip().lower())
+		elapsed_us = (time.perf_counter() - started) * 1e6
+		print(json.dumps({"found": found is not None, "ticket": found, "lookup_us": round(elapsed_us, 1),
+						  "tickets": snapshot.count, "generated_at": time.ctime(snapshot.generated_at)}))
+	else:
+		with get_pool().connection() as conn:
+			with conn.cursor() as cur:
+				if args.command == "snapshot":
+					cur.execute(SNAPSHOT_SQL)
+					print(f"{write_snapshot(cur, args.path)} billet(s) -> {args.path}")
+				else:
+					print(f"{sync_journal(cur, args.journal)} scan(s) reporté(s)")
+#----------------------------------------------------------------------------------------------------------------------#
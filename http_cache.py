@@ -0,0 +1,36 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Petits utilitaires de cache HTTP (ETag / If-None-Match, Last-Modified / If-Modified-Since)
+#----------------------------------------------------------------------------------------------------------------------#
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Request, Response
+#----------------------------------------------------------------------------------------------------------------------#
+def etag_matches(request: Request, etag: str) -> bool:
+	"""Vrai si l'en-tête If-None-Match du client contient cet ETag (comparaison faible, "*" accepté)."""
+	header = request.headers.get("if-none-match")
+	if not header:
+		return False
+	wanted = etag.removeprefix("W/")
+	for candidate in header.split(","):
+		candidate = candidate.strip()
+		if candidate == "*" or candidate.removeprefix("W/") == wanted:
+			return True
+	return False
+#----------------------------------------------------------------------------------------------------------------------#
+def http_date(timestamp: float) -> str:
+	return formatdate(timestamp, usegmt=True)
+#----------------------------------------------------------------------------------------------------------------------#
+def is_fresh(request: Request, etag: str, last_modified: float | None = None) -> bool:
+	"""Copie du client encore valide ? If-None-Match prime : If-Modified-Since n'est lu qu'en son absence (RFC 9110)."""
+	if request.headers.get("if-none-match"):
+		return etag_matches(request, etag)
+	since = request.headers.get("if-modified-since")
+	if not since or last_modified is None:
+		return False
+	try:
+		return int(last_modified) <= parsedate_to_datetime(since).timestamp()
+	except (TypeError, ValueError):
+		return False
+#----------------------------------------------------------------------------------------------------------------------#
+def not_modified(etag: str, cache_control: str = "private, no-cache") -> Response:
+	return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,64 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# API JSON versionnée (/api/v1) : encodage rapide et GET conditionnels
+#
+# - encodage orjson (bytes directement, dates RFC 3339) si le module est installé, sinon json de la bibliothèque
+#   standard avec le même rendu (compact, UTF-8)
+# - chaque réponse porte un ETag fort (empreinte du corps, ou version du catalogue pour les offres) et, quand la
+#   date de dernière modification est connue, Last-Modified ; If-None-Match / If-Modified-Since -> 304 sans corps
+# - listes paginées par curseur (pagination.py) : {"data": [...], "cursors": {"before": ..., "after": ...}}
+# - erreurs : {"error": "..."} avec le code HTTP correspondant
+#----------------------------------------------------------------------------------------------------------------------#
+import datetime, decimal, hashlib, json, os
+from starlette.requests import Request
+from starlette.responses import Response
+from http_cache import http_date, is_fresh, not_modified
+
+try:
+	import orjson
+except ImportError:		# encodage json standard (plus lent, même rendu)
+	orjson = None
+#----------------------------------------------------------------------------------------------------------------------#
+API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", "50"))		# éléments par page si page_size absent
+
+PUBLIC = "public, no-cache"		# catalogue : partageable par un proxy, revalidé à chaque appel
+PRIVATE = "private, no-cache"	# données d'un utilisateur / de l'administration
+#----------------------------------------------------------------------------------------------------------------------#
+def _default(value):
+	if isinstance(value, decimal.Decimal):
+		return float(value)
+	if isinstance(value, (datetime.date, datetime.time)):
+		return value.isoformat()
+	raise TypeError(f"Type non sérialisable : {type(value).__name__}")
+
+def dumps(content) -> bytes:
+	if orjson is not None:
+		return orjson.dumps(content, default=_default)
+	return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+#----------------------------------------------------------------------------------------------------------------------#
+class APIResponse(Response):
+	media_type = "application/json"
+
+	def render(self, content) -> bytes:
+		return content if isinstance(content, bytes) else dumps(content)
+#----------------------------------------------------------------------------------------------------------------------#
+def body_etag(body: bytes) -> str:
+	return '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+
+def api_error(message: str, status_code: int) -> APIResponse:
+	return APIResponse({"error": message}, status_code=status_code, headers={"Cache-Control": "no-store"})
+#----------------------------------------------------------------------------------------------------------------------#
+def conditional(request: Request, body: bytes, etag: str | None = None, last_modified: float | None = None,
+				cache_control: str = PRIVATE) -> Response:
+	"""200 avec validateurs, ou 304 si la copie du client est à jour (ETag par défaut : empreinte du corps)."""
+	etag = etag or body_etag(body)
+	headers = {"ETag": etag, "Cache-Control": cache_control}
+	if last_modified is not None:
+		headers["Last-Modified"] = http_date(last_modified)
+	if cache_control == PRIVATE:
+		headers["Vary"] = "Cookie"		# réponse propre à l'utilisateur du cookie
+	if is_fresh(request, etag, last_modified):
+		response = not_modified(etag, cache_control)
+		response.headers.update(headers)
+		return response
+	return APIResponse(body, headers=headers)
+#----------------------------------------------------------------------------------------------------------------------#
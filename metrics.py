@@ -0,0 +1,386 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Métriques au format texte Prometheus (GET /metrics)
+#
+# - http_request_duration_seconds{method, route, status} : histogramme par gabarit de route ("/tickets/{final_key}.{fmt}",
+#   pas l'URL réelle : nombre de séries borné) ; son _count donne le nombre de requêtes par code de statut
+# - db_query_duration_seconds{fingerprint, query} / db_query_rows_total / db_query_errors_total : chaque requête SQL,
+#   regroupée par empreinte (texte normalisé : littéraux, paramètres et listes IN / VALUES remplacés par "?")
+#   -> connexions psycopg2 du pool (TimedConnection, donc get_connection_database() et tous les modules) et façade
+#   async de db_async.py
+# - db_pool_acquire_seconds{pool} : attente d'une connexion (sync = pool psycopg2, async = pool psycopg 3)
+# - requêtes SQL au-delà de SLOW_QUERY_MS : transmises au journal des requêtes lentes (voir slow_queries.py)
+#
+# Coût au fil de l'eau : quelques µs par requête HTTP et par requête SQL (un verrou, une recherche de compartiment ;
+# l'empreinte d'un texte SQL déjà vu est en cache) -> activé par défaut, mesuré par bench/bench_metrics.py.
+# Chaque worker uvicorn compte de son côté : avec METRICS_DIR, chaque worker y écrit ses compteurs toutes les
+# METRICS_FLUSH_INTERVAL s et /metrics additionne ceux de tous les workers (sinon : ceux du worker qui répond).
+# Accès : en-tête "Authorization: Bearer <METRICS_TOKEN>" (configuration de collecte Prometheus) ; les empreintes SQL
+# et l'état des pools ne sont pas publics, METRICS_TOKEN vide = /metrics refusé (403).
+#----------------------------------------------------------------------------------------------------------------------#
+import asyncio, bisect, contextvars, hashlib, hmac, json, os, re, tempfile, threading, time
+import psycopg2
+import psycopg2.extensions
+from slow_queries import SLOW_QUERY_SECONDS, slow_log
+#----------------------------------------------------------------------------------------------------------------------#
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_BUCKETS = tuple(sorted(float(b) for b in os.getenv(
+	"METRICS_BUCKETS", "0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10"
+).split(",")))																# bornes des histogrammes (s)
+METRICS_MAX_QUERIES = int(os.getenv("METRICS_MAX_QUERIES", "500"))			# empreintes SQL distinctes, au-delà : "other"
+METRICS_DIR = os.getenv("METRICS_DIR", "")									# "" = compteurs du seul worker qui répond
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))	# secondes
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")								# jeton de collecte, "" = /metrics refusé
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+QUERY_LABEL_MAX = 200		# longueur max du libellé "query" (l'empreinte, elle, porte sur le texte complet)
+
+SCRAPE_MESSAGES = {
+	401: "Jeton de métriques invalide",
+	403: "Métriques non exposées : METRICS_TOKEN non défini",
+}
+#----------------------------------------------------------------------------------------------------------------------#
+def scrape_denied(authorization: str | None) -> int | None:
+	"""None si l'en-tête Authorization vaut "Bearer <METRICS_TOKEN>", sinon 401 / 403."""
+	if not METRICS_TOKEN:
+		return 403
+	scheme, _, token = (authorization or "").partition(" ")
+	if scheme.lower() != "bearer":
+		return 401
+	return None if hmac.compare_digest(token.strip().encode(), METRICS_TOKEN.encode()) else 401
+#----------------------------------------------------------------------------------------------------------------------#
+class _Counter:
+	__slots__ = ("value",)
+
+	def __init__(self):
+		self.value = 0
+
+	def values(self) -> list:
+		return [self.value]
+
+class _Histogram:
+	__slots__ = ("counts", "sum")
+
+	def __init__(self, buckets: int):
+		self.counts = [0] * (buckets + 1)		# un compteur par borne + "+Inf", non cumulés
+		self.sum = 0.0
+
+	def values(self) -> list:
+		return self.counts + [self.sum]
+#----------------------------------------------------------------------------------------------------------------------#
+class Family:
+	"""Une métrique et ses séries (une par combinaison de libellés)."""
+
+	def __init__(self, registry, name: str, kind: str, help: str, labelnames: tuple, max_series: int = 0):
+		self.registry = registry
+		self.name = name
+		self.kind = kind				# counter | histogram
+		self.help = help
+		self.labelnames = labelnames
+		self.max_series = max_series
+		self.children = {}
+
+	def labels(self, *values):
+		child = self.children.get(values)
+		if child is None:
+			with self.registry.lock:
+				if self.max_series and values not in self.children and len(self.children) >= self.max_series:
+					values = ("other",) * len(values)
+				child = self.children.get(values)
+				if child is None:
+					child = _Histogram(len(self.registry.buckets)) if self.kind == "histogram" else _Counter()
+					self.children[values] = child
+		return child
+
+	def observe(self, child: _Histogram, seconds: float):
+		i = bisect.bisect_left(self.registry.buckets, seconds)		# compartiment "le" : première borne >= valeur
+		with self.registry.lock:
+			child.counts[i] += 1
+			child.sum += seconds
+
+	def inc(self, child: _Counter, amount: float = 1):
+		with self.registry.lock:
+			child.value += amount
+#----------------------------------------------------------------------------------------------------------------------#
+class Registry:
+	def __init__(self, buckets: tuple = METRICS_BUCKETS, directory: str = METRICS_DIR):
+		self.buckets = buckets
+		self.directory = directory
+		self.lock = threading.Lock()
+		self.families = {}
+		self._task = None
+		#------------------------------------------------------------------------------#
+		self.flushes = 0
+		self.flush_errors = 0
+	#------------------------------------------------------------------------------#
+	def family(self, name: str, kind: str, help: str, labelnames: tuple, max_series: int = 0) -> Family:
+		family = self.families[name] = Family(self, name, kind, help, labelnames, max_series)
+		return family
+	#------------------------------------------------------------------------------#
+	def snapshot(self) -> dict:
+		"""{métrique : {libellés (json) : [valeurs]}} du processus, copie cohérente prise sous le verrou."""
+		with self.lock:
+			return {
+				name: {json.dumps(labels): child.values() for labels, child in family.children.items()}
+				for name, family in self.families.items()
+			}
+	#------------------------------------------------------------------------------#
+	def _path(self, pid: int) -> str:
+		return os.path.join(self.directory, f"{pid}.json")
+
+	def flush(self):
+		"""Écrit les compteurs du worker dans METRICS_DIR (remplacement atomique du fichier du pid)."""
+		path = self._path(os.getpid())
+		try:
+			os.makedirs(self.directory, exist_ok=True)
+			fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+			with os.fdopen(fd, "w") as fichier:
+				json.dump(self.snapshot(), fichier)
+			os.replace(tmp, path)
+			self.flushes += 1
+		except OSError:
+			self.flush_errors += 1
+	#------------------------------------------------------------------------------#
+	def merged(self) -> dict:
+		"""Compteurs du processus + ceux écrits par les autres workers (METRICS_DIR), additionnés série par série."""
+		total = self.snapshot()
+		if not self.directory or not os.path.isdir(self.directory):
+			return total
+		own = os.path.basename(self._path(os.getpid()))
+		for entry in os.scandir(self.directory):
+			if not entry.name.endswith(".json") or entry.name == own:
+				continue
+			try:
+				with open(entry.path) as fichier:
+					other = json.load(fichier)
+			except (OSError, ValueError):
+				continue		# fichier d'un worker en cours de remplacement : compté au prochain scrape
+			for name, series in other.items():
+				target = total.setdefault(name, {})
+				for labels, values in series.items():
+					current = target.get(labels)
+					target[labels] = values if current is None else [a + b for a, b in zip(current, values)]
+		return total
+	#------------------------------------------------------------------------------#
+	def render(self, gauges: list = ()) -> str:
+		"""Exposition texte ; gauges : [(nom, aide, libellés, {valeurs des libellés : valeur})] du worker qui répond."""
+		data = self.merged()
+		bounds = [_number(b) for b in self.buckets] + ["+Inf"]
+		lines = []
+		for name, family in self.families.items():
+			lines.append(f"# HELP {name} {family.help}")
+			lines.append(f"# TYPE {name} {family.kind}")
+			for labels, values in sorted(data.get(name, {}).items()):
+				pairs = _pairs(family.labelnames, json.loads(labels))
+				if family.kind == "counter":
+					lines.append(f"{name}{_braces(pairs)} {_number(values[0])}")
+					continue
+				cumulative = 0
+				sep = "," if pairs else ""
+				for bound, count in zip(bounds, values[:-1]):
+					cumulative += count
+					lines.append(f'{name}_bucket{{{pairs}{sep}le="{bound}"}} {cumulative}')
+				lines.append(f"{name}_sum{_braces(pairs)} {_number(values[-1])}")
+				lines.append(f"{name}_count{_braces(pairs)} {cumulative}")
+		for name, help, labelnames, series in gauges:
+			lines.append(f"# HELP {name} {help}")
+			lines.append(f"# TYPE {name} gauge")
+			for labels, value in series.items():
+				lines.append(f"{name}{_braces(_pairs(labelnames, labels))} {_number(value)}")
+		return "\n".join(lines) + "\n"
+	#------------------------------------------------------------------------------#
+	async def _loop(self, interval: float):
+		while True:
+			await asyncio.sleep(interval)
+			await asyncio.to_thread(self.flush)
+	#------------------------------------------------------------------------------#
+	def start(self, interval: float = METRICS_FLUSH_INTERVAL):
+		if self.directory and interval > 0 and self._task is None:
+			self._task = asyncio.get_running_loop().create_task(self._loop(interval))
+	#------------------------------------------------------------------------------#
+	async def stop(self):
+		task, self._task = self._task, None
+		if task is not None:
+			task.cancel()
+			try:
+				await task
+			except asyncio.CancelledError:
+				pass
+			self.flush()		# derniers compteurs du worker avant son arrêt
+	#------------------------------------------------------------------------------#
+	def stats(self) -> dict:
+		with self.lock:
+			series = {name: len(family.children) for name, family in self.families.items()}
+		return {
+			"enabled": METRICS_ENABLED,
+			"series": series,
+			"fingerprints_cached": len(_fingerprints),
+			"directory": self.directory or None,
+			"flushes": self.flushes,
+			"flush_errors": self.flush_errors,
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+def _escape(value) -> str:
+	return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _pairs(names: tuple, values) -> str:
+	return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+def _braces(pairs: str) -> str:
+	return "{" + pairs + "}" if pairs else ""
+
+def _number(value) -> str:
+	return repr(float(value)) if isinstance(value, float) else str(value)
+#----------------------------------------------------------------------------------------------------------------------#
+registry = Registry()
+
+HTTP_REQUESTS = registry.family(
+	"http_request_duration_seconds", "histogram", "Durée des requêtes HTTP par gabarit de route (réponse complète)",
+	("method", "route", "status"),
+)
+DB_QUERIES = registry.family(
+	"db_query_duration_seconds", "histogram", "Durée d'exécution des requêtes SQL par empreinte",
+	("fingerprint", "query"), METRICS_MAX_QUERIES,
+)
+DB_ROWS = registry.family(
+	"db_query_rows_total", "counter", "Lignes renvoyées ou modifiées par empreinte SQL",
+	("fingerprint", "query"), METRICS_MAX_QUERIES,
+)
+DB_ERRORS = registry.family(
+	"db_query_errors_total", "counter", "Requêtes SQL en erreur par empreinte",
+	("fingerprint", "query"), METRICS_MAX_QUERIES,
+)
+DB_ACQUIRE = registry.family(
+	"db_pool_acquire_seconds", "histogram", "Attente d'une connexion du pool (vérification au checkout comprise)",
+	("pool",),
+)
+#----------------------------------------------------------------------------------------------------------------------#
+# Empreinte SQL
+#----------------------------------------------------------------------------------------------------------------------#
+_LITERALS = re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|%s|\$\d+|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")					# IN (?, ?, ?) / une ligne de VALUES
+_ROWS = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")						# VALUES (?), (?), ... (execute_values)
+_COMMENTS = re.compile(r"--[^\n]*")
+_SPACES = re.compile(r"\s+")
+_fingerprints = {}		# texte SQL exécuté -> (série durée, série lignes, libellés, texte normalisé)
+_FINGERPRINT_CACHE = 4096
+
+def normalize(sql: str) -> str:
+	text = _COMMENTS.sub(" ", sql)
+	text = _LITERALS.sub("?", text)
+	text = _LISTS.sub("(?)", text)
+	text = _ROWS.sub("(?)", text)
+	return _SPACES.sub(" ", text).strip()
+
+def _query_series(sql) -> tuple:
+	entry = _fingerprints.get(sql)
+	if entry is None:
+		if isinstance(sql, bytes):
+			text = sql.decode("utf-8", "replace")
+		else:
+			text = str(sql)
+		normalized = normalize(text)
+		labels = (hashlib.blake2b(normalized.encode(), digest_size=6).hexdigest(), normalized[:QUERY_LABEL_MAX])
+		entry = (DB_QUERIES.labels(*labels), DB_ROWS.labels(*labels), labels, normalized)
+		if len(_fingerprints) >= _FINGERPRINT_CACHE:
+			_fingerprints.clear()		# textes SQL à littéraux inlinés : le cache ne doit pas grossir sans fin
+		_fingerprints[sql] = entry
+	return entry
+
+def observe_query(sql, seconds: float, rows: int, failed: bool = False, statement=None, params=None):
+	"""statement / params : requête à rejouer sous EXPLAIN si elle est lente (None : journalisée sans plan)."""
+	duration, rows_total, labels, normalized = _query_series(sql)
+	i = bisect.bisect_left(registry.buckets, seconds)
+	with registry.lock:
+		duration.counts[i] += 1
+		duration.sum += seconds
+		if rows > 0:
+			rows_total.value += rows
+	if failed:
+		errors = DB_ERRORS.labels(*labels)
+		with registry.lock:
+			errors.value += 1
+	if seconds >= SLOW_QUERY_SECONDS:
+		scope = request_scope.get()
+		slow_log.capture(labels[0], normalized, statement, params, seconds, rows,
+			route_template(scope) if scope is not None else None, failed)
+
+def observe_acquire(pool: str, seconds: float):
+	DB_ACQUIRE.observe(DB_ACQUIRE.labels(pool), seconds)
+#----------------------------------------------------------------------------------------------------------------------#
+# Curseurs psycopg2 chronométrés : connection_factory des connexions du pool (db_pool.py)
+#----------------------------------------------------------------------------------------------------------------------#
+class _TimedCursor:
+	"""Mixin placé devant la classe de curseur demandée (curseur simple, RealDictCursor, curseur nommé...)."""
+
+	def _timed(self, call, sql, explain, *args):
+		# explain : (requête, paramètres) à rejouer pour le journal des requêtes lentes
+		started = time.perf_counter()
+		try:
+			result = call(sql, *args)
+		except BaseException:
+			observe_query(sql, time.perf_counter() - started, 0, True, *explain)
+			raise
+		observe_query(sql, time.perf_counter() - started, self.rowcount, False, *explain)
+		return result
+
+	def execute(self, query, vars=None):
+		return self._timed(super().execute, query, (query, vars), vars)
+
+	def executemany(self, query, vars_list):
+		return self._timed(super().executemany, query, (None, None), vars_list)
+
+	def copy_expert(self, sql, file, size=8192):
+		return self._timed(super().copy_expert, sql, (None, None), file, size)
+
+_timed_factories = {}
+
+def _timed_factory(factory):
+	timed = _timed_factories.get(factory)
+	if timed is None:
+		timed = _timed_factories[factory] = type(f"Timed{factory.__name__}", (_TimedCursor, factory), {})
+	return timed
+
+class TimedConnection(psycopg2.extensions.connection):
+	def cursor(self, *args, **kwargs):
+		if len(args) < 2:		# cursor(name, cursor_factory, ...) : la fabrique passée en position est laissée telle quelle
+			factory = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+			kwargs["cursor_factory"] = _timed_factory(factory)
+		return super().cursor(*args, **kwargs)
+#----------------------------------------------------------------------------------------------------------------------#
+# Middleware ASGI (pas BaseHTTPMiddleware : pas de tâche supplémentaire par requête, réponses en streaming intactes)
+#----------------------------------------------------------------------------------------------------------------------#
+request_scope = contextvars.ContextVar("request_scope", default=None)	# requête HTTP en cours (journal lent)
+
+def route_template(scope) -> str:
+	route = scope.get("route")		# posé par le routeur FastAPI une fois la route trouvée
+	if route is not None:
+		return route.path
+	if "endpoint" in scope:			# application montée (StaticFiles de /static)
+		return scope.get("root_path", "") + "/{path}"
+	return "<unmatched>"			# 404 : pas de libellé par URL inconnue
+
+class MetricsMiddleware:
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http":
+			await self.app(scope, receive, send)
+			return
+		started = time.perf_counter()
+		status = 500				# exception avant l'envoi des en-têtes : ServerErrorMiddleware répondra 500
+
+		async def send_status(message):
+			nonlocal status
+			if message["type"] == "http.response.start":
+				status = message["status"]
+			await send(message)
+
+		token = request_scope.set(scope)
+		try:
+			await self.app(scope, receive, send_status)
+		finally:
+			request_scope.reset(token)
+			child = HTTP_REQUESTS.labels(scope["method"], route_template(scope), str(status))
+			HTTP_REQUESTS.observe(child, time.perf_counter() - started)
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,98 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Cache du catalogue des offres (en mémoire, par processus)
+# - le catalogue ne change que via /admin/offers/new et /admin/offers/delete -> invalidate() après commit
+# - CATALOG_CACHE_TTL borne la durée de vie d'une copie (autres workers uvicorn, modifications faites en SQL)
+# - cache du HTML des cartes de /offers, lié à la version du catalogue, + ETag pour If-None-Match
+# - modified_at : instant du dernier changement de contenu vu par ce processus (un rechargement à l'identique le
+#   conserve) -> Last-Modified de /api/v1/offers
+# - rechargements sur un réplica (voir replicas.py), sauf le premier après invalidate() : un réplica en retard
+#   remettrait en cache, pour CATALOG_CACHE_TTL s, le catalogue d'avant la modification
+#----------------------------------------------------------------------------------------------------------------------#
+import asyncio, hashlib, os, threading, time
+from db_async import get_async_connection
+#----------------------------------------------------------------------------------------------------------------------#
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "60"))		# secondes
+
+CATALOG_SQL = "SELECT id, name, nbr_ticket, prix, capacity FROM offers ORDER BY id"
+#----------------------------------------------------------------------------------------------------------------------#
+class _Snapshot:
+	__slots__ = ("offers", "by_id", "etag", "loaded_at", "modified_at", "rendered")
+
+	def __init__(self, offers: list, previous=None):
+		self.offers = offers
+		self.by_id = {o["id"]: o for o in offers}
+		self.etag = hashlib.sha1(repr([tuple(o.values()) for o in offers]).encode()).hexdigest()[:16]
+		self.loaded_at = time.monotonic()
+		unchanged = previous is not None and previous.etag == self.etag
+		self.modified_at = previous.modified_at if unchanged else time.time()
+		self.rendered = {}		# HTML / JSON construit à partir de CE catalogue (ex: cartes de /offers)
+#----------------------------------------------------------------------------------------------------------------------#
+class OfferCatalog:
+	def __init__(self, ttl: float = CATALOG_CACHE_TTL):
+		self.ttl = ttl
+		self._snapshot = None
+		self._last = None			# dernier catalogue lu, même invalidé (modified_at du suivant)
+		self._generation = 0		# incrémenté à chaque invalidation
+		self._invalidated = False	# prochain rechargement sur le serveur principal
+		self._guard = threading.Lock()
+		self._load_lock = None		# asyncio.Lock créé paresseusement (boucle de l'application)
+		#------------------------------------------------------------------------------#
+		self.hits = 0
+		self.misses = 0
+	#------------------------------------------------------------------------------#
+	def _fresh(self):
+		snap = self._snapshot
+		if snap is not None and time.monotonic() - snap.loaded_at < self.ttl:
+			return snap
+		return None
+	#------------------------------------------------------------------------------#
+	def invalidate(self):
+		with self._guard:
+			self._generation += 1
+			self._snapshot = None
+			self._invalidated = True
+	#------------------------------------------------------------------------------#
+	async def snapshot(self) -> _Snapshot:
+		snap = self._fresh()
+		if snap is not None:
+			self.hits += 1
+			return snap
+		#------------------------------------------------------------------------------#
+		# un seul rechargement à la fois : les requêtes concurrentes attendent son résultat
+		if self._load_lock is None:
+			self._load_lock = asyncio.Lock()
+		async with self._load_lock:
+			snap = self._fresh()
+			if snap is not None:
+				self.hits += 1
+				return snap
+			self.misses += 1
+			generation = self._generation
+			async with get_async_connection(readonly=not self._invalidated) as conn:
+				rows = await conn.fetchall(CATALOG_SQL)
+			snap = _Snapshot([dict(r) for r in rows], self._last)
+			with self._guard:
+				# une invalidation pendant la lecture rend ce résultat douteux : on ne le garde pas
+				if generation == self._generation:
+					self._snapshot = self._last = snap
+					self._invalidated = False
+			return snap
+	#------------------------------------------------------------------------------#
+	async def offers(self) -> list:
+		return (await self.snapshot()).offers
+	#------------------------------------------------------------------------------#
+	async def get(self, offer_id: int) -> dict | None:
+		return (await self.snapshot()).by_id.get(int(offer_id))
+	#------------------------------------------------------------------------------#
+	def stats(self) -> dict:
+		snap = self._snapshot
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"generation": self._generation,
+			"offers": len(snap.offers) if snap else None,
+			"age_s": round(time.monotonic() - snap.loaded_at, 1) if snap else None,
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+offer_catalog = OfferCatalog()
+#----------------------------------------------------------------------------------------------------------------------#
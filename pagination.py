@@ -0,0 +1,57 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Pagination par curseur ("keyset") pour les listes admin
+# - au lieu de LIMIT/OFFSET (Postgres lit puis jette toutes les lignes des pages précédentes),
+#   on repart de la dernière clé vue : WHERE id > %s ORDER BY id LIMIT n -> même coût à n'importe quelle profondeur
+# - curseurs opaques after / before : base64url("<portée>:<id>"), la portée (ex: "orders:paid") évite
+#   de réutiliser un curseur sur une autre liste
+#----------------------------------------------------------------------------------------------------------------------#
+import base64, os
+#----------------------------------------------------------------------------------------------------------------------#
+PAGE_SIZE_DEFAULT = int(os.getenv("ADMIN_PAGE_SIZE", "10"))
+PAGE_SIZE_MAX = int(os.getenv("ADMIN_PAGE_SIZE_MAX", "200"))
+#----------------------------------------------------------------------------------------------------------------------#
+def encode_cursor(scope: str, key: int) -> str:
+	return base64.urlsafe_b64encode(f"{scope}:{key}".encode()).decode().rstrip("=")
+#----------------------------------------------------------------------------------------------------------------------#
+def decode_cursor(token: str | None, scope: str) -> int | None:
+	"""Clé contenue dans le curseur, ou None si absent / invalide / d'une autre portée."""
+	if not token:
+		return None
+	try:
+		raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+		token_scope, key = raw.rsplit(":", 1)
+		return int(key) if token_scope == scope else None
+	except ValueError:
+		return None
+#----------------------------------------------------------------------------------------------------------------------#
+def clamp_page_size(page_size: int | None, default: int = PAGE_SIZE_DEFAULT) -> int:
+	if not page_size:
+		return default
+	return max(1, min(PAGE_SIZE_MAX, page_size))
+#----------------------------------------------------------------------------------------------------------------------#
+def keyset_clause(column: str, scope: str, after: str | None, before: str | None):
+	"""(condition SQL à ajouter au WHERE, sens du ORDER BY, paramètres, page demandée à rebours ?)"""
+	key = decode_cursor(before, scope)
+	if key is not None:
+		return f"AND {column} < %s", "DESC", [key], True
+	key = decode_cursor(after, scope)
+	if key is not None:
+		return f"AND {column} > %s", "ASC", [key], False
+	return "", "ASC", [], False
+#----------------------------------------------------------------------------------------------------------------------#
+def keyset_page(rows: list, page_size: int, backward: bool, has_cursor: bool):
+	"""rows = résultat de LIMIT page_size + 1 -> (lignes de la page dans l'ordre croissant, has_prev, has_next)."""
+	more = len(rows) > page_size
+	rows = rows[:page_size]
+	if backward:
+		rows.reverse()
+		return rows, more, True
+	return rows, has_cursor, more
+#----------------------------------------------------------------------------------------------------------------------#
+def page_cursors(rows: list, key: str, scope: str, has_prev: bool, has_next: bool) -> dict:
+	"""Curseurs before / after des pages voisines (None s'il n'y en a pas), pour les réponses JSON."""
+	return {
+		"before": encode_cursor(scope, rows[0][key]) if has_prev and rows else None,
+		"after": encode_cursor(scope, rows[-1][key]) if has_next and rows else None,
+	}
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,373 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Partitionnement mensuel de orders et payments sur created_at (PostgreSQL 13+)
+#
+# - migration optionnelle d'une base existante : python partitions.py migrate
+#	orders / payments deviennent des tables partitionnées par mois (UTC) + une partition DEFAULT de secours
+# - contraintes qui ne peuvent pas inclure la clé de partition, remplacées par des tables de clés non partitionnées
+#   (clé primaire = unicité globale) tenues à jour par triggers, dans la même transaction que l'écriture :
+#	* PRIMARY KEY (id) -> (id, created_at) + order_keys(id) : payments.order_id / seat_holds.order_id gardent
+#	  une clé étrangère (vers order_keys, ON DELETE CASCADE) ; id / created_at d'une commande non modifiables
+#	* payments_one_success_per_order -> payment_success_orders(order_id) : un seul paiement 'success' par commande
+#	* idx_payments_final_key -> payment_final_keys(final_key) : clé de billet unique
+#	les index de même nom restent (non uniques, pour les recherches) : le script d'init peut être rejoué
+#	base migrée avant ces tables : python partitions.py guarantees (refuse s'il existe déjà des doublons ;
+#	sur une base déjà équipée, met seulement les triggers à jour)
+# - partitions futures : PARTITION_MONTHS_AHEAD mois d'avance, vérifiées au démarrage puis toutes les
+#   PARTITION_CHECK_INTERVAL s par l'application (ou par cron : python partitions.py ensure)
+# - archivage : python partitions.py archive --before 2024-09 [--out archives] [--keep]
+#	détache les partitions des mois antérieurs, les exporte en CSV gzip puis les supprime ; une commande archivée
+#	emporte tous ses paiements, ses ventes passent dans offer_sales_archived (sales_stats.py verify / rebuild)
+#
+# Élagage (partition pruning) : les requêtes avec un filtre sur created_at (/admin/orders?since=&until=,
+# archivage) ne lisent que les partitions concernées ; les recherches par id / utilisateur sondent l'index de
+# chaque partition vivante, d'où l'intérêt d'archiver les saisons terminées.
+#----------------------------------------------------------------------------------------------------------------------#
+import asyncio, os, re
+from datetime import date, datetime, timedelta, timezone
+#----------------------------------------------------------------------------------------------------------------------#
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_CHECK_INTERVAL = float(os.getenv("PARTITION_CHECK_INTERVAL", "86400"))	# secondes, 0 = jamais
+
+PARTITIONED_TABLES = ("orders", "payments")
+PARTITION_NAME_RE = re.compile(r"^(orders|payments)_p(\d{4})_(\d{2})$")
+#----------------------------------------------------------------------------------------------------------------------#
+def ensure_sql(months_ahead: int = PARTITION_MONTHS_AHEAD, since: str = "NOW()") -> str:
+	"""Crée les partitions mensuelles manquantes du mois de `since` (expression SQL) à +months_ahead mois.
+	Sans effet sur une table non partitionnée (base non migrée)."""
+	return f"""
+	DO $$
+	DECLARE
+		t TEXT;
+		m TIMESTAMP;
+	BEGIN
+		FOREACH t IN ARRAY ARRAY['orders', 'payments'] LOOP
+			CONTINUE WHEN NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(t));
+			FOR m IN
+				SELECT generate_series(
+					date_trunc('month', COALESCE({since}, NOW()) AT TIME ZONE 'UTC'),
+					date_trunc('month', NOW() AT TIME ZONE 'UTC') + make_interval(months => {int(months_ahead)}),
+					INTERVAL '1 month'
+				)
+			LOOP
+				EXECUTE format(
+					'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+					t || '_p' || to_char(m, 'YYYY_MM'), t,
+					m AT TIME ZONE 'UTC', (m + INTERVAL '1 month') AT TIME ZONE 'UTC'
+				);
+			END LOOP;
+		END LOOP;
+	END $$
+	"""
+#----------------------------------------------------------------------------------------------------------------------#
+def parse_day(value: str | None) -> date | None:
+	"""'YYYY-MM-DD' -> date, None si absent ou invalide."""
+	try:
+		return date.fromisoformat(value) if value else None
+	except ValueError:
+		return None
+#----------------------------------------------------------------------------------------------------------------------#
+def created_range_clause(column: str, since: date | None, until: date | None):
+	"""(condition SQL à ajouter au WHERE, paramètres) pour since <= created_at < until + 1 jour.
+
+	Bornes passées en timestamptz UTC (constantes, comme les bornes des partitions) : le planificateur écarte
+	les partitions hors de l'intervalle dès la planification.
+	"""
+	condition, params = "", []
+	if since:
+		condition += f" AND {column} >= %s"
+		params.append(datetime.combine(since, datetime.min.time(), timezone.utc))
+	if until:
+		condition += f" AND {column} < %s"
+		params.append(datetime.combine(until + timedelta(days=1), datetime.min.time(), timezone.utc))
+	return condition, params
+#----------------------------------------------------------------------------------------------------------------------#
+IS_PARTITIONED_SQL = "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('orders'))"
+
+# Index des tables partitionnées : ceux de database/init_database_JO.sql, sans UNIQUE quand la clé de partition
+# ne peut pas en faire partie (unicité portée par GUARANTEES_SQL)
+PARTITIONED_INDEXES = """
+	CREATE INDEX payments_one_success_per_order ON payments(order_id) WHERE status = 'success';
+	CREATE INDEX idx_orders_user ON orders(user_id);
+	CREATE INDEX idx_orders_offer ON orders(offer_id);
+	CREATE INDEX idx_payments_order ON payments(order_id);
+	CREATE INDEX idx_orders_user_draft ON orders(user_id, id) WHERE status = 'draft';
+	CREATE INDEX idx_orders_user_paid ON orders(user_id, id) WHERE status = 'paid';
+	CREATE INDEX idx_orders_status_id ON orders(status, id);
+	CREATE INDEX idx_payments_final_key ON payments(final_key);
+"""
+
+# Unicité et clés étrangères globales d'une base partitionnée. Remplissage sans ON CONFLICT : un doublon déjà
+# présent fait échouer la migration (unique_violation) au lieu d'être ignoré
+GUARANTEES_SQL = """
+	CREATE TABLE order_keys (id INTEGER PRIMARY KEY);
+	CREATE TABLE payment_success_orders (order_id INTEGER PRIMARY KEY);
+	CREATE TABLE payment_final_keys (final_key TEXT PRIMARY KEY);
+	INSERT INTO order_keys SELECT id FROM orders;
+	INSERT INTO payment_success_orders SELECT order_id FROM payments WHERE status = 'success';
+	INSERT INTO payment_final_keys SELECT final_key FROM payments WHERE final_key IS NOT NULL;
+
+	ALTER TABLE payments ADD CONSTRAINT payments_order_id_fkey
+		FOREIGN KEY (order_id) REFERENCES order_keys(id) ON DELETE CASCADE;
+	ALTER TABLE seat_holds ADD CONSTRAINT seat_holds_order_id_fkey
+		FOREIGN KEY (order_id) REFERENCES order_keys(id) ON DELETE CASCADE;
+"""
+
+# Triggers des tables de clés (rejouables : "python partitions.py guarantees" les met à jour sur une base déjà équipée)
+GUARANTEE_TRIGGERS_SQL = """
+	-- création d'une commande : clé ajoutée AVANT la ligne, un paiement inséré par la même requête (import en masse)
+	-- trouve sa cible au contrôle de la clé étrangère ; suppression : order_keys, puis payments / seat_holds
+	-- par les clés étrangères. Un UPDATE qui changerait de partition serait un DELETE + INSERT (cascade sur les
+	-- paiements) : refusé
+	CREATE OR REPLACE FUNCTION order_keys_sync() RETURNS trigger AS $$
+	BEGIN
+		IF TG_OP = 'INSERT' THEN
+			INSERT INTO order_keys (id) VALUES (NEW.id);
+			RETURN NEW;
+		ELSIF TG_OP = 'DELETE' THEN
+			DELETE FROM order_keys WHERE id = OLD.id;
+		ELSE
+			RAISE EXCEPTION 'orders.id / orders.created_at non modifiables (table partitionnée)';
+		END IF;
+		RETURN NULL;
+	END $$ LANGUAGE plpgsql;
+
+	DROP TRIGGER IF EXISTS order_keys_sync ON orders;
+	DROP TRIGGER IF EXISTS order_keys_insert ON orders;
+	DROP TRIGGER IF EXISTS order_keys_delete ON orders;
+	DROP TRIGGER IF EXISTS order_keys_frozen ON orders;
+	CREATE TRIGGER order_keys_insert BEFORE INSERT ON orders
+	FOR EACH ROW EXECUTE FUNCTION order_keys_sync();
+	CREATE TRIGGER order_keys_delete AFTER DELETE ON orders
+	FOR EACH ROW EXECUTE FUNCTION order_keys_sync();
+	CREATE TRIGGER order_keys_frozen BEFORE UPDATE OF id, created_at ON orders
+	FOR EACH ROW WHEN (NEW.id <> OLD.id OR NEW.created_at <> OLD.created_at) EXECUTE FUNCTION order_keys_sync();
+
+	-- UPDATE OF : le marquage des billets scannés (used_at) ne touche pas aux tables de clés
+	CREATE OR REPLACE FUNCTION payment_keys_sync() RETURNS trigger AS $$
+	BEGIN
+		IF TG_OP <> 'INSERT' THEN
+			IF OLD.status = 'success' THEN
+				DELETE FROM payment_success_orders WHERE order_id = OLD.order_id;
+			END IF;
+			IF OLD.final_key IS NOT NULL THEN
+				DELETE FROM payment_final_keys WHERE final_key = OLD.final_key;
+			END IF;
+		END IF;
+		IF TG_OP <> 'DELETE' THEN
+			IF NEW.status = 'success' THEN
+				INSERT INTO payment_success_orders (order_id) VALUES (NEW.order_id);
+			END IF;
+			IF NEW.final_key IS NOT NULL THEN
+				INSERT INTO payment_final_keys (final_key) VALUES (NEW.final_key);
+			END IF;
+		END IF;
+		RETURN NULL;
+	END $$ LANGUAGE plpgsql;
+
+	DROP TRIGGER IF EXISTS payment_keys_sync ON payments;
+	CREATE TRIGGER payment_keys_sync AFTER INSERT OR DELETE OR UPDATE OF order_id, status, final_key ON payments
+	FOR EACH ROW EXECUTE FUNCTION payment_keys_sync();
+"""
+#----------------------------------------------------------------------------------------------------------------------#
+def is_partitioned(cur) -> bool:
+	cur.execute(IS_PARTITIONED_SQL)
+	return cur.fetchone()[0]
+#----------------------------------------------------------------------------------------------------------------------#
+def install_guarantees(cur):
+	"""Tables de clés + triggers d'une base partitionnée (appelé par migrate, ou seul pour une base migrée avant).
+
+	Tables de clés déjà en place : seuls les triggers sont remis à jour."""
+	if not is_partitioned(cur):
+		raise ValueError("orders n'est pas partitionnée (python partitions.py migrate)")
+	cur.execute("SELECT to_regclass('order_keys') IS NOT NULL")
+	installed = cur.fetchone()[0]
+	cur.execute("LOCK TABLE orders, payments, seat_holds IN ACCESS EXCLUSIVE MODE")
+	if not installed:
+		# ancienne migration : cascade par trigger, sans clé étrangère
+		cur.execute("DROP TRIGGER IF EXISTS orders_delete_cascade ON orders")
+		cur.execute("DROP FUNCTION IF EXISTS orders_delete_cascade()")
+		cur.execute(GUARANTEES_SQL)
+	cur.execute(GUARANTEE_TRIGGERS_SQL)
+#----------------------------------------------------------------------------------------------------------------------#
+def migrate(cur, months_ahead: int = PARTITION_MONTHS_AHEAD):
+	"""Convertit orders / payments en tables partitionnées (dans la transaction de l'appelant, tables verrouillées)."""
+	if is_partitioned(cur):
+		raise ValueError("orders est déjà partitionnée")
+	cur.execute("LOCK TABLE orders, payments, seat_holds IN ACCESS EXCLUSIVE MODE")
+	#------------------------------------------------------------------------------#
+	# 1) contraintes impossibles sur une table partitionnée
+	cur.execute("ALTER TABLE payments DROP CONSTRAINT IF EXISTS payments_order_id_fkey")
+	cur.execute("ALTER TABLE seat_holds DROP CONSTRAINT IF EXISTS seat_holds_order_id_fkey")
+	#------------------------------------------------------------------------------#
+	# 2) nouvelles tables mères (mêmes colonnes, valeurs par défaut et CHECK), partitions, copie des lignes
+	for table in PARTITIONED_TABLES:
+		cur.execute(f"UPDATE {table} SET created_at = NOW() WHERE created_at IS NULL")
+		cur.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE")
+		cur.execute(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned")
+		cur.execute(f"""
+			CREATE TABLE {table} (LIKE {table}_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+			PARTITION BY RANGE (created_at)
+		""")
+		cur.execute(f"ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL")
+		cur.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+	cur.execute(ensure_sql(months_ahead, since="""LEAST(
+		(SELECT MIN(created_at) FROM orders_unpartitioned), (SELECT MIN(created_at) FROM payments_unpartitioned)
+	)"""))
+	for table in PARTITIONED_TABLES:
+		cur.execute(f"INSERT INTO {table} SELECT * FROM {table}_unpartitioned")
+		cur.execute(f"DROP TABLE {table}_unpartitioned")
+		cur.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+		cur.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)")
+	#------------------------------------------------------------------------------#
+	# 3) clés étrangères vers les tables non partitionnées, index, unicité globale (tables de clés)
+	cur.execute("ALTER TABLE orders ADD FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE")
+	cur.execute("ALTER TABLE orders ADD FOREIGN KEY (offer_id) REFERENCES offers(id)")
+	cur.execute(PARTITIONED_INDEXES)
+	install_guarantees(cur)
+	cur.execute("ANALYZE orders")
+	cur.execute("ANALYZE payments")
+#----------------------------------------------------------------------------------------------------------------------#
+def ensure(cur, months_ahead: int = PARTITION_MONTHS_AHEAD):
+	cur.execute(ensure_sql(months_ahead))
+#----------------------------------------------------------------------------------------------------------------------#
+def list_partitions(cur, table: str) -> list:
+	"""[(nom, 'YYYY-MM')] des partitions mensuelles de `table`, dans l'ordre."""
+	cur.execute("""
+		SELECT c.relname
+		FROM pg_inherits i
+		JOIN pg_class c ON c.oid = i.inhrelid
+		WHERE i.inhparent = to_regclass(%s)
+		ORDER BY c.relname
+	""", (table,))
+	result = []
+	for (name,) in cur.fetchall():
+		m = PARTITION_NAME_RE.match(name)
+		if m:
+			result.append((name, f"{m.group(2)}-{m.group(3)}"))
+	return result
+#----------------------------------------------------------------------------------------------------------------------#
+def archive(cur, before: str, out_dir: str, keep: bool = False) -> list:
+	"""Détache et exporte (CSV gzip) les partitions des mois < `before` ('YYYY-MM').
+
+	Curseur psycopg2 (COPY) dans la transaction de l'appelant : les fichiers sont écrits sous un nom temporaire,
+	à renommer par l'appelant après le commit (voir __main__). Retourne [(table, partition, lignes, fichier)].
+	Une commande archivée part avec tous ses paiements, même ceux d'un mois suivant (fichier
+	<partition>_payments.csv.gz), et ses ventes sont cumulées dans offer_sales_archived (sales_stats.py).
+	"""
+	import gzip
+	if not is_partitioned(cur):
+		return []
+	cur.execute("SELECT to_regclass('order_keys') IS NOT NULL")
+	if not cur.fetchone()[0]:
+		raise ValueError("tables de clés absentes : python partitions.py guarantees")
+	os.makedirs(out_dir, exist_ok=True)
+	archived = []
+
+	def export(table: str, name: str, query: str):
+		path = os.path.join(out_dir, f"{name}.csv.gz")
+		with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+			cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+		cur.execute(f"SELECT COUNT(*) FROM ({query}) q")
+		archived.append((table, name, cur.fetchone()[0], path))
+	#------------------------------------------------------------------------------#
+	# 1) paiements : détachés avant les commandes (la cascade depuis order_keys ne doit plus les atteindre)
+	for name, month in list_partitions(cur, "payments"):
+		if month >= before:
+			continue
+		cur.execute(f"ALTER TABLE payments DETACH PARTITION {name}")
+		cur.execute(f"ALTER TABLE {name} DROP CONSTRAINT IF EXISTS payments_order_id_fkey")
+		export("payments", name, f"SELECT * FROM {name}")
+		# lignes supprimées sans passer par le trigger : clés retirées ici
+		cur.execute(f"DELETE FROM payment_final_keys k USING {name} p WHERE k.final_key = p.final_key")
+		cur.execute(f"""
+			DELETE FROM payment_success_orders s USING {name} p WHERE s.order_id = p.order_id AND p.status = 'success'
+		""")
+		if not keep:
+			cur.execute(f"DROP TABLE {name}")
+	#------------------------------------------------------------------------------#
+	# 2) commandes, avec leurs paiements restés dans les partitions vivantes (paiement du mois suivant)
+	for name, month in list_partitions(cur, "orders"):
+		if month >= before:
+			continue
+		cur.execute(f"ALTER TABLE orders DETACH PARTITION {name}")
+		export("orders", name, f"SELECT * FROM {name}")
+		export("payments", f"{name}_payments", f"SELECT p.* FROM payments p JOIN {name} o ON o.id = p.order_id")
+		cur.execute(f"""
+			INSERT INTO offer_sales_archived(offer_id, total_packs, total_turnover)
+			SELECT o.offer_id, SUM(o.quantity), SUM(o.quantity * of.prix)
+			FROM {name} o
+			JOIN offers of ON of.id = o.offer_id
+			WHERE o.status = 'paid'
+			GROUP BY o.offer_id
+			ON CONFLICT (offer_id) DO UPDATE
+			SET total_packs = offer_sales_archived.total_packs + EXCLUDED.total_packs,
+				total_turnover = offer_sales_archived.total_turnover + EXCLUDED.total_turnover
+		""")
+		# payments / seat_holds restants : ON DELETE CASCADE depuis order_keys
+		cur.execute(f"DELETE FROM order_keys k USING {name} o WHERE k.id = o.id")
+		if not keep:
+			cur.execute(f"DROP TABLE {name}")
+	return archived
+#----------------------------------------------------------------------------------------------------------------------#
+async def maintain(interval: float = PARTITION_CHECK_INTERVAL):
+	"""Tâche de fond de l'application : partitions des prochains mois (sans effet si la base n'est pas migrée)."""
+	from db_async import get_async_connection
+	while True:
+		try:
+			async with get_async_connection() as conn:
+				await conn.execute(ensure_sql())
+		except asyncio.CancelledError:
+			raise
+		except Exception as e:
+			print(f"[partitions] création des partitions impossible : {e}")
+		if interval <= 0:
+			return
+		await asyncio.sleep(interval)
+#----------------------------------------------------------------------------------------------------------------------#
+if __name__ == "__main__":
+	import argparse
+	from db_pool import get_pool
+
+	parser = argparse.ArgumentParser(description="Partitionnement mensuel de orders / payments")
+	sub = parser.add_subparsers(dest="command", required=True)
+	p = sub.add_parser("migrate", help="convertir une base existante (tables verrouillées pendant la copie)")
+	p.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+	p = sub.add_parser("ensure", help="créer les partitions des prochains mois")
+	p.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+	p = sub.add_parser("archive", help="détacher, exporter et supprimer les partitions anciennes (commandes avec tous "
+		"leurs paiements, ventes conservées dans offer_sales_archived)")
+	p.add_argument("--before", required=True, help="mois exclu, format YYYY-MM")
+	p.add_argument("--out", default="archives")
+	p.add_argument("--keep", action="store_true", help="garder les tables détachées (non supprimées)")
+	sub.add_parser("guarantees", help="unicité / clés étrangères d'une base migrée avant les tables de clés")
+	sub.add_parser("list", help="partitions existantes")
+	args = parser.parse_args()
+
+	if args.command == "archive" and not re.fullmatch(r"\d{4}-\d{2}", args.before):
+		parser.error("--before : format YYYY-MM attendu")
+
+	with get_pool().connection() as conn:
+		with conn.cursor() as cur:
+			if args.command == "migrate":
+				migrate(cur, args.months_ahead)
+			elif args.command == "guarantees":
+				install_guarantees(cur)
+			elif args.command == "ensure":
+				ensure(cur, args.months_ahead)
+			elif args.command == "archive":
+				archived = archive(cur, args.before, args.out, args.keep)
+			partitioned = is_partitioned(cur)
+			partitions = [p for t in PARTITIONED_TABLES for p in list_partitions(cur, t)]
+
+	if args.command == "archive":
+		# transaction validée : les exports deviennent définitifs
+		for table, name, rows, path in archived:
+			os.replace(path + ".tmp", path)
+			print(f"{name:<24} {rows:>10} ligne(s) -> {path}")
+		if not archived:
+			print(f"aucune partition antérieure à {args.before}")
+	elif not partitioned:
+		print("orders n'est pas partitionnée (python partitions.py migrate)")
+	else:
+		print(" ".join(name for name, _ in partitions))
+#----------------------------------------------------------------------------------------------------------------------#
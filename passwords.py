@@ -0,0 +1,150 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Hachage des mots de passe
+#
+# - scrypt (défaut) ou PBKDF2-SHA256 de hashlib, sel aléatoire par utilisateur, format préfixé :
+#	scrypt$<log2 N>$<r>$<p>$<sel hex>$<hash hex>
+#	pbkdf2_sha256$<itérations>$<sel hex>$<hash hex>
+#	sans préfixe (64 caractères hex) = ancien SHA-256 salé "SALT1234", remplacé à la prochaine connexion réussie
+# - le calcul (volontairement lent) tourne dans un pool de processus borné : il ne bloque ni la boucle asyncio,
+#   ni le thread pool des routes, ni le GIL
+# - file d'attente limitée : au-delà de PASSWORD_HASH_QUEUE calculs en attente, HashingBusy tout de suite (503)
+#   plutôt que d'accumuler des connexions qui expireront de toute façon
+# - augmenter le facteur de travail (PASSWORD_SCRYPT_LOG2N / PASSWORD_PBKDF2_ITERATIONS) fait aussi
+#   re-hacher les mots de passe existants à la connexion (needs_rehash)
+#
+# Benchmark : python bench/bench_passwords.py
+#----------------------------------------------------------------------------------------------------------------------#
+import asyncio, hashlib, hmac, multiprocessing, os, secrets, threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+#----------------------------------------------------------------------------------------------------------------------#
+PASSWORD_HASH_ALGO = os.getenv("PASSWORD_HASH_ALGO", "scrypt")					# scrypt | pbkdf2_sha256
+PASSWORD_SCRYPT_LOG2N = int(os.getenv("PASSWORD_SCRYPT_LOG2N", "14"))			# N = 2^14 -> 16 Mo par calcul
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", "600000"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or os.cpu_count() or 1
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))				# calculs en attente, en plus des workers
+
+SCRYPT_R = 8
+SCRYPT_P = 1
+LEGACY_SALT = "SALT1234"
+#----------------------------------------------------------------------------------------------------------------------#
+class HashingBusy(Exception):
+	"""File d'attente du hachage pleine : la requête doit être refusée (503)."""
+#----------------------------------------------------------------------------------------------------------------------#
+def current_params(algo: str = None, cost: int = None) -> tuple:
+	"""(algorithme, facteur de travail) en vigueur ; cost = log2 N (scrypt) ou nombre d'itérations (PBKDF2)."""
+	algo = algo or PASSWORD_HASH_ALGO
+	if algo == "scrypt":
+		return algo, cost or PASSWORD_SCRYPT_LOG2N
+	if algo == "pbkdf2_sha256":
+		return algo, cost or PASSWORD_PBKDF2_ITERATIONS
+	raise ValueError(f"PASSWORD_HASH_ALGO inconnu : {algo}")
+#----------------------------------------------------------------------------------------------------------------------#
+def _scrypt(password: str, salt: bytes, log2n: int, r: int, p: int) -> bytes:
+	n = 1 << log2n
+	return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * r * (n + p + 2) + (1 << 20), dklen=32)
+
+def hash_password(password: str, algo: str = None, cost: int = None) -> str:
+	"""Hache le mot de passe (calcul lent : à appeler dans un worker, voir PasswordHasher)."""
+	algo, cost = current_params(algo, cost)
+	salt = secrets.token_bytes(16)
+	if algo == "scrypt":
+		digest = _scrypt(password, salt, cost, SCRYPT_R, SCRYPT_P)
+		return f"scrypt${cost}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+	digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, cost)
+	return f"pbkdf2_sha256${cost}${salt.hex()}${digest.hex()}"
+#----------------------------------------------------------------------------------------------------------------------#
+def verify_password(password: str, stored: str) -> bool:
+	"""Compare en temps constant ; accepte les trois formats (scrypt, PBKDF2, ancien SHA-256)."""
+	try:
+		if stored.startswith("scrypt$"):
+			_, log2n, r, p, salt, digest = stored.split("$")
+			computed = _scrypt(password, bytes.fromhex(salt), int(log2n), int(r), int(p))
+		elif stored.startswith("pbkdf2_sha256$"):
+			_, iterations, salt, digest = stored.split("$")
+			computed = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+		else:
+			digest = stored
+			computed = hashlib.sha256((LEGACY_SALT + password).encode()).digest()
+		return hmac.compare_digest(computed, bytes.fromhex(digest))
+	except ValueError:
+		return False
+#----------------------------------------------------------------------------------------------------------------------#
+def needs_rehash(stored: str) -> bool:
+	"""Ancien SHA-256, autre algorithme ou facteur de travail différent de la configuration courante."""
+	algo, cost = current_params()
+	if algo == "scrypt":
+		return stored.split("$")[:4] != ["scrypt", str(cost), str(SCRYPT_R), str(SCRYPT_P)]
+	return stored.split("$")[:2] != [algo, str(cost)]
+#----------------------------------------------------------------------------------------------------------------------#
+def _verify_and_rehash(password: str, stored: str) -> tuple:
+	# exécuté dans un worker : vérification + nouveau hash éventuel en un seul aller-retour
+	if not verify_password(password, stored):
+		return False, None
+	return True, hash_password(password) if needs_rehash(stored) else None
+#----------------------------------------------------------------------------------------------------------------------#
+class PasswordHasher:
+	def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue: int = PASSWORD_HASH_QUEUE):
+		self.workers = max(1, workers)
+		self.limit = self.workers + max(0, queue)		# calculs en cours + en attente
+		self._executor = None
+		self._lock = threading.Lock()
+		self._pending = 0
+		#------------------------------------------------------------------------------#
+		self.done = 0
+		self.rejected = 0
+	#------------------------------------------------------------------------------#
+	def start(self):
+		with self._lock:
+			if self._executor is None:
+				# "spawn" : workers neufs, sans les threads ni les connexions du processus web
+				self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+	#------------------------------------------------------------------------------#
+	def shutdown(self):
+		with self._lock:
+			executor, self._executor = self._executor, None
+		if executor is not None:
+			executor.shutdown(wait=True, cancel_futures=True)
+	#------------------------------------------------------------------------------#
+	async def _run(self, fn, *args):
+		with self._lock:
+			if self._pending >= self.limit:
+				self.rejected += 1
+				raise HashingBusy()
+			self._pending += 1
+		try:
+			self.start()
+			executor = self._executor
+			return await asyncio.wrap_future(executor.submit(fn, *args))
+		except BrokenProcessPool:
+			# worker tué (OOM...) : le pool est inutilisable, on en recrée un au prochain appel
+			with self._lock:
+				if self._executor is executor:
+					self._executor = None
+			raise
+		finally:
+			with self._lock:
+				self._pending -= 1
+				self.done += 1
+	#------------------------------------------------------------------------------#
+	async def hash(self, password: str) -> str:
+		return await self._run(hash_password, password)
+	#------------------------------------------------------------------------------#
+	async def verify(self, password: str, stored: str) -> tuple:
+		"""(mot de passe correct ?, nouveau hash à enregistrer ou None)."""
+		return await self._run(_verify_and_rehash, password, stored)
+	#------------------------------------------------------------------------------#
+	def stats(self) -> dict:
+		algo, cost = current_params()
+		return {
+			"algo": algo,
+			"cost": cost,
+			"workers": self.workers,
+			"limit": self.limit,
+			"pending": self._pending,
+			"done": self.done,
+			"rejected": self.rejected,
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+password_hasher = PasswordHasher()
+#----------------------------------------------------------------------------------------------------------------------#
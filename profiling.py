@@ -0,0 +1,297 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Profilage à la demande des requêtes HTTP (échantillonnage de piles, sans dépendance)
+#
+# - déclenchement : en-tête "X-Profile: <PROFILE_TOKEN>" (réservé à l'admin ; vide = en-tête ignoré) ou
+#   PROFILE_SAMPLE_PERCENT % des requêtes tirées au hasard ; au plus PROFILE_MAX_ACTIVE requêtes profilées à la fois
+# - un thread échantillonne toutes les PROFILE_INTERVAL s, uniquement tant qu'une requête profilée est en cours :
+#	* boucle d'événements exécutant la tâche de la requête -> pile du thread
+#	* thread du pool anyio exécutant du code de la requête (route sync, requête psycopg2, rendu...) -> pile await
+#	  de la tâche + pile du thread (repéré par le contexte contextvars que anyio lui transmet)
+#	* sinon (attente d'une E/S asyncio) -> pile await de la tâche terminée par "(await)"
+#   -> temps "horloge murale" : Postgres, construction HTML et E/S apparaissent chacun dans la pile qui les attend
+# - résultat : une pile repliée par ligne ("a;b;c nombre", format de flamegraph.pl / speedscope) dans
+#   PROFILE_DIR/<date>-<méthode>-<route>-<n>.folded, nom renvoyé dans l'en-tête X-Profile-File
+#
+#	python profiling.py top profiles/*.folded [--limit 25]		fonctions les plus coûteuses (propre / cumulé)
+#	python profiling.py merge profiles/*my_orders*.folded > my_orders.folded	piles de plusieurs requêtes additionnées
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, asyncio, collections, contextvars, hmac, itertools, os, random, re, sys, threading, time
+from metrics import route_template
+#----------------------------------------------------------------------------------------------------------------------#
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")									# "" = pas de profilage par en-tête
+PROFILE_SAMPLE_PERCENT = float(os.getenv("PROFILE_SAMPLE_PERCENT", "0"))		# % des requêtes profilées au hasard
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))				# période d'échantillonnage (s)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_ACTIVE = int(os.getenv("PROFILE_MAX_ACTIVE", "4"))					# requêtes profilées simultanément
+
+PROFILE_ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_PERCENT > 0
+PROFILE_HEADER = b"x-profile"
+AWAIT_LEAF = "(await)"
+#----------------------------------------------------------------------------------------------------------------------#
+_current = contextvars.ContextVar("profile", default=None)	# profil de la requête, hérité par les threads anyio
+_labels = {}													# code -> "fonction (fichier:ligne)"
+_THREADING = threading.__file__
+
+def _label(code) -> str:
+	label = _labels.get(code)
+	if label is None:
+		label = _labels[code] = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+	return label
+
+def _thread_context(frame):
+	"""(contexte, frames exécutées sous context.run) d'un thread du pool anyio en plein travail, sinon None."""
+	chain = []
+	while frame is not None:
+		chain.append(frame)
+		frame = frame.f_back
+	chain.reverse()							# de la plus externe à la plus interne
+	for i, f in enumerate(chain[:8]):		# WorkerThread.run est tout en bas de la pile du thread
+		if f.f_code.co_filename == _THREADING:
+			continue						# _bootstrap, _bootstrap_inner, run
+		context = next((v for v in f.f_locals.values() if type(v) is contextvars.Context), None)
+		if context is not None:
+			# entre deux tâches, le thread a effacé son contexte ; juste après context.run, rien au-dessus
+			return (context, chain[i + 1:]) if i + 1 < len(chain) else None
+	return None
+#----------------------------------------------------------------------------------------------------------------------#
+class Profile:
+	_ids = itertools.count(1)
+
+	def __init__(self, scope, task, loop, stop_code):
+		self.scope = scope
+		self.task = task
+		self.loop = loop
+		self.loop_thread = threading.get_ident()
+		self.stop_code = stop_code			# frame du middleware : les piles commencent juste en dessous
+		self.stacks = collections.Counter()
+		self.samples = 0
+		self.started = time.perf_counter()
+		self.filename = None
+	#------------------------------------------------------------------------------#
+	def name(self) -> str:
+		if self.filename is None:
+			route = re.sub(r"[^0-9A-Za-z]+", "_", route_template(self.scope)).strip("_") or "root"
+			self.filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.scope['method']}-{route}-{next(self._ids)}.folded"
+		return self.filename
+	#------------------------------------------------------------------------------#
+	def _await_stack(self) -> list:
+		"""Chaîne des coroutines de la tâche (de la plus externe à celle qui attend)."""
+		frames = []
+		coro = self.task.get_coro()
+		while coro is not None:
+			frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+			if frame is None:
+				break
+			frames.append(frame)
+			coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+		return self._trim(frames)
+
+	def _thread_stack(self, frame) -> list:
+		frames = []
+		while frame is not None:
+			frames.append(frame)
+			frame = frame.f_back
+		frames.reverse()
+		return frames
+
+	def _trim(self, frames: list) -> list:
+		for i, frame in enumerate(frames):
+			if frame.f_code is self.stop_code:
+				return frames[i + 1:]
+		return frames
+	#------------------------------------------------------------------------------#
+	def sample(self, frames: dict, workers: dict):
+		if self.task.done():
+			return
+		if asyncio.current_task(self.loop) is self.task and self.loop_thread in frames:
+			stacks = [self._trim(self._thread_stack(frames[self.loop_thread]))]
+		else:
+			outer = self._await_stack()
+			stacks = [outer + inner for context, inner in workers.values() if context.get(_current) is self]
+			if not stacks:
+				stacks = [outer + [AWAIT_LEAF]]
+		for stack in stacks:
+			self.stacks[";".join(f if type(f) is str else _label(f.f_code) for f in stack)] += 1
+		self.samples += 1
+	#------------------------------------------------------------------------------#
+	def write(self, directory: str) -> str:
+		os.makedirs(directory, exist_ok=True)
+		path = os.path.join(directory, self.name())
+		with open(path, "w", encoding="utf-8") as fichier:
+			for stack, count in self.stacks.most_common():
+				fichier.write(f"{stack} {count}\n")
+		return path
+#----------------------------------------------------------------------------------------------------------------------#
+class Sampler:
+	def __init__(self, interval: float = PROFILE_INTERVAL, max_active: int = PROFILE_MAX_ACTIVE,
+				 directory: str = PROFILE_DIR):
+		self.interval = interval
+		self.max_active = max(1, max_active)
+		self.directory = directory
+		self._lock = threading.Lock()
+		self._active = set()
+		self._thread = None
+		self._switch_interval = None
+		#------------------------------------------------------------------------------#
+		self.profiled = 0
+		self.skipped = 0
+		self.write_errors = 0
+		self.recent = collections.deque(maxlen=20)
+	#------------------------------------------------------------------------------#
+	def add(self, profile: Profile) -> bool:
+		with self._lock:
+			if len(self._active) >= self.max_active:
+				self.skipped += 1
+				return False
+			self._active.add(profile)
+			if self._thread is None:
+				# le thread échantillonneur n'obtient le GIL qu'à chaque bascule (5 ms par défaut) : on la rapproche
+				# de la période d'échantillonnage le temps du profilage
+				self._switch_interval = sys.getswitchinterval()
+				sys.setswitchinterval(min(self._switch_interval, self.interval))
+				self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+				self._thread.start()
+		return True
+
+	def remove(self, profile: Profile):
+		with self._lock:
+			self._active.discard(profile)
+	#------------------------------------------------------------------------------#
+	def _run(self):
+		me = threading.get_ident()
+		while True:
+			with self._lock:
+				if not self._active:
+					sys.setswitchinterval(self._switch_interval)
+					self._thread = None
+					return
+				profiles = list(self._active)
+			frames = sys._current_frames()
+			loops = {p.loop_thread for p in profiles}
+			workers = {}
+			for ident, frame in frames.items():
+				if ident != me and ident not in loops:
+					found = _thread_context(frame)
+					if found is not None:
+						workers[ident] = found
+			for profile in profiles:
+				profile.sample(frames, workers)
+			del frames, workers
+			time.sleep(self.interval)
+	#------------------------------------------------------------------------------#
+	def finish(self, profile: Profile, status: int):
+		"""Écrit le profil (appelé hors boucle d'événements, réponse déjà envoyée)."""
+		ms = round((time.perf_counter() - profile.started) * 1000, 3)
+		try:
+			path = profile.write(self.directory)
+		except OSError:
+			self.write_errors += 1
+			return
+		self.profiled += 1
+		self.recent.append({
+			"file": os.path.basename(path),
+			"route": route_template(profile.scope),
+			"status": status,
+			"ms": ms,
+			"samples": profile.samples,
+		})
+	#------------------------------------------------------------------------------#
+	def stats(self) -> dict:
+		return {
+			"enabled": PROFILE_ENABLED,
+			"sample_percent": PROFILE_SAMPLE_PERCENT,
+			"interval_ms": self.interval * 1000,
+			"active": len(self._active),
+			"profiled": self.profiled,
+			"skipped": self.skipped,
+			"write_errors": self.write_errors,
+			"recent": list(self.recent),
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+sampler = Sampler()
+#----------------------------------------------------------------------------------------------------------------------#
+def _requested(scope) -> bool:
+	if PROFILE_TOKEN:
+		for name, value in scope["headers"]:
+			if name == PROFILE_HEADER:
+				return hmac.compare_digest(value, PROFILE_TOKEN.encode())
+	return False
+
+class ProfilingMiddleware:
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http":
+			await self.app(scope, receive, send)
+			return
+		requested = _requested(scope)
+		if not requested and not (PROFILE_SAMPLE_PERCENT > 0 and random.random() * 100 < PROFILE_SAMPLE_PERCENT):
+			await self.app(scope, receive, send)
+			return
+		#------------------------------------------------------------------------------#
+		profile = Profile(scope, asyncio.current_task(), asyncio.get_running_loop(), ProfilingMiddleware.__call__.__code__)
+		if not sampler.add(profile):
+			await self.app(scope, receive, send)
+			return
+		status = 500
+
+		async def send_profiled(message):
+			nonlocal status
+			if message["type"] == "http.response.start":
+				status = message["status"]
+				if requested:
+					headers = list(message.get("headers", [])) + [(b"x-profile-file", profile.name().encode())]
+					message = {**message, "headers": headers}
+			await send(message)
+
+		token = _current.set(profile)
+		try:
+			await self.app(scope, receive, send_profiled)
+		finally:
+			_current.reset(token)
+			sampler.remove(profile)
+			await asyncio.to_thread(sampler.finish, profile, status)
+#----------------------------------------------------------------------------------------------------------------------#
+def _read(paths: list) -> collections.Counter:
+	stacks = collections.Counter()
+	for path in paths:
+		with open(path, encoding="utf-8") as fichier:
+			for line in fichier:
+				stack, _, count = line.rstrip("\n").rpartition(" ")
+				if stack:
+					stacks[stack] += int(count)
+	return stacks
+
+def top(paths: list, limit: int):
+	stacks = _read(paths)
+	total = sum(stacks.values()) or 1
+	own, inclusive = collections.Counter(), collections.Counter()
+	for stack, count in stacks.items():
+		frames = stack.split(";")
+		own[frames[-1]] += count
+		for frame in set(frames):
+			inclusive[frame] += count
+	print(f"{sum(stacks.values())} échantillons, {len(paths)} profil(s)")
+	print(f"{'propre':>8} {'cumulé':>8}  fonction")
+	for frame, count in own.most_common(limit):
+		print(f"{100 * count / total:7.1f}% {100 * inclusive[frame] / total:7.1f}%  {frame}")
+
+def merge(paths: list):
+	for stack, count in _read(paths).most_common():
+		print(f"{stack} {count}")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Lecture des profils de requêtes (piles repliées)")
+	sub = parser.add_subparsers(dest="command", required=True)
+	p_top = sub.add_parser("top", help="fonctions les plus coûteuses")
+	p_top.add_argument("paths", nargs="+")
+	p_top.add_argument("--limit", type=int, default=25)
+	p_merge = sub.add_parser("merge", help="additionner plusieurs profils (entrée de flamegraph.pl)")
+	p_merge.add_argument("paths", nargs="+")
+	args = parser.parse_args()
+	if args.command == "top":
+		top(args.paths, args.limit)
+	else:
+		merge(args.paths)
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,233 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Requêtes SQL des routes de app.py
+# Regroupées ici pour que tools/explain_check.py vérifie les plans des requêtes réellement exécutées
+# (chaque requête doit passer par un index, voir "INDEX/CONTRAINTES" dans database/init_database_JO.sql).
+#
+# Un parcours = un aller-retour : les étapes d'un même parcours (annuler l'ancien panier, créer le nouveau,
+# payer...) sont regroupées dans une seule requête à CTE modifiantes ; seule la prise de places d'une offre
+# à capacité limitée (reservations.hold, avec son 2e essai) reste une requête à part.
+# NB : toutes les CTE d'une requête voient le même instantané -> aucune ligne n'y est modifiée deux fois.
+#----------------------------------------------------------------------------------------------------------------------#
+from reservations import cancel_drafts_cte, release_cte
+from sales_stats import AMOUNT_CENTS_SQL, record_from
+#----------------------------------------------------------------------------------------------------------------------#
+# /auth/login : index unique users(email) ; le hash est vérifié hors de la base (passwords.py)
+LOGIN_SQL = "SELECT id, password FROM users WHERE email=%(email)s"
+
+# /auth/login : ancien format ou facteur de travail changé -> nouveau hash (sauf si modifié entre-temps)
+REHASH_PASSWORD_SQL = "UPDATE users SET password=%(new)s WHERE id=%(user_id)s AND password=%(old)s"
+
+# /my/cart
+INSERT_DRAFT_SQL = (
+	"INSERT INTO orders(user_id, offer_id, quantity, status) "
+	"VALUES(%(user_id)s, %(offer_id)s, %(quantity)s, 'draft') RETURNING id"
+)
+
+# /offers/validate, /auth/login : annulation des anciens paniers + nouveau panier
+REPLACE_DRAFT_SQL = f"""
+	WITH {cancel_drafts_cte("%(user_id)s")}
+	INSERT INTO orders(user_id, offer_id, quantity, status)
+	VALUES(%(user_id)s, %(offer_id)s, %(quantity)s, 'draft')
+	RETURNING id
+"""
+#----------------------------------------------------------------------------------------------------------------------#
+# /my/orders : le panier ("draft", index partiel idx_orders_user_draft) et les commandes payées
+# (index partiel idx_orders_user_paid) ; UNION ALL plutôt que status IN (...) pour garder les deux index partiels
+_MY_ORDERS_COLUMNS = """
+		o.id AS order_id,
+		o.quantity,
+		o.status,
+		o.created_at,
+		of.name AS offer_name,
+		of.nbr_ticket,
+		of.prix"""
+
+MY_ORDERS_SQL = f"""
+	(SELECT {_MY_ORDERS_COLUMNS}, NULL AS final_key
+	FROM orders AS o
+	JOIN offers AS of ON of.id = o.offer_id
+	WHERE o.user_id = %(user_id)s AND o.status = 'draft')
+	UNION ALL
+	(SELECT {_MY_ORDERS_COLUMNS}, p.final_key
+	FROM orders AS o
+	JOIN offers AS of ON of.id = o.offer_id
+	JOIN payments p ON p.order_id = o.id
+	WHERE o.user_id = %(user_id)s AND o.status = 'paid')
+	ORDER BY order_id ASC
+"""
+#----------------------------------------------------------------------------------------------------------------------#
+# /api/v1/me/cart : panier de l'utilisateur (index partiel idx_orders_user_draft)
+API_CART_SQL = """
+	SELECT o.id AS order_id, o.offer_id, of.name AS offer_name, of.nbr_ticket, of.prix, o.quantity, o.created_at
+	FROM orders o
+	JOIN offers of ON of.id = o.offer_id
+	WHERE o.user_id = %s AND o.status = 'draft'
+	ORDER BY o.id
+"""
+
+# /api/v1/me/tickets : billets payés, pagination par curseur sur (user_id, id) de idx_orders_user_paid ;
+# {condition} / {order} fournis par pagination.keyset_clause
+API_TICKETS_SQL = """
+	SELECT
+		o.id AS order_id,
+		o.offer_id,
+		of.name AS offer_name,
+		of.nbr_ticket,
+		of.prix,
+		o.quantity,
+		o.created_at,
+		p.final_key,
+		p.used_at
+	FROM orders o
+	JOIN offers of ON of.id = o.offer_id
+	JOIN payments p ON p.order_id = o.id AND p.status = 'success'
+	WHERE o.user_id = %s AND o.status = 'paid' {condition}
+	ORDER BY o.id {order}
+	LIMIT %s
+"""
+#----------------------------------------------------------------------------------------------------------------------#
+# /pay : nom + prix de l'offre choisie
+PAY_PAGE_SQL = """
+	SELECT of.name AS offer_name, of.prix
+	FROM orders o
+	JOIN offers of ON of.id = o.offer_id
+	WHERE o.id = %s AND o.user_id = %s
+"""
+
+# /payments/confirm, rejeu (double clic, POST renvoyé par un proxy) : même clé d'idempotence -> billet déjà émis,
+# sans verrou ni écriture (index idx_payments_order)
+PAYMENT_REPLAY_SQL = """
+	SELECT p.final_key
+	FROM payments p
+	JOIN orders o ON o.id = p.order_id
+	WHERE p.order_id=%(order_id)s AND p.status='success' AND p.idempotency_key=%(idempotency_key)s
+	  AND o.user_id=%(user_id)s AND o.status='paid'
+"""
+
+# /payments/confirm : commande verrouillée, transition 'draft' -> 'paid' UNIQUEMENT
+# -> payée + paiement (clé finale = clé 1 de l'utilisateur + clé 2) + places confirmées + statistiques de ventes.
+# `status` = statut avant la requête (relu après le verrou : un paiement concurrent validé est vu 'paid') ;
+# 'paid' -> aucune écriture, final_key = billet déjà émis (NULL si émis par une transaction concurrente,
+# invisible dans l'instantané de la requête : relire avec PAID_FINAL_KEY_SQL).
+# `held` = 0 pour une offre limitée sans places bloquées : l'appelant les prend alors (reservations.commit).
+CONFIRM_PAYMENT_SQL = f"""
+	WITH target AS (
+		SELECT o.id, o.status, o.offer_id, o.quantity, u.key1, of.name, of.nbr_ticket, of.prix, of.capacity
+		FROM orders o
+		JOIN users u ON o.user_id = u.id
+		JOIN offers of ON o.offer_id = of.id
+		WHERE o.id=%(order_id)s AND o.user_id=%(user_id)s
+		FOR UPDATE OF o
+	), draft AS (
+		SELECT * FROM target WHERE status = 'draft'
+	), paid AS (
+		UPDATE orders SET status='paid' FROM draft WHERE orders.id = draft.id
+		RETURNING orders.id
+	), payment AS (
+		INSERT INTO payments(order_id, amount_cents, status, key2, final_key, idempotency_key)
+		SELECT id, {AMOUNT_CENTS_SQL}, 'success', %(key2)s::text, key1 || %(key2)s::text, %(idempotency_key)s::text FROM draft
+		RETURNING final_key
+	), held AS (
+		UPDATE seat_holds SET status='committed'
+		WHERE order_id = (SELECT id FROM draft) AND status='held'
+		RETURNING order_id
+	), stats AS ({record_from(
+		"SELECT offer_id, %(stats_shard)s::int, quantity, quantity * prix FROM draft"
+	)})
+	SELECT
+		target.*,
+		COALESCE(
+			(SELECT final_key FROM payment),
+			(SELECT final_key FROM payments WHERE order_id = target.id AND status = 'success')
+		) AS final_key,
+		(SELECT COUNT(*) FROM held) AS held
+	FROM target
+"""
+
+PAID_FINAL_KEY_SQL = "SELECT final_key FROM payments WHERE order_id=%(order_id)s AND status='success'"
+
+def cancel_order_sql(condition: str) -> str:
+	"""Annule la commande %(order_id)s si `condition` (filtre sur o), rend ses places et retire la vente des
+	statistiques si elle était payée -> old_status (aucune ligne si la commande ne correspond pas)."""
+	return f"""
+	WITH old AS (
+		SELECT o.id, o.status, o.offer_id, o.quantity, of.prix
+		FROM orders o
+		JOIN offers of ON of.id = o.offer_id
+		WHERE o.id=%(order_id)s {condition}
+		FOR UPDATE OF o
+	), canceled AS (
+		UPDATE orders SET status='canceled' FROM old WHERE orders.id = old.id
+		RETURNING orders.id
+	), {release_cte("(SELECT id FROM old)")},
+	stats AS ({record_from(
+		"SELECT offer_id, %(stats_shard)s::int, -quantity, -quantity * prix FROM old WHERE status = 'paid'"
+	)})
+	SELECT status AS old_status FROM old
+	"""
+
+# /payments/cancel : panier ('draft') de l'utilisateur connecté uniquement -> places bloquées rendues
+CANCEL_ORDER_SQL = cancel_order_sql("AND o.user_id=%(user_id)s AND o.status='draft'")
+
+# /admin/orders/refund (jeton admin) : commande payée -> annulée, places vendues remises en vente, vente retirée
+# des statistiques ; le billet devient "canceled" au contrôle
+REFUND_ORDER_SQL = cancel_order_sql("AND o.status='paid'")
+#----------------------------------------------------------------------------------------------------------------------#
+# /admin/users/list : {condition} / {order} fournis par pagination.keyset_clause (clé primaire)
+ADMIN_USERS_SQL = """
+	SELECT id, first_name, last_name, email
+	FROM users
+	WHERE TRUE {condition}
+	ORDER BY id {order}
+	LIMIT %s
+"""
+
+# /admin/orders, /api/v1/admin/orders : pagination par curseur sur (status, id), index idx_orders_status_id
+# la page de commandes est choisie d'abord (sous-requête) : les jointures ne portent que sur ses lignes
+# (jointure directe : le planificateur fusionnait avec tout idx_payments_order depuis le début, voir bench_routes.py)
+ADMIN_ORDERS_SQL = """
+	SELECT
+		o.id AS order_id,
+		o.quantity,
+		o.status,
+		o.created_at,
+		u.email,
+		of.name AS offer_name,
+		of.nbr_ticket,
+		of.prix,
+		p.final_key
+	FROM (
+		SELECT o.id, o.user_id, o.offer_id, o.quantity, o.status, o.created_at
+		FROM orders o
+		WHERE o.status = %s {condition}
+		ORDER BY o.id {order}
+		LIMIT %s
+	) o
+	JOIN users u ON u.id = o.user_id
+	JOIN offers of ON of.id = o.offer_id
+	LEFT JOIN payments p ON p.order_id = o.id
+	ORDER BY o.id {order}
+"""
+
+# /admin/orders/export : toutes les commandes d'un statut (curseur serveur), {condition} = filtre de dates
+EXPORT_ORDERS_SQL = """
+	SELECT
+		o.id,
+		o.status,
+		o.created_at,
+		u.email,
+		o.offer_id,
+		of.name,
+		of.nbr_ticket,
+		o.quantity,
+		of.prix,
+		o.quantity * of.prix,
+		p.final_key
+	FROM orders o
+	JOIN users u ON u.id = o.user_id
+	JOIN offers of ON of.id = o.offer_id
+	LEFT JOIN payments p ON p.order_id = o.id AND p.status = 'success'
+	WHERE o.status = %s {condition}
+	ORDER BY o.id
+"""
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,247 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Lectures sur réplicas PostgreSQL (réplication en flux), écritures sur le serveur principal
+#
+# - DATABASE_REPLICA_URLS (vide = tout sur DATABASE_URL) : réplicas en lecture seule, un pool chacun
+# - lectures pures (get_async_connection(readonly=True), read_connection()) -> réplica sain suivant (tourniquet) ;
+#   aucun réplica sain, ou connexion impossible -> serveur principal
+# - contrôle toutes les REPLICA_CHECK_INTERVAL s : réplica joignable, en réception du flux WAL, retard de rejeu
+#   <= REPLICA_MAX_LAG s ; sinon retiré du tourniquet jusqu'au contrôle suivant qui le trouve rattrapé
+# - connexion perdue pendant une lecture : réplica retiré aussitôt ; erreur de la requête seule (statement_timeout,
+#   conflit avec le rejeu du WAL...) : l'erreur remonte, le réplica reste dans le tourniquet
+# - lire ses propres écritures : toute requête d'écriture (POST...) pose le cookie REPLICA_STICKY_COOKIE pour
+#   REPLICA_STICKY_SECONDS s ; tant qu'il est présent, les lectures de ce navigateur restent sur le serveur principal
+#   (ex: /my/orders juste après /payments/confirm)
+#
+# CLI : python replicas.py status
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, asyncio, contextvars, itertools, json, os, time
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import cookie_parser
+from db_pool import DATABASE_SSLMODE, ConnectionPool, PoolTimeout, connection_lost, get_pool
+#----------------------------------------------------------------------------------------------------------------------#
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "5"))					# s de retard de rejeu tolérées
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "2"))	# s entre deux contrôles
+REPLICA_POOL_TIMEOUT = float(os.getenv("REPLICA_POOL_TIMEOUT", "1"))		# attente d'une connexion, puis principal
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", "10"))		# lectures sur le principal après écriture
+REPLICA_STICKY_COOKIE = "db_primary"
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# retard = 0 si tout le WAL reçu est rejoué (principal inactif : pg_last_xact_replay_timestamp vieillit sans retard ;
+# au démarrage du réplica, la position reçue repart du début du segment WAL, derrière la position rejouée)
+LAG_SQL = """
+	SELECT
+		pg_is_in_recovery() AS standby,
+		(SELECT status FROM pg_stat_wal_receiver) AS receiver,
+		CASE
+			WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0
+			ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+		END AS lag
+"""
+#----------------------------------------------------------------------------------------------------------------------#
+# posé par ReadYourWritesMiddleware pour la requête HTTP en cours (copié dans les threads des routes "def")
+prefer_primary = contextvars.ContextVar("prefer_primary", default=False)
+#----------------------------------------------------------------------------------------------------------------------#
+class Replica:
+	def __init__(self, index: int, dsn: str):
+		self.name = f"replica{index}"
+		self.dsn = dsn
+		params = psycopg2.extensions.parse_dsn(dsn)
+		self.address = f"{params.get('host', 'localhost')}:{params.get('port', 5432)}/{params.get('dbname', '')}"
+		self.pool = ConnectionPool(dsn, timeout=REPLICA_POOL_TIMEOUT, name=self.name)
+		self.async_pool = None		# DB_MODE=async : créé par db_async à la première lecture
+		self._conn = None			# connexion du contrôle (hors pool)
+		#------------------------------------------------------------------------------#
+		self.healthy = False		# hors tourniquet jusqu'au premier contrôle réussi
+		self.lag = None
+		self.error = None
+		self.checked_at = None
+		self.reads = 0
+		self.failures = 0
+	#------------------------------------------------------------------------------#
+	def check(self, max_lag: float):
+		"""Contrôle bloquant (thread pool) : met à jour healthy / lag / error."""
+		try:
+			if self._conn is None or self._conn.closed:
+				self._conn = psycopg2.connect(self.dsn, sslmode=DATABASE_SSLMODE, connect_timeout=2,
+					application_name="replica_check", options="-c statement_timeout=2s")
+				self._conn.autocommit = True
+			with self._conn.cursor() as cur:
+				cur.execute(LAG_SQL)
+				standby, receiver, lag = cur.fetchone()
+		except psycopg2.Error as e:
+			if self._conn is not None:
+				self._conn.close()
+			self.mark_down(e)
+			return
+		finally:
+			self.checked_at = time.time()
+		self.lag = float(lag) if lag is not None else None
+		if standby and receiver != "streaming":
+			self.healthy, self.error = False, f"réception WAL : {receiver or 'arrêtée'}"
+		elif self.lag is None or self.lag > max_lag:
+			self.healthy, self.error = False, f"retard {self.lag} s > {max_lag} s"
+		else:
+			self.healthy, self.error = True, None
+	#------------------------------------------------------------------------------#
+	def mark_down(self, error: Exception):
+		if self.healthy:
+			self.pool.discard_idle()		# connexions d'avant la panne : inutilisables au retour du réplica
+		self.healthy = False
+		self.failures += 1
+		self.error = str(error).strip() or type(error).__name__
+	#------------------------------------------------------------------------------#
+	def stats(self) -> dict:
+		return {
+			"address": self.address,
+			"healthy": self.healthy,
+			"lag_s": round(self.lag, 3) if self.lag is not None else None,
+			"error": self.error,
+			"checked_age_s": round(time.time() - self.checked_at, 1) if self.checked_at else None,
+			"reads": self.reads,
+			"failures": self.failures,
+			"pool": self.pool.stats(),
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+class ReplicaSet:
+	def __init__(self, urls: list = DATABASE_REPLICA_URLS, max_lag: float = REPLICA_MAX_LAG):
+		self.replicas = [Replica(i, url) for i, url in enumerate(urls, 1)]
+		self.max_lag = max_lag
+		self._turn = itertools.count()
+		self._task = None
+		#------------------------------------------------------------------------------#
+		self.primary_reads = 0		# lectures envoyées au principal (cookie d'écriture récente)
+		self.fallbacks = 0			# lectures envoyées au principal faute de réplica sain
+	#------------------------------------------------------------------------------#
+	def choose(self) -> Replica | None:
+		"""Réplica de la prochaine lecture, ou None (serveur principal)."""
+		if not self.replicas:
+			return None
+		if prefer_primary.get():
+			self.primary_reads += 1
+			return None
+		healthy = [r for r in self.replicas if r.healthy]
+		if not healthy:
+			self.fallbacks += 1
+			return None
+		replica = healthy[next(self._turn) % len(healthy)]
+		replica.reads += 1
+		return replica
+	#------------------------------------------------------------------------------#
+	@contextmanager
+	def read_connection(self):
+		"""Comme get_pool().connection(), sur un réplica sain si possible (routes de lecture "def")."""
+		replica = self.choose()
+		if replica is not None:
+			try:
+				item = replica.pool.getconn()
+			except (psycopg2.OperationalError, PoolTimeout) as e:
+				replica.mark_down(e)		# réplica injoignable ou saturé : cette lecture part sur le principal
+				self.fallbacks += 1
+			else:
+				try:
+					with replica.pool.connection(item) as conn:
+						yield conn
+				except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+					if connection_lost(item.conn, e):
+						replica.mark_down(e)		# panne entre deux contrôles : les lectures suivantes vont au principal
+					raise
+				return
+		with get_pool().connection() as conn:
+			yield conn
+	#------------------------------------------------------------------------------#
+	def check_all(self):
+		for replica in self.replicas:
+			replica.check(self.max_lag)
+	#------------------------------------------------------------------------------#
+	async def _loop(self, interval: float):
+		while True:
+			await asyncio.sleep(interval)
+			try:
+				await run_in_threadpool(self.check_all)
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				print(f"[replicas] contrôle impossible : {e}")
+	#------------------------------------------------------------------------------#
+	async def start(self, interval: float = REPLICA_CHECK_INTERVAL):
+		if not self.replicas or self._task is not None:
+			return
+		await run_in_threadpool(self.check_all)		# premières lectures déjà réparties
+		if interval > 0:
+			self._task = asyncio.get_running_loop().create_task(self._loop(interval))
+	#------------------------------------------------------------------------------#
+	async def stop(self):
+		task, self._task = self._task, None
+		if task is not None:
+			task.cancel()
+			try:
+				await task
+			except asyncio.CancelledError:
+				pass
+		for replica in self.replicas:
+			replica.pool.close()
+	#------------------------------------------------------------------------------#
+	def stats(self) -> dict | None:
+		if not self.replicas:
+			return None
+		return {
+			"max_lag_s": self.max_lag,
+			"running": self._task is not None,
+			"primary_reads": self.primary_reads,
+			"fallbacks": self.fallbacks,
+			"replicas": {r.name: r.stats() for r in self.replicas},
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+class ReadYourWritesMiddleware:
+	"""Requête d'écriture -> cookie de REPLICA_STICKY_SECONDS s ; requête avec ce cookie -> lectures sur le principal."""
+
+	def __init__(self, app, sticky: int = REPLICA_STICKY_SECONDS):
+		self.app = app
+		self.cookie = (
+			f"{REPLICA_STICKY_COOKIE}=1; Max-Age={sticky}; Path=/; HttpOnly; SameSite=Lax"
+		).encode("latin-1")
+	#------------------------------------------------------------------------------#
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http":
+			await self.app(scope, receive, send)
+			return
+		write = scope["method"] not in SAFE_METHODS
+		token = prefer_primary.set(write or self._marked(scope))
+		try:
+			if not write:
+				await self.app(scope, receive, send)
+				return
+
+			async def send_marked(message):
+				if message["type"] == "http.response.start":
+					message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", self.cookie)]}
+				await send(message)
+
+			await self.app(scope, receive, send_marked)
+		finally:
+			prefer_primary.reset(token)
+	#------------------------------------------------------------------------------#
+	@staticmethod
+	def _marked(scope) -> bool:
+		for name, value in scope["headers"]:
+			if name == b"cookie" and REPLICA_STICKY_COOKIE.encode() in value:
+				return REPLICA_STICKY_COOKIE in cookie_parser(value.decode("latin-1"))
+		return False
+#----------------------------------------------------------------------------------------------------------------------#
+replica_set = ReplicaSet()
+#----------------------------------------------------------------------------------------------------------------------#
+def main():
+	parser = argparse.ArgumentParser(description="État des réplicas de DATABASE_REPLICA_URLS")
+	parser.add_argument("command", choices=["status"])
+	parser.parse_args()
+	replica_set.check_all()
+	print(json.dumps(replica_set.stats(), indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+	main()
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,182 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Réservation de places (offres à capacité limitée)
+#
+# - offers.capacity = nombre de billets vendables (même unité que orders.quantity), NULL = illimité
+# - le stock restant est réparti sur RESERVATION_SHARDS lignes de offer_stock_shards : un acheteur verrouille
+#   UNE ligne libre (FOR UPDATE SKIP LOCKED) au lieu de faire la queue derrière une seule ligne "chaude"
+# - fin de vente (aucun shard n'a assez de places seul) : les shards de l'offre sont regroupés sur un seul, puis débités
+# - seat_holds garde, par commande, le shard débité et le nombre de places :
+#	held (commande 'draft') -> committed (/payments/confirm) ou released (/payments/cancel, panier annulé) ;
+#	committed -> released (remboursement /admin/orders/refund)
+# - invariant : SUM(remaining des shards) + SUM(seats des holds non 'released') = capacity
+#
+# CLI : python reservations.py provision <offer_id> <capacity> [--shards N]
+# (la capacité est lue dans le catalogue en mémoire : prise en compte par les autres workers sous CATALOG_CACHE_TTL)
+#----------------------------------------------------------------------------------------------------------------------#
+import os
+#----------------------------------------------------------------------------------------------------------------------#
+RESERVATION_SHARDS = int(os.getenv("RESERVATION_SHARDS", "16"))
+#----------------------------------------------------------------------------------------------------------------------#
+class SoldOut(Exception):
+	"""Plus assez de places pour cette offre : la transaction en cours doit être annulée."""
+#----------------------------------------------------------------------------------------------------------------------#
+# 1er essai : un shard au hasard parmi ceux qui ne sont pas verrouillés par un autre acheteur
+HOLD_SKIP_LOCKED_SQL = """
+	WITH pick AS (
+		SELECT offer_id, shard
+		FROM offer_stock_shards
+		WHERE offer_id = %(offer_id)s AND remaining >= %(seats)s
+		ORDER BY random()
+		LIMIT 1
+		FOR UPDATE SKIP LOCKED
+	), debit AS (
+		UPDATE offer_stock_shards AS s
+		SET remaining = s.remaining - %(seats)s
+		FROM pick
+		WHERE s.offer_id = pick.offer_id AND s.shard = pick.shard
+		RETURNING s.shard
+	)
+	INSERT INTO seat_holds(order_id, offer_id, shard, seats)
+	SELECT %(order_id)s, %(offer_id)s, shard, %(seats)s FROM debit
+	RETURNING shard
+"""
+# 2e essai (tous les shards occupés) : on attend un shard garni ; WHERE re-vérifié après le verrou (s'il ne passe plus :
+# verrou gardé, shard suivant), parcours dans l'ordre des shards comme le 3e essai
+HOLD_BLOCKING_SQL = HOLD_SKIP_LOCKED_SQL.replace("ORDER BY random()", "ORDER BY shard").replace(
+	"FOR UPDATE SKIP LOCKED", "FOR UPDATE"
+)
+
+# 3e essai (places éparpillées sur plusieurs shards) : tous les shards garnis verrouillés dans l'ordre, leur reste
+# regroupé sur le mieux garni et débité d'un coup ; une seule ligne seat_holds par commande, invariant inchangé
+HOLD_CONSOLIDATE_SQL = """
+	WITH locked AS (
+		SELECT shard, remaining
+		FROM offer_stock_shards
+		WHERE offer_id = %(offer_id)s AND remaining > 0
+		ORDER BY shard
+		FOR UPDATE
+	), pool AS (
+		SELECT SUM(remaining) AS remaining, (array_agg(shard ORDER BY remaining DESC, shard))[1] AS shard
+		FROM locked
+		HAVING SUM(remaining) >= %(seats)s
+	), merged AS (
+		UPDATE offer_stock_shards AS s
+		SET remaining = CASE WHEN s.shard = pool.shard THEN pool.remaining - %(seats)s ELSE 0 END
+		FROM pool, locked
+		WHERE s.offer_id = %(offer_id)s AND s.shard = locked.shard
+		RETURNING s.shard
+	)
+	INSERT INTO seat_holds(order_id, offer_id, shard, seats)
+	SELECT %(order_id)s, %(offer_id)s, shard, %(seats)s FROM pool
+	RETURNING shard
+"""
+
+# chaque essai part de ce point de sauvegarde (verrous des lignes re-vérifiées sans succès relâchés)
+SAVEPOINT_SQL = "SAVEPOINT seat_hold"
+ROLLBACK_SAVEPOINT_SQL = "ROLLBACK TO SAVEPOINT seat_hold"
+
+COMMIT_SQL = "UPDATE seat_holds SET status='committed' WHERE order_id=%s AND status='held'"
+
+# Fragments de CTE réutilisés par les requêtes "tout-en-un" de queries.py (connexion + panier, paiement, annulation)
+def _restock_cte(name: str, released: str) -> str:
+	# remet en stock les places de la CTE `released` (offer_id, shard, seats), agrégées par shard
+	return f"""{name} AS (
+		UPDATE offer_stock_shards AS s
+		SET remaining = s.remaining + agg.seats
+		FROM (SELECT offer_id, shard, SUM(seats) AS seats FROM {released} GROUP BY offer_id, shard) AS agg
+		WHERE s.offer_id = agg.offer_id AND s.shard = agg.shard
+		RETURNING s.offer_id
+	)"""
+
+def release_cte(order_expr: str) -> str:
+	"""CTE : rend les places (bloquées ou vendues) de la commande `order_expr`."""
+	return f"""order_released AS (
+		UPDATE seat_holds SET status='released'
+		WHERE order_id = {order_expr} AND status <> 'released'
+		RETURNING offer_id, shard, seats
+	), {_restock_cte("order_restocked", "order_released")}"""
+
+def release_canceled_cte(canceled: str = "canceled") -> str:
+	"""CTE : rend les places bloquées des commandes de la CTE `canceled` (id) -> drafts_released."""
+	return f"""drafts_released AS (
+		UPDATE seat_holds AS h SET status='released'
+		FROM {canceled}
+		WHERE h.order_id = {canceled}.id AND h.status = 'held'
+		RETURNING h.offer_id, h.shard, h.seats
+	), {_restock_cte("drafts_restocked", "drafts_released")}"""
+
+def cancel_drafts_cte(user_expr: str) -> str:
+	"""CTE : annule les anciens paniers de l'utilisateur `user_expr` et rend leurs places."""
+	return f"""canceled AS (
+		UPDATE orders SET status='canceled'
+		WHERE user_id = {user_expr} AND status = 'draft'
+		RETURNING id
+	), {release_canceled_cte()}"""
+#----------------------------------------------------------------------------------------------------------------------#
+async def hold(conn, offer: dict, order_id: int, seats: int):
+	"""Bloque `seats` places pour la commande ; SoldOut si l'offre est complète. Sans effet si capacité illimitée."""
+	if offer.get("capacity") is None:
+		return
+	params = {"offer_id": offer["id"], "order_id": order_id, "seats": seats}
+	# chaque essai raté est annulé jusqu'au point de sauvegarde : l'essai suivant n'attend jamais en gardant le verrou
+	# d'une ligne re-vérifiée sans succès (attentes dans l'ordre des shards -> pas d'interblocage entre acheteurs)
+	await conn.execute(SAVEPOINT_SQL)
+	for sql in (HOLD_SKIP_LOCKED_SQL, HOLD_BLOCKING_SQL, HOLD_CONSOLIDATE_SQL):
+		if await conn.fetchone(sql, params) is not None:
+			return
+		await conn.execute(ROLLBACK_SAVEPOINT_SQL)
+	raise SoldOut(offer["name"])
+#----------------------------------------------------------------------------------------------------------------------#
+async def commit(conn, offer: dict, order_id: int, seats: int):
+	"""Confirme les places au paiement (les prend maintenant si la commande n'en avait pas encore)."""
+	if offer.get("capacity") is None:
+		return
+	if await conn.execute(COMMIT_SQL, (order_id,)) == 0:
+		await hold(conn, offer, order_id, seats)
+		await conn.execute(COMMIT_SQL, (order_id,))
+#----------------------------------------------------------------------------------------------------------------------#
+def provision(cur, offer_id: int, capacity: int | None, shards: int = RESERVATION_SHARDS):
+	"""(Re)définit la capacité d'une offre (curseur psycopg2, dans la transaction de l'appelant)."""
+	shards = max(1, shards)
+	cur.execute("SELECT id FROM offers WHERE id=%s FOR UPDATE", (offer_id,))
+	if cur.fetchone() is None:
+		raise ValueError(f"Offre {offer_id} introuvable")
+	cur.execute("UPDATE offers SET capacity=%s WHERE id=%s", (capacity, offer_id))
+	cur.execute("DELETE FROM offer_stock_shards WHERE offer_id=%s", (offer_id,))
+	if capacity is None:
+		return
+	#------------------------------------------------------------------------------#
+	# les places déjà bloquées/vendues restent dues : on les rattache aux nouveaux shards
+	cur.execute(
+		"UPDATE seat_holds SET shard = shard %% %s WHERE offer_id=%s AND status <> 'released'",
+		(shards, offer_id)
+	)
+	cur.execute(
+		"SELECT COALESCE(SUM(seats), 0) FROM seat_holds WHERE offer_id=%s AND status <> 'released'",
+		(offer_id,)
+	)
+	available = max(0, capacity - cur.fetchone()[0])
+	base, extra = divmod(available, shards)
+	cur.executemany(
+		"INSERT INTO offer_stock_shards(offer_id, shard, remaining) VALUES(%s, %s, %s)",
+		[(offer_id, i, base + (1 if i < extra else 0)) for i in range(shards)]
+	)
+#----------------------------------------------------------------------------------------------------------------------#
+if __name__ == "__main__":
+	import argparse
+	from db_pool import get_pool
+
+	parser = argparse.ArgumentParser(description="Capacité des offres")
+	sub = parser.add_subparsers(dest="command", required=True)
+	p = sub.add_parser("provision", help="définir la capacité d'une offre")
+	p.add_argument("offer_id", type=int)
+	p.add_argument("capacity", type=int, help="nombre de billets ; -1 = illimité")
+	p.add_argument("--shards", type=int, default=RESERVATION_SHARDS)
+	args = parser.parse_args()
+
+	capacity = None if args.capacity < 0 else args.capacity
+	with get_pool().connection() as conn:
+		with conn.cursor() as cur:
+			provision(cur, args.offer_id, capacity, args.shards)
+	print(f"offre {args.offer_id} : capacité {capacity if capacity is not None else 'illimitée'}, {args.shards} shard(s)")
+#----------------------------------------------------------------------------------------------------------------------#
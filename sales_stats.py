@@ -0,0 +1,143 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Statistiques de ventes par offre, maintenues au fil de l'eau
+#
+# - offer_sales_stats(offer_id, shard) : packs vendus et chiffre d'affaires, mis à jour DANS la transaction
+#   de /payments/confirm (+) et du remboursement /admin/orders/refund (-), via record_from dans queries.py
+# - plusieurs lignes (shards) par offre : deux paiements simultanés sur la même offre ne se bloquent pas
+# - la page /admin lit O(nombre d'offres x STATS_SHARDS) lignes au lieu d'agréger toutes les commandes payées
+#
+# CLI : python sales_stats.py verify   -> compare aux commandes payées (table orders), code retour 1 si écart
+#       python sales_stats.py rebuild  -> recalcule tout depuis orders
+#       commandes archivées (partitions.py archive) : leurs ventes, cumulées dans offer_sales_archived au moment
+#       de l'archivage, sont ajoutées à celles de orders par les deux commandes
+#----------------------------------------------------------------------------------------------------------------------#
+import os, random
+#----------------------------------------------------------------------------------------------------------------------#
+STATS_SHARDS = int(os.getenv("STATS_SHARDS", "8"))
+#----------------------------------------------------------------------------------------------------------------------#
+def record_from(rows_sql: str) -> str:
+	"""Cumul des lignes (offer_id, shard, packs, turnover) de `rows_sql` (VALUES ou SELECT, utilisable dans une CTE)."""
+	return f"""
+	INSERT INTO offer_sales_stats(offer_id, shard, total_packs, total_turnover)
+	{rows_sql}
+	ON CONFLICT (offer_id, shard) DO UPDATE
+	SET total_packs = offer_sales_stats.total_packs + EXCLUDED.total_packs,
+		total_turnover = offer_sales_stats.total_turnover + EXCLUDED.total_turnover
+	"""
+
+# Montant d'une commande payée, seule définition : chiffre d'affaires des statistiques = quantity x prix (euros),
+# payments.amount_cents = ce montant en centimes (/payments/confirm, import en masse, tools/gen_dataset.py)
+AMOUNT_CENTS_SQL = "quantity * prix * 100"		# colonnes quantity et prix de la ligne source
+
+def amount_cents(quantity: int, prix: int) -> int:
+	return quantity * prix * 100
+
+# Lecture du tableau de bord : mêmes colonnes que l'ancien agrégat sur orders
+DASHBOARD_SQL = """
+	SELECT
+		of.id,
+		of.name,
+		of.nbr_ticket,
+		of.prix,
+		COALESCE(s.total_packs, 0) AS total_packs,
+		COALESCE(s.total_packs, 0) * of.nbr_ticket AS total_persons,
+		COALESCE(s.total_turnover, 0) AS total_turnover
+	FROM offers of
+	LEFT JOIN (
+		SELECT offer_id, SUM(total_packs) AS total_packs, SUM(total_turnover) AS total_turnover
+		FROM offer_sales_stats
+		GROUP BY offer_id
+	) s ON s.offer_id = of.id
+	ORDER BY of.id ASC
+"""
+
+# Recalcul depuis la source de vérité (commandes payées + ventes des commandes archivées)
+RAW_SQL = """
+	SELECT offer_id, SUM(total_packs) AS total_packs, SUM(total_turnover) AS total_turnover
+	FROM (
+		SELECT
+			of.id AS offer_id,
+			COALESCE(SUM(o.quantity), 0) AS total_packs,
+			COALESCE(SUM(o.quantity * of.prix), 0) AS total_turnover
+		FROM offers of
+		LEFT JOIN orders o
+			ON o.offer_id = of.id
+		   AND o.status = 'paid'
+		GROUP BY of.id
+		UNION ALL
+		SELECT offer_id, total_packs, total_turnover FROM offer_sales_archived
+	) sales
+	GROUP BY offer_id
+"""
+
+VERIFY_SQL = f"""
+	WITH raw AS ({RAW_SQL}),
+	inc AS (
+		SELECT offer_id, SUM(total_packs) AS total_packs, SUM(total_turnover) AS total_turnover
+		FROM offer_sales_stats
+		GROUP BY offer_id
+	)
+	SELECT
+		raw.offer_id,
+		raw.total_packs AS expected_packs,
+		COALESCE(inc.total_packs, 0) AS actual_packs,
+		raw.total_turnover AS expected_turnover,
+		COALESCE(inc.total_turnover, 0) AS actual_turnover
+	FROM raw
+	LEFT JOIN inc ON inc.offer_id = raw.offer_id
+	WHERE raw.total_packs <> COALESCE(inc.total_packs, 0)
+	   OR raw.total_turnover <> COALESCE(inc.total_turnover, 0)
+	ORDER BY raw.offer_id
+"""
+#----------------------------------------------------------------------------------------------------------------------#
+def random_shard() -> int:
+	return random.randrange(max(1, STATS_SHARDS))
+#----------------------------------------------------------------------------------------------------------------------#
+def verify(cur) -> list:
+	"""Écarts entre les statistiques et les commandes payées ou archivées (lecture cohérente d'un seul instantané)."""
+	cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+	cur.execute(VERIFY_SQL)
+	return cur.fetchall()
+#----------------------------------------------------------------------------------------------------------------------#
+def rebuild(cur) -> int:
+	"""Recalcule offer_sales_stats depuis orders (+ offer_sales_archived) ; les paiements/annulations attendent la fin
+	du recalcul."""
+	cur.execute("LOCK TABLE orders, offer_sales_archived IN SHARE MODE")
+	cur.execute("LOCK TABLE offer_sales_stats IN EXCLUSIVE MODE")
+	cur.execute("DELETE FROM offer_sales_stats")
+	cur.execute(f"""
+		INSERT INTO offer_sales_stats(offer_id, shard, total_packs, total_turnover)
+		SELECT offer_id, 0, total_packs, total_turnover FROM ({RAW_SQL}) raw
+		WHERE total_packs <> 0 OR total_turnover <> 0
+	""")
+	return cur.rowcount
+#----------------------------------------------------------------------------------------------------------------------#
+if __name__ == "__main__":
+	import argparse, sys
+	from db_pool import get_pool
+
+	parser = argparse.ArgumentParser(
+		description="Statistiques de ventes par offre",
+		epilog="Les ventes des commandes archivées (python partitions.py archive) sont comptées via offer_sales_archived.",
+	)
+	parser.add_argument("command", choices=["verify", "rebuild"])
+	args = parser.parse_args()
+
+	with get_pool().connection() as conn:
+		with conn.cursor() as cur:
+			if args.command == "rebuild":
+				rebuilt = rebuild(cur)
+			else:
+				drift = verify(cur)
+
+	if args.command == "rebuild":
+		print(f"{rebuilt} offre(s) recalculée(s)")
+		sys.exit(0)
+	if not drift:
+		print("OK : statistiques conformes aux commandes payées")
+		sys.exit(0)
+	print("offre  packs attendus  packs stockés  CA attendu  CA stocké")
+	for offer_id, exp_packs, act_packs, exp_ca, act_ca in drift:
+		print(f"{offer_id:>5}  {exp_packs:>14}  {act_packs:>13}  {exp_ca:>10}  {act_ca:>9}")
+	sys.exit(1)
+#----------------------------------------------------------------------------------------------------------------------#
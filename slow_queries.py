@@ -0,0 +1,148 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Journal des requêtes SQL lentes, avec leur plan d'exécution
+#
+# - toute requête chronométrée par metrics.py (pool psycopg2 et façade async) au-delà de SLOW_QUERY_MS est mise en
+#   file ; la requête HTTP qui l'a émise ne fait rien de plus qu'un put_nowait (file pleine : entrée abandonnée)
+# - un thread dédié, avec sa propre connexion (hors pool, non chronométrée), rejoue la requête sous
+#   EXPLAIN (ANALYZE, BUFFERS) dans une transaction READ ONLY annulée ensuite, bornée par statement_timeout ;
+#   écriture (INSERT / UPDATE / FOR UPDATE...) refusée en lecture seule -> EXPLAIN sans exécution
+# - un plan au plus par empreinte toutes les SLOW_QUERY_EXPLAIN_INTERVAL s : quand tout ralentit, le journal ne
+#   double pas la charge de la base
+# - une ligne JSON par requête lente dans SLOW_QUERY_LOG (texte normalisé, durée, route HTTP, plan) ; les plans
+#   contiennent les valeurs des paramètres (emails...) : fichier réservé à l'exploitation
+#----------------------------------------------------------------------------------------------------------------------#
+import json, os, queue, re, threading, time
+import psycopg2
+import psycopg2.errors
+#----------------------------------------------------------------------------------------------------------------------#
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))								# 0 = journal désactivé
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "slow_queries.ndjson")
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "analyze")						# analyze | plan | off
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "60"))	# s entre deux plans d'une empreinte
+SLOW_QUERY_EXPLAIN_TIMEOUT = os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT", "10s")			# statement_timeout de l'EXPLAIN
+SLOW_QUERY_QUEUE = int(os.getenv("SLOW_QUERY_QUEUE", "100"))
+
+SLOW_QUERY_SECONDS = SLOW_QUERY_MS / 1000 if SLOW_QUERY_MS > 0 else float("inf")
+EXPLAINABLE = re.compile(r"[\s(]*(SELECT|WITH|INSERT|UPDATE|DELETE|VALUES|TABLE)\b", re.IGNORECASE)
+#----------------------------------------------------------------------------------------------------------------------#
+class SlowQueryLog:
+	def __init__(self, path: str = SLOW_QUERY_LOG, explain: str = SLOW_QUERY_EXPLAIN,
+				 interval: float = SLOW_QUERY_EXPLAIN_INTERVAL, maxsize: int = SLOW_QUERY_QUEUE):
+		self.path = path
+		self.explain = explain
+		self.interval = interval
+		self._queue = queue.Queue(maxsize=max(1, maxsize))
+		self._lock = threading.Lock()
+		self._thread = None
+		self._conn = None
+		self._explained = {}		# empreinte -> instant du dernier plan
+		#------------------------------------------------------------------------------#
+		self.captured = 0
+		self.dropped = 0
+		self.explained = 0
+		self.explain_errors = 0
+		self.write_errors = 0
+		self.last = None
+	#------------------------------------------------------------------------------#
+	def capture(self, fingerprint: str, query: str, statement, params, seconds: float, rows: int, route,
+				failed: bool = False):
+		"""Appelé sur le chemin de la requête : ne bloque jamais."""
+		entry = {
+			"at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+			"ms": round(seconds * 1000, 3),
+			"rows": max(rows, 0),
+			"failed": failed,
+			"route": route,
+			"fingerprint": fingerprint,
+			"query": query,
+			"pid": os.getpid(),
+		}
+		try:
+			self._queue.put_nowait((entry, statement, params))
+		except queue.Full:
+			self.dropped += 1
+			return
+		self.captured += 1
+		if self._thread is None:
+			with self._lock:
+				if self._thread is None:
+					self._thread = threading.Thread(target=self._run, name="slow-queries", daemon=True)
+					self._thread.start()
+	#------------------------------------------------------------------------------#
+	def _run(self):
+		while True:
+			entry, statement, params = self._queue.get()
+			self._handle(entry, statement, params)
+	#------------------------------------------------------------------------------#
+	def _handle(self, entry: dict, statement, params):
+		if isinstance(statement, bytes):
+			statement = statement.decode("utf-8", "replace")
+		now = time.monotonic()
+		if self.explain == "off" or statement is None or not EXPLAINABLE.match(statement):
+			entry["explain"] = None
+		elif now - self._explained.get(entry["fingerprint"], float("-inf")) < self.interval:
+			entry["explain"] = "skipped"		# plan de cette empreinte déjà relevé récemment
+		else:
+			self._explained[entry["fingerprint"]] = now
+			try:
+				entry["explain"], entry["plan"] = self._explain(statement, params)
+				self.explained += 1
+			except Exception as e:
+				self.explain_errors += 1
+				entry["explain"] = "error"
+				entry["error"] = str(e).strip()
+		#------------------------------------------------------------------------------#
+		self.last = entry
+		try:
+			with open(self.path, "a", encoding="utf-8") as fichier:
+				fichier.write(json.dumps(entry, ensure_ascii=False) + "\n")
+		except OSError:
+			self.write_errors += 1
+	#------------------------------------------------------------------------------#
+	def _connection(self):
+		if self._conn is None or self._conn.closed:
+			# import local : db_pool importe metrics, qui importe ce module
+			from db_pool import DATABASE_URL, DATABASE_SSLMODE
+			self._conn = psycopg2.connect(DATABASE_URL, sslmode=DATABASE_SSLMODE,
+				application_name="slow_queries", options=f"-c statement_timeout={SLOW_QUERY_EXPLAIN_TIMEOUT}")
+		return self._conn
+	#------------------------------------------------------------------------------#
+	def _explain(self, statement: str, params) -> tuple:
+		"""(mode, plan texte) ; la transaction est toujours annulée, rien de ce que rejoue l'EXPLAIN ne reste."""
+		conn = self._connection()
+		modes = ["analyze", "plan"] if self.explain == "analyze" else ["plan"]
+		for mode in modes:
+			try:
+				with conn.cursor() as cur:
+					if mode == "analyze":
+						cur.execute("SET TRANSACTION READ ONLY")
+						cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, params)
+					else:
+						cur.execute("EXPLAIN (COSTS) " + statement, params)		# options explicites : "(SELECT ...) UNION ..."
+					plan = "\n".join(row[0] for row in cur.fetchall())
+				return mode, plan
+			except psycopg2.errors.ReadOnlySqlTransaction:
+				continue		# requête d'écriture : plan estimé seulement
+			except (psycopg2.OperationalError, psycopg2.InterfaceError):
+				conn.close()
+				raise
+			finally:
+				if not conn.closed:
+					conn.rollback()
+		raise RuntimeError("EXPLAIN impossible")
+	#------------------------------------------------------------------------------#
+	def stats(self) -> dict:
+		return {
+			"threshold_ms": SLOW_QUERY_MS or None,
+			"explain": self.explain,
+			"queued": self._queue.qsize(),
+			"captured": self.captured,
+			"dropped": self.dropped,
+			"explained": self.explained,
+			"explain_errors": self.explain_errors,
+			"write_errors": self.write_errors,
+			"last": {k: v for k, v in self.last.items() if k != "plan"} if self.last else None,
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+slow_log = SlowQueryLog()
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,67 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Registre de gabarits HTML (fichiers de static/)
+# - chaque fichier est lu une seule fois puis découpé à ses marqueurs <!--NOM--> en segments
+# - le rendu est un simple "".join() des segments (plus de str.replace successifs sur tout le document)
+# - TEMPLATES_RELOAD=1 (dev uniquement) : relecture du fichier si son mtime a changé
+# - rewrite : transformation du texte au chargement (URL /static/... -> URL à empreinte, voir assets.py)
+#----------------------------------------------------------------------------------------------------------------------#
+import os, re, threading
+#----------------------------------------------------------------------------------------------------------------------#
+TEMPLATES_RELOAD = os.getenv("TEMPLATES_RELOAD", "0") == "1"
+
+# Marqueurs : <!--BODY_HTML-->, <!--ROWS_HERE-->... (les commentaires HTML ordinaires ne sont pas concernés)
+MARKER_RE = re.compile(r"<!--([A-Z][A-Z0-9_]*)-->")
+#----------------------------------------------------------------------------------------------------------------------#
+class Template:
+	def __init__(self, path: str, rewrite=None):
+		self.path = path
+		self.rewrite = rewrite
+		self.load()
+	#------------------------------------------------------------------------------#
+	def load(self):
+		mtime = os.stat(self.path).st_mtime_ns
+		with open(self.path, "r", encoding="utf-8") as fichier:
+			text = fichier.read()
+		if self.rewrite is not None:
+			text = self.rewrite(text)
+		#------------------------------------------------------------------------------#
+		# segments = [texte, marqueur, texte, marqueur, ..., texte] ; slots = (index, nom) des marqueurs
+		parts = MARKER_RE.split(text)
+		slots = [(i, parts[i]) for i in range(1, len(parts), 2)]
+		# une seule affectation : un rendu concurrent voit l'ancienne ou la nouvelle version, jamais un mélange
+		self.compiled = (parts, slots, text.encode("utf-8"))
+		self.mtime = mtime
+	#------------------------------------------------------------------------------#
+	def render(self, **values) -> str:
+		"""Remplace chaque marqueur par values[NOM] (chaîne vide si absent)."""
+		segments, slots, _ = self.compiled
+		parts = segments.copy()
+		for i, name in slots:
+			parts[i] = values.get(name, "")
+		return "".join(parts)
+#----------------------------------------------------------------------------------------------------------------------#
+class TemplateRegistry:
+	def __init__(self, directory: str = "static", reload: bool = TEMPLATES_RELOAD, rewrite=None):
+		self.directory = directory
+		self.reload = reload
+		self.rewrite = rewrite
+		self._templates = {}
+		self._lock = threading.Lock()
+	#------------------------------------------------------------------------------#
+	def get(self, name: str) -> Template:
+		template = self._templates.get(name)
+		if template is None:
+			with self._lock:
+				template = self._templates.get(name)
+				if template is None:
+					template = Template(os.path.join(self.directory, name), self.rewrite)
+					self._templates[name] = template
+		elif self.reload and os.stat(template.path).st_mtime_ns != template.mtime:
+			with self._lock:
+				template.load()
+		return template
+	#------------------------------------------------------------------------------#
+	def page(self, name: str) -> bytes:
+		"""Page entièrement statique, déjà encodée en UTF-8."""
+		return self.get(name).compiled[2]
+#----------------------------------------------------------------------------------------------------------------------#
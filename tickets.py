@@ -0,0 +1,303 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# E-billets : QR code de payments.final_key en SVG / PNG (/tickets/{final_key}.svg|png)
+#
+# - l'image ne dépend que de la clé et des paramètres de rendu : adresse = blake2b(version de rendu, format, clé)
+#   -> ETag fort et "immutable" (le navigateur du téléphone ne redemande plus l'image), et cache sans invalidation
+# - deux niveaux : LRU en mémoire (TICKET_CACHE_BYTES par worker) puis fichiers sur disque (TICKET_CACHE_DIR,
+#   partagés entre workers) ; un billet déjà rendu ne refait ni calcul QR ni requête SQL
+# - rendu direct depuis la matrice du QR (chemin SVG par segments de ligne, PNG 1 bit écrit à la main) : bien
+#   moins coûteux que les fabriques d'images de qrcode ; deux demandes simultanées du même billet ne le calculent qu'une fois
+# - pré-rendu : en tâche de fond après /payments/confirm (TICKET_PRERENDER), et en lot pour les billets déjà
+#   émis (import de groupe, avant l'ouverture des portes) :
+#
+#	python tickets.py prerender [--since AAAA-MM-JJ] [--workers 4]
+#	python tickets.py render <clé> billet.svg
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, collections, concurrent.futures, hashlib, multiprocessing, os, struct, tempfile, threading, time, zlib
+from importlib.metadata import version
+import qrcode
+from db_pool import get_pool, close_pool
+#----------------------------------------------------------------------------------------------------------------------#
+TICKET_CACHE_BYTES = int(os.getenv("TICKET_CACHE_BYTES", str(32 * 2**20)))		# LRU mémoire, par worker
+TICKET_CACHE_DIR = os.getenv("TICKET_CACHE_DIR", "ticket_cache")					# "" = pas de cache disque
+TICKET_PNG_SCALE = int(os.getenv("TICKET_PNG_SCALE", "8"))						# pixels par module
+TICKET_PRERENDER = os.getenv("TICKET_PRERENDER", "1") == "1"						# rendu après paiement
+
+QR_BORDER = 4					# zone de silence exigée par la norme (modules)
+MEDIA_TYPES = {"svg": "image/svg+xml", "png": "image/png"}
+CACHE_CONTROL = "private, max-age=31536000, immutable"		# billet personnel : pas de cache partagé
+# toute modification du rendu doit changer cette chaîne (nouvelles adresses, anciens ETag périmés)
+RENDER_VERSION = f"qr{version('qrcode')}-M-b{QR_BORDER}-s{TICKET_PNG_SCALE}-r1"
+
+PAID_KEY_SQL = "SELECT 1 FROM payments WHERE final_key = %s AND status = 'success'"
+PAID_KEYS_SQL = "SELECT final_key FROM payments WHERE status = 'success' AND final_key IS NOT NULL {condition}"
+#----------------------------------------------------------------------------------------------------------------------#
+def address(final_key: str, fmt: str) -> str:
+	return hashlib.blake2b(f"{RENDER_VERSION}|{fmt}|{final_key}".encode(), digest_size=16).hexdigest()
+
+def etag(final_key: str, fmt: str) -> str:
+	return f'"{address(final_key, fmt)}"'
+#----------------------------------------------------------------------------------------------------------------------#
+def matrix(final_key: str) -> list:
+	qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=QR_BORDER)
+	qr.add_data(final_key)
+	qr.make(fit=True)
+	return qr.get_matrix()		# lignes de booléens, zone de silence comprise
+
+def _svg(modules: list) -> bytes:
+	# un sous-chemin par suite de modules noirs d'une ligne (M x y h n v1 h -n z), coordonnées en modules
+	size = len(modules)
+	parts = []
+	for y, row in enumerate(modules):
+		x = 0
+		while x < size:
+			if row[x]:
+				start = x
+				while x < size and row[x]:
+					x += 1
+				parts.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+			else:
+				x += 1
+	return (
+		f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+		f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{"".join(parts)}"/></svg>'
+	).encode()
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+	return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+def _png(modules: list) -> bytes:
+	# PNG 1 bit en niveaux de gris écrit directement (lignes empaquetées par int.to_bytes) : 0 = noir
+	scale = TICKET_PNG_SCALE
+	width = len(modules) * scale
+	pad = -width % 8
+	raw = bytearray()
+	for row in modules:
+		bits = "".join("0" * scale if dark else "1" * scale for dark in row) + "0" * pad
+		line = b"\x00" + int(bits, 2).to_bytes((width + pad) // 8, "big")		# filtre 0 (aucun)
+		raw += line * scale
+	return b"".join((
+		b"\x89PNG\r\n\x1a\n",
+		_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, width, 1, 0, 0, 0, 0)),
+		_png_chunk(b"IDAT", zlib.compress(bytes(raw), 9)),
+		_png_chunk(b"IEND", b""),
+	))
+
+RENDERERS = {"svg": _svg, "png": _png}
+#----------------------------------------------------------------------------------------------------------------------#
+class TicketImages:
+	def __init__(self, max_bytes: int = TICKET_CACHE_BYTES, directory: str = TICKET_CACHE_DIR):
+		self.max_bytes = max_bytes
+		self.directory = directory
+		self._items = collections.OrderedDict()		# adresse -> octets, du moins au plus récemment servi
+		self._bytes = 0
+		self._lock = threading.Lock()
+		self._inflight = {}							# adresse -> Event du rendu en cours
+		#------------------------------------------------------------------------------#
+		self.memory_hits = 0
+		self.disk_hits = 0
+		self.renders = 0
+		self.render_seconds = 0.0
+		self.evictions = 0
+		self.disk_errors = 0
+	#------------------------------------------------------------------------------#
+	def _path(self, addr: str, fmt: str) -> str:
+		return os.path.join(self.directory, addr[:2], f"{addr}.{fmt}")
+	#------------------------------------------------------------------------------#
+	def _remember(self, addr: str, data: bytes):
+		if len(data) > self.max_bytes:
+			return
+		with self._lock:
+			if addr in self._items:
+				self._items.move_to_end(addr)
+				return
+			self._items[addr] = data
+			self._bytes += len(data)
+			while self._bytes > self.max_bytes:
+				_, old = self._items.popitem(last=False)
+				self._bytes -= len(old)
+				self.evictions += 1
+	#------------------------------------------------------------------------------#
+	def _write(self, addr: str, fmt: str, data: bytes):
+		# écriture atomique (fichier temporaire puis rename) : un autre worker ne lit jamais un fichier partiel
+		path = self._path(addr, fmt)
+		try:
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+			with os.fdopen(fd, "wb") as fichier:
+				fichier.write(data)
+			os.replace(tmp, path)
+		except OSError:
+			self.disk_errors += 1
+	#------------------------------------------------------------------------------#
+	def cached(self, final_key: str, fmt: str) -> bytes | None:
+		"""Image déjà rendue (mémoire seulement, sans E/S) ou None."""
+		addr = address(final_key, fmt)
+		with self._lock:
+			data = self._items.get(addr)
+			if data is not None:
+				self._items.move_to_end(addr)
+				self.memory_hits += 1
+		return data
+	#------------------------------------------------------------------------------#
+	def stored(self, final_key: str, fmt: str) -> bytes | None:
+		"""Image déjà rendue (mémoire puis disque, remontée en mémoire) ou None."""
+		data = self.cached(final_key, fmt)
+		if data is not None or not self.directory:
+			return data
+		addr = address(final_key, fmt)
+		try:
+			with open(self._path(addr, fmt), "rb") as fichier:
+				data = fichier.read()
+		except FileNotFoundError:
+			return None
+		except OSError:
+			self.disk_errors += 1
+			return None
+		self.disk_hits += 1
+		self._remember(addr, data)
+		return data
+	#------------------------------------------------------------------------------#
+	def render(self, final_key: str, fmt: str) -> bytes:
+		"""Image du billet, rendue si besoin (à appeler hors boucle asyncio : calcul et E/S disque)."""
+		data = self.stored(final_key, fmt)
+		if data is not None:
+			return data
+		addr = address(final_key, fmt)
+		with self._lock:
+			pending = self._inflight.get(addr)
+			if pending is None:
+				self._inflight[addr] = threading.Event()
+		if pending is not None:
+			# même billet demandé en parallèle (page de confirmation + pré-rendu) : on attend le premier rendu
+			pending.wait(5)
+			data = self.cached(final_key, fmt)
+			if data is not None:
+				return data
+		try:
+			return self._render(final_key, {fmt: addr})[fmt]
+		finally:
+			if pending is None:
+				with self._lock:
+					self._inflight.pop(addr).set()
+	#------------------------------------------------------------------------------#
+	def _render(self, final_key: str, missing: dict, keep_in_memory: bool = True) -> dict:
+		# une seule matrice QR (le plus coûteux : choix du masque) pour tous les formats demandés
+		started = time.perf_counter()
+		modules = matrix(final_key)
+		images = {fmt: RENDERERS[fmt](modules) for fmt in missing}
+		self.renders += len(images)
+		self.render_seconds += time.perf_counter() - started
+		for fmt, data in images.items():
+			if self.directory:
+				self._write(missing[fmt], fmt, data)
+			if keep_in_memory:
+				self._remember(missing[fmt], data)
+		return images
+	#------------------------------------------------------------------------------#
+	def prerender(self, final_keys, keep_in_memory: bool = True) -> int:
+		"""Rend les formats pas encore en cache de ces billets (une seule matrice QR par billet) ; nombre d'images."""
+		count = 0
+		for final_key in final_keys:
+			missing = {}
+			with self._lock:
+				for fmt in MEDIA_TYPES:
+					addr = address(final_key, fmt)
+					if addr in self._items or addr in self._inflight:
+						continue
+					if self.directory and os.path.exists(self._path(addr, fmt)):
+						continue
+					missing[fmt] = addr
+					self._inflight[addr] = threading.Event()		# un /tickets/... simultané attend ce rendu
+			if not missing:
+				continue
+			try:
+				# lot CLI (keep_in_memory=False) : disque seulement, le LRU du processus ne sert à rien
+				count += len(self._render(final_key, missing, keep_in_memory))
+			finally:
+				with self._lock:
+					for addr in missing.values():
+						self._inflight.pop(addr).set()
+		return count
+	#------------------------------------------------------------------------------#
+	def stats(self) -> dict:
+		return {
+			"items": len(self._items),
+			"bytes": self._bytes,
+			"max_bytes": self.max_bytes,
+			"memory_hits": self.memory_hits,
+			"disk_hits": self.disk_hits,
+			"renders": self.renders,
+			"render_ms_avg": round(1000 * self.render_seconds / self.renders, 2) if self.renders else None,
+			"evictions": self.evictions,
+			"disk_errors": self.disk_errors,
+			"directory": self.directory or None,
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+ticket_images = TicketImages()
+#----------------------------------------------------------------------------------------------------------------------#
+def _prerender_batch(final_keys: list) -> int:
+	return ticket_images.prerender(final_keys, keep_in_memory=False)
+
+def prerender_paid(since=None, workers: int = 1, batch: int = 1000) -> dict:
+	"""Pré-rendu disque de tous les billets payés (depuis `since`) ; lots répartis sur `workers` processus."""
+	import partitions
+	condition, params = partitions.created_range_clause("created_at", since, None) if since else ("", [])
+	started = time.perf_counter()
+	tickets = images = 0
+	with get_pool().connection() as conn:
+		with conn.cursor(name="tickets_prerender") as cur, \
+				concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+			cur.itersize = batch
+			cur.execute(PAID_KEYS_SQL.format(condition=condition), params)
+			futures = []
+			while True:
+				rows = cur.fetchmany(batch)
+				if not rows:
+					break
+				keys = [r[0] for r in rows]
+				tickets += len(keys)
+				futures.append(executor.submit(_prerender_batch, keys))
+				# au plus 2 lots en attente par processus : mémoire bornée sur les grosses bases
+				while len(futures) >= 2 * workers:
+					done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+					images += sum(f.result() for f in done)
+					futures = [f for f in futures if f not in done]
+			images += sum(f.result() for f in futures)
+	elapsed = time.perf_counter() - started
+	return {
+		"tickets": tickets,
+		"rendered": images,
+		"seconds": round(elapsed, 2),
+		"tickets_per_s": round(tickets / elapsed) if elapsed else None,
+	}
+#----------------------------------------------------------------------------------------------------------------------#
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Rendu des QR codes des e-billets")
+	commands = parser.add_subparsers(dest="command", required=True)
+	cmd = commands.add_parser("prerender", help="rendre sur disque les billets payés (cache partagé)")
+	cmd.add_argument("--since", help="AAAA-MM-JJ : billets commandés depuis cette date")
+	cmd.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+	cmd = commands.add_parser("render", help="écrire l'image d'une clé dans un fichier (.svg / .png)")
+	cmd.add_argument("final_key")
+	cmd.add_argument("path")
+	args = parser.parse_args()
+	#------------------------------------------------------------------------------#
+	if args.command == "prerender":
+		import json, partitions
+		since = partitions.parse_day(args.since)
+		if args.since and since is None:
+			parser.error("--since attend une date AAAA-MM-JJ")
+		if not TICKET_CACHE_DIR:
+			parser.error("TICKET_CACHE_DIR est vide : pas de cache disque à remplir")
+		try:
+			print(json.dumps(prerender_paid(since, args.workers)))
+		finally:
+			close_pool()
+	else:
+		fmt = os.path.splitext(args.path)[1].lstrip(".")
+		if fmt not in RENDERERS:
+			parser.error("extension attendue : .svg ou .png")
+		with open(args.path, "wb") as fichier:
+			fichier.write(RENDERERS[fmt](matrix(args.final_key)))
+#----------------------------------------------------------------------------------------------------------------------#
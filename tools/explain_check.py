@@ -0,0 +1,240 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Non-régression des plans d'exécution : chaque requête de l'application doit passer par un index
+#
+#	DATABASE_SSLMODE=disable python tools/explain_check.py [--users 20000] [--orders 200000] [--partitioned] [--keep]
+#
+# 1) crée un schéma jetable "explain_check" dans la base DATABASE_URL et y applique database/init_database_JO.sql
+# 2) y charge un jeu de données synthétique (generate_series) puis ANALYZE
+# 3) EXPLAIN (FORMAT JSON) de chaque requête (textes importés de queries.py, draft_sweeper.py...)
+#	-> échec si un "Seq Scan" touche une grosse table ou si aucun des index attendus n'apparaît dans le plan
+# --partitioned : mêmes vérifications après partitions.migrate (orders / payments partitionnées par mois), plus
+# l'élagage : /admin/orders filtrée sur un mois ne doit lire qu'une partition de orders
+# Code retour 1 en cas de régression : à lancer en intégration continue avec une base PostgreSQL locale.
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, json, os, sys
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psycopg2
+import queries, draft_sweeper, partitions, gate
+from db_pool import DATABASE_URL, DATABASE_SSLMODE
+from pagination import encode_cursor, keyset_clause
+#----------------------------------------------------------------------------------------------------------------------#
+SCHEMA = "explain_check"
+BIG_TABLES = {"users", "orders", "payments", "seat_holds"}
+SMALL_PARTITION = 1000		# lignes : un Seq Scan sur une partition plus petite (mois à venir, DEFAULT) est normal
+#----------------------------------------------------------------------------------------------------------------------#
+def checks(nb_users: int, nb_orders: int) -> list:
+	"""(nom, requête, paramètres, index acceptés)
+
+	Index acceptés : un ensemble (au moins un de ces index) ou une liste d'ensembles (chacun doit être satisfait,
+	ex: les deux branches de /my/orders).
+	Listes admin : WHERE status = ? AND id > ? ORDER BY id LIMIT n -> le planificateur peut aussi parcourir
+	orders_pkey dans l'ordre en filtrant le statut ; les deux plans sont bornés par le LIMIT.
+	"""
+	user_id = nb_users // 2
+	order_id = nb_orders // 2
+	after = encode_cursor("orders:paid", order_id)
+	users_cond, users_order, users_params, _ = keyset_clause("id", "users", encode_cursor("users", user_id), None)
+	paid_cond, paid_order, paid_params, _ = keyset_clause("o.id", "orders:paid", after, None)
+	draft_cond, draft_order, draft_params, _ = keyset_clause(
+		"o.id", "orders:draft", encode_cursor("orders:draft", order_id), None
+	)
+	tickets_cond, tickets_order, tickets_params, _ = keyset_clause(
+		"o.id", "tickets", encode_cursor("tickets", order_id), None
+	)
+	draft = {"user_id": user_id, "offer_id": 1, "quantity": 1}
+	confirm = {"order_id": order_id, "user_id": user_id, "idempotency_key": "k", "key2": "x", "stats_shard": 0}
+	return [
+		("login", queries.LOGIN_SQL, {"email": f"user{user_id}@synthetic.local"}, {"users_email_key"}),
+		("login rehash", queries.REHASH_PASSWORD_SQL, {"user_id": user_id, "old": "x", "new": "y"}, {"users_pkey"}),
+		("my_orders", queries.MY_ORDERS_SQL, {"user_id": user_id}, [{"idx_orders_user_draft"}, {"idx_orders_user_paid"}]),
+		("api panier", queries.API_CART_SQL, (user_id,), {"idx_orders_user_draft"}),
+		(
+			"api billets (curseur)",
+			queries.API_TICKETS_SQL.format(condition=tickets_cond, order=tickets_order),
+			(user_id, *tickets_params, 51),
+			[{"idx_orders_user_paid"}, {"idx_payments_order", "payments_one_success_per_order"}],
+		),
+		("nouveau panier", queries.REPLACE_DRAFT_SQL, draft, {"idx_orders_user_draft"}),
+		("pay", queries.PAY_PAGE_SQL, (order_id, user_id), {"orders_pkey"}),
+		(
+			"confirm rejeu",
+			queries.PAYMENT_REPLAY_SQL,
+			confirm,
+			[{"idx_payments_order", "payments_one_success_per_order"}, {"orders_pkey", "idx_orders_user_paid"}],
+		),
+		("confirm", queries.CONFIRM_PAYMENT_SQL, confirm, [{"orders_pkey"}, {"users_pkey"}, {"seat_holds_pkey"}]),
+		(
+			"cancel",
+			queries.CANCEL_ORDER_SQL,
+			{"order_id": order_id, "user_id": user_id, "stats_shard": 0},
+			[{"orders_pkey", "idx_orders_user_draft"}, {"seat_holds_pkey"}],
+		),
+		(
+			"remboursement (admin)",
+			queries.REFUND_ORDER_SQL,
+			{"order_id": order_id, "stats_shard": 0},
+			[{"orders_pkey", "idx_orders_status_id"}, {"seat_holds_pkey"}],
+		),
+		(
+			"expiration paniers (lot)",
+			draft_sweeper.EXPIRE_BATCH_SQL,
+			{"ttl": 1800, "batch": 500},
+			[{"idx_orders_status_id", "idx_orders_user_draft"}, {"seat_holds_pkey"}],
+		),
+		(
+			"admin_orders payés (curseur)",
+			queries.ADMIN_ORDERS_SQL.format(condition=paid_cond, order=paid_order),
+			("paid", *paid_params, 11),
+			{"idx_orders_status_id", "orders_pkey"},
+		),
+		(
+			"admin_orders brouillons (curseur)",
+			queries.ADMIN_ORDERS_SQL.format(condition=draft_cond, order=draft_order),
+			("draft", *draft_params, 11),
+			{"idx_orders_status_id", "orders_pkey"},
+		),
+		(
+			"admin_users (curseur)",
+			queries.ADMIN_USERS_SQL.format(condition=users_cond, order=users_order),
+			(*users_params, 11),
+			{"users_pkey"},
+		),
+		(
+			"billet par clé finale",
+			"SELECT id, order_id, status FROM payments WHERE final_key = %s",
+			("0" * 64,),
+			{"idx_payments_final_key"},
+		),
+		("scan billet (gate)", gate.SCAN_SQL, {"final_key": "0" * 64}, {"idx_payments_final_key"}),
+		("filtre à jour (gate)", gate.NEWEST_PAYMENT_SQL, None, {"payments_pkey"}),
+	]
+#----------------------------------------------------------------------------------------------------------------------#
+def load_dataset(cur, nb_users: int, nb_orders: int):
+	cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+	cur.execute(f"CREATE SCHEMA {SCHEMA}")
+	cur.execute(f"SET search_path TO {SCHEMA}")
+	with open(os.path.join(ROOT, "database", "init_database_JO.sql"), encoding="utf-8") as fichier:
+		cur.execute(fichier.read())
+	#------------------------------------------------------------------------------#
+	cur.execute("""
+		INSERT INTO users(first_name, last_name, email, password, key1)
+		SELECT 'Prénom', 'Nom', 'user' || i || '@synthetic.local', md5(i::text), md5('k' || i)
+		FROM generate_series(1, %s) AS i
+	""", (nb_users,))
+	# ~5 % de paniers, ~15 % d'annulées, le reste payé
+	cur.execute("""
+		INSERT INTO orders(user_id, offer_id, quantity, status, created_at)
+		SELECT
+			1 + (i %% %s),
+			(SELECT id FROM offers ORDER BY id LIMIT 1 OFFSET (i %% 3)),
+			1 + (i %% 4),
+			CASE WHEN i %% 20 = 0 THEN 'draft' WHEN i %% 7 = 0 THEN 'canceled' ELSE 'paid' END,
+			NOW() - (i || ' minutes')::interval
+		FROM generate_series(1, %s) AS i
+	""", (nb_users, nb_orders))
+	cur.execute("""
+		INSERT INTO payments(order_id, amount_cents, status, key2, final_key)
+		SELECT o.id, 100 * o.quantity, 'success', md5('p' || o.id), md5('k' || o.user_id) || md5('p' || o.id)
+		FROM orders o WHERE o.status = 'paid'
+	""")
+	cur.execute("""
+		INSERT INTO seat_holds(order_id, offer_id, shard, seats, status)
+		SELECT id, offer_id, id % 16, quantity, CASE status WHEN 'paid' THEN 'committed' ELSE 'released' END
+		FROM orders
+	""")
+	cur.execute("ANALYZE")
+#----------------------------------------------------------------------------------------------------------------------#
+def relations(cur) -> dict:
+	"""{nom : (table ou index parent, lignes estimées)} : les partitions et leurs index sont rapportés au parent."""
+	cur.execute("""
+		SELECT c.relname, COALESCE(p.relname, c.relname), c.reltuples
+		FROM pg_class c
+		LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+		LEFT JOIN pg_class p ON p.oid = i.inhparent
+		WHERE c.relnamespace = %s::regnamespace
+	""", (SCHEMA,))
+	return {name: (parent, tuples) for name, parent, tuples in cur.fetchall()}
+#----------------------------------------------------------------------------------------------------------------------#
+def plan_nodes(node: dict):
+	yield node
+	for child in node.get("Plans", []):
+		yield from plan_nodes(child)
+#----------------------------------------------------------------------------------------------------------------------#
+def explain(cur, sql: str, params) -> list:
+	cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+	plan = cur.fetchone()[0]
+	if isinstance(plan, str):
+		plan = json.loads(plan)
+	return list(plan_nodes(plan[0]["Plan"]))
+#----------------------------------------------------------------------------------------------------------------------#
+def check_plan(cur, sql: str, params, accepted: set, rels: dict) -> tuple[bool, str]:
+	nodes = explain(cur, sql, params)
+	seq_scans = set()
+	for n in nodes:
+		if n["Node Type"] != "Seq Scan":
+			continue
+		parent, tuples = rels.get(n.get("Relation Name"), (None, 0))
+		if parent in BIG_TABLES and (parent == n["Relation Name"] or tuples >= SMALL_PARTITION):
+			seq_scans.add(n["Relation Name"])
+	seq_scans = sorted(seq_scans)
+	indexes = sorted({rels.get(n["Index Name"], (n["Index Name"],))[0] for n in nodes if "Index Name" in n})
+	if seq_scans:
+		return False, f"Seq Scan sur {', '.join(seq_scans)} (index : {', '.join(indexes) or '-'})"
+	for group in accepted if isinstance(accepted, list) else [accepted]:
+		if not group & set(indexes):
+			return False, f"index attendu {' / '.join(sorted(group))}, plan : {', '.join(indexes) or '-'}"
+	return True, ", ".join(indexes)
+def check_pruning(cur, rels: dict) -> tuple[bool, str]:
+	"""/admin/orders filtrée sur le mois d'il y a 60 jours : une seule partition de orders dans le plan."""
+	month = (date.today() - timedelta(days=60)).replace(day=1)
+	last_day = (month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+	condition, params = partitions.created_range_clause("o.created_at", month, last_day)
+	nodes = explain(cur, queries.ADMIN_ORDERS_SQL.format(condition=condition, order="ASC"), ("paid", *params, 11))
+	scanned = sorted({
+		n["Relation Name"] for n in nodes
+		if rels.get(n.get("Relation Name"), (None,))[0] == "orders" and n["Relation Name"] != "orders"
+	})
+	return len(scanned) == 1, f"{month:%Y-%m} -> {', '.join(scanned) or '-'}"
+#----------------------------------------------------------------------------------------------------------------------#
+def main():
+	parser = argparse.ArgumentParser(description="Vérification des plans EXPLAIN des requêtes de l'application")
+	parser.add_argument("--users", type=int, default=20000)
+	parser.add_argument("--orders", type=int, default=200000)
+	parser.add_argument("--partitioned", action="store_true", help="orders / payments partitionnées par mois")
+	parser.add_argument("--keep", action="store_true", help="ne pas supprimer le schéma de test")
+	args = parser.parse_args()
+
+	conn = psycopg2.connect(DATABASE_URL, sslmode=DATABASE_SSLMODE)
+	conn.autocommit = True
+	failures = 0
+	try:
+		with conn.cursor() as cur:
+			load_dataset(cur, args.users, args.orders)
+			if args.partitioned:
+				cur.execute("BEGIN")		# migrate() verrouille les tables : une transaction explicite
+				partitions.migrate(cur)
+				cur.execute("COMMIT")
+			rels = relations(cur)
+			for name, sql, params, accepted in checks(args.users, args.orders):
+				ok, detail = check_plan(cur, sql, params, accepted, rels)
+				failures += not ok
+				print(f"{'OK  ' if ok else 'FAIL'}  {name:<36} {detail}")
+			if args.partitioned:
+				ok, detail = check_pruning(cur, rels)
+				failures += not ok
+				print(f"{'OK  ' if ok else 'FAIL'}  {'élagage admin_orders (1 mois)':<36} {detail}")
+			if not args.keep:
+				cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+	finally:
+		conn.close()
+
+	print(f"\n{failures} régression(s) de plan" if failures else "\nTous les plans utilisent un index")
+	sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+	main()
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,262 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Jeu de données synthétique à grande échelle (users, offers, orders, payments) pour les tests de volumétrie
+#
+#	DATABASE_SSLMODE=disable python tools/gen_dataset.py --users 100000 --orders 1000000 [--workers 4] [--seed 42]
+#	DATABASE_SSLMODE=disable python tools/gen_dataset.py --users 2000000 --orders 20000000 --partitioned
+#
+# - schéma dédié --schema (défaut "dataset", recréé : database/init_database_JO.sql puis données), jamais "public"
+# - COPY en parallèle : lots de --chunk lignes répartis sur --workers processus, une connexion chacun
+# - déterministe : chaque lot a sa propre graine (--seed, table, numéro de lot) -> mêmes lignes quel que soit
+#   le nombre de workers (dates relatives à --end, à fixer pour comparer deux jeux)
+# - chargement rapide : index secondaires et clés étrangères supprimés pendant le COPY puis recréés (une passe)
+# - répartition réaliste : commandes étalées sur --months mois (ids croissants avec le temps), clients plus ou
+#   moins actifs, --mix draft/paid/canceled (paniers récents : les anciens sont expirés par draft_sweeper.py),
+#   une partie des annulées avait été payée (--refunded) ; billets "final_key" valides (key1 + key2)
+# - mot de passe de tous les comptes : --password (connexion possible avec bench/loadtest.py)
+# Les offres ajoutées (--offers) sont sans capacité : pas de stock ni de seat_holds à tenir cohérents.
+# Statistiques de ventes recalculées (sales_stats.rebuild), ANALYZE ; résumé JSON sur stdout.
+#
+# Utilisation du jeu : PGOPTIONS="-c search_path=dataset" (voir bench/bench_routes.py)
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, concurrent.futures, hashlib, io, json, multiprocessing, os, random, sys, time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psycopg2
+import partitions, sales_stats
+from db_pool import DATABASE_URL, DATABASE_SSLMODE
+from passwords import hash_password
+#----------------------------------------------------------------------------------------------------------------------#
+FIRST_NAMES = ("Camille", "Léa", "Louis", "Hugo", "Chloé", "Lucas", "Manon", "Jules", "Inès", "Nathan", "Emma", "Adam")
+LAST_NAMES = ("Martin", "Bernard", "Dubois", "Thomas", "Robert", "Petit", "Durand", "Leroy", "Moreau", "Simon")
+QUANTITIES = ((1, 2, 3, 4), (60, 25, 10, 5))		# nombre de packs par commande et poids
+DRAFT_MAX_AGE = 1800								# s : au-delà, un panier aurait été expiré
+
+INDEXES_SQL = """
+	SELECT ic.relname, pg_get_indexdef(ic.oid)
+	FROM pg_index x
+	JOIN pg_class ic ON ic.oid = x.indexrelid
+	JOIN pg_class t ON t.oid = x.indrelid
+	WHERE t.relnamespace = %s::regnamespace AND NOT ic.relispartition
+	  AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = ic.oid)
+	  AND t.relname IN ('users', 'orders', 'payments')
+"""
+FOREIGN_KEYS_SQL = """
+	SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+	FROM pg_constraint
+	WHERE contype = 'f' AND connamespace = %s::regnamespace AND conparentid = 0
+"""
+#----------------------------------------------------------------------------------------------------------------------#
+def parse_args():
+	parser = argparse.ArgumentParser(description="Génération d'un jeu de données synthétique (COPY parallèle)")
+	parser.add_argument("--users", type=int, default=100000)
+	parser.add_argument("--orders", type=int, default=1000000)
+	parser.add_argument("--offers", type=int, default=12, help="nombre total d'offres (3 de base + ajoutées)")
+	parser.add_argument("--months", type=int, default=24, help="ancienneté de la plus vieille commande")
+	parser.add_argument("--end", help="AAAA-MM-JJ : date de la commande la plus récente (défaut : maintenant)")
+	parser.add_argument("--mix", default="draft=3,paid=82,canceled=15", help="répartition des statuts (poids)")
+	parser.add_argument("--refunded", type=float, default=0.3, help="part des annulées qui avaient été payées")
+	parser.add_argument("--password", default="Password1", help="mot de passe de tous les comptes")
+	parser.add_argument("--seed", type=int, default=42)
+	parser.add_argument("--schema", default="dataset")
+	parser.add_argument("--chunk", type=int, default=50000, help="lignes par COPY")
+	parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+	parser.add_argument("--partitioned", action="store_true", help="orders / payments partitionnées par mois")
+	args = parser.parse_args()
+	if args.schema == "public":
+		parser.error("--schema public refusé : le schéma est supprimé puis recréé")
+	try:
+		args.mix = {name: float(weight) for name, weight in (item.split("=") for item in args.mix.split(","))}
+	except ValueError:
+		parser.error("--mix attendu sous la forme draft=3,paid=82,canceled=15")
+	if set(args.mix) - {"draft", "paid", "canceled"}:
+		parser.error("--mix : statuts draft, paid, canceled")
+	end = partitions.parse_day(args.end)
+	if args.end and end is None:
+		parser.error("--end attend une date AAAA-MM-JJ")
+	args.end = datetime(end.year, end.month, end.day, tzinfo=timezone.utc) if end else datetime.now(timezone.utc)
+	return args
+#----------------------------------------------------------------------------------------------------------------------#
+def connect(schema: str):
+	return psycopg2.connect(DATABASE_URL, sslmode=DATABASE_SSLMODE, options=f"-c search_path={schema}")
+
+def key1(seed: int, user_id: int) -> str:
+	# dérivée de l'id : les lots de commandes calculent final_key sans lire users
+	return hashlib.blake2b(f"{seed}:key1:{user_id}".encode(), digest_size=16).hexdigest()
+
+def timestamp(epoch: float) -> str:
+	return datetime.fromtimestamp(epoch, timezone.utc).isoformat(sep=" ")
+#----------------------------------------------------------------------------------------------------------------------#
+def users_chunk(job: dict, lo: int, hi: int) -> dict:
+	rng = random.Random(f"{job['seed']}:users:{lo}")
+	start, span = job["start"], job["end"] - job["start"]
+	out = io.StringIO()
+	for user_id in range(lo, hi):
+		created = min(start + span * (user_id - 1) / job["users"] + rng.random() * 60, job["end"])	# ids ~ ancienneté
+		out.write(
+			f"{user_id}\t{rng.choice(FIRST_NAMES)}\t{rng.choice(LAST_NAMES)}\tuser{user_id}@synthetic.local\t"
+			f"{job['password']}\t{key1(job['seed'], user_id)}\t{timestamp(created)}\n"
+		)
+	out.seek(0)
+	return {"users": out}
+
+def orders_chunk(job: dict, lo: int, hi: int) -> dict:
+	rng = random.Random(f"{job['seed']}:orders:{lo}")
+	start, end = job["start"], job["end"]
+	span = end - start
+	statuses, status_weights = list(job["mix"]), list(job["mix"].values())
+	offer_ids, offer_weights = job["offer_ids"], job["offer_weights"]
+	orders, payments = io.StringIO(), io.StringIO()
+	for order_id in range(lo, hi):
+		# quelques clients très actifs, beaucoup de clients occasionnels
+		user_id = 1 + int(job["users"] * rng.random() ** 2)
+		offer_id = rng.choices(offer_ids, offer_weights)[0]
+		quantity = rng.choices(*QUANTITIES)[0]
+		status = rng.choices(statuses, status_weights)[0]
+		if status == "draft":
+			created = end - rng.random() * DRAFT_MAX_AGE
+		else:
+			created = start + span * (order_id - 1) / job["orders"] + rng.random() * 60
+		orders.write(f"{order_id}\t{user_id}\t{offer_id}\t{quantity}\t{status}\t{timestamp(created)}\n")
+		if status == "paid" or (status == "canceled" and rng.random() < job["refunded"]):
+			key2 = f"{rng.getrandbits(128):032x}"
+			paid_at = min(created + rng.random() * 600, end)
+			# même id que la commande : 1 paiement au plus par commande, id unique et déterministe
+			payments.write(
+				f"{order_id}\t{order_id}\t{sales_stats.amount_cents(quantity, job['prices'][offer_id])}\tsuccess\t{key2}\t"
+				f"{key1(job['seed'], user_id)}{key2}\t{timestamp(paid_at)}\n"
+			)
+	orders.seek(0)
+	payments.seek(0)
+	return {"orders": orders, "payments": payments}
+
+COLUMNS = {
+	"users": "id, first_name, last_name, email, password, key1, created_at",
+	"orders": "id, user_id, offer_id, quantity, status, created_at",
+	"payments": "id, order_id, amount_cents, status, key2, final_key, created_at",
+}
+GENERATORS = {"users": users_chunk, "orders": orders_chunk}
+#----------------------------------------------------------------------------------------------------------------------#
+_connection = None
+
+def load_chunk(job: dict, kind: str, lo: int, hi: int) -> dict:
+	"""Worker : génère un lot et le charge par COPY (une transaction) ; lignes chargées par table."""
+	global _connection
+	if _connection is None:
+		_connection = connect(job["schema"])
+	buffers = GENERATORS[kind](job, lo, hi)
+	counts = {}
+	with _connection, _connection.cursor() as cur:
+		for table, data in buffers.items():
+			cur.copy_expert(f"COPY {table} ({COLUMNS[table]}) FROM STDIN", data)
+			counts[table] = cur.rowcount
+	return counts
+#----------------------------------------------------------------------------------------------------------------------#
+def prepare_schema(cur, args, start: datetime) -> dict:
+	cur.execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE")
+	cur.execute(f"CREATE SCHEMA {args.schema}")
+	cur.execute(f"SET search_path TO {args.schema}")
+	with open(os.path.join(ROOT, "database", "init_database_JO.sql"), encoding="utf-8") as fichier:
+		cur.execute(fichier.read())
+	if args.partitioned:
+		cur.execute("BEGIN")		# migrate() verrouille les tables : une transaction explicite
+		partitions.migrate(cur)
+		cur.execute("COMMIT")
+		cur.execute(partitions.ensure_sql(since=f"'{start.isoformat()}'::timestamptz"))
+	#------------------------------------------------------------------------------#
+	rng = random.Random(f"{args.seed}:offers")
+	for i in range(4, args.offers + 1):
+		nbr_ticket = rng.choice((1, 2, 4, 6))
+		cur.execute(
+			"INSERT INTO offers(name, nbr_ticket, prix) VALUES (%s, %s, %s)",
+			(f"Offre {i}", nbr_ticket, nbr_ticket * rng.choice((35, 45, 60, 80, 120))),
+		)
+	cur.execute("SELECT id, prix FROM offers ORDER BY id")
+	offers = cur.fetchall()
+	#------------------------------------------------------------------------------#
+	# index secondaires et clés étrangères : recréés après le chargement
+	cur.execute(INDEXES_SQL, (args.schema,))
+	indexes = cur.fetchall()
+	cur.execute(FOREIGN_KEYS_SQL, (args.schema,))
+	foreign_keys = cur.fetchall()
+	for table, name, _ in foreign_keys:
+		cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+	for name, _ in indexes:
+		cur.execute(f"DROP INDEX {name}")
+	return {"offers": offers, "indexes": indexes, "foreign_keys": foreign_keys}
+#----------------------------------------------------------------------------------------------------------------------#
+def main():
+	args = parse_args()
+	end = args.end
+	start = end - timedelta(days=30 * args.months)
+	timings = {}
+	conn = connect("public")
+	conn.autocommit = True
+	try:
+		with conn.cursor() as cur:
+			t = time.perf_counter()
+			schema = prepare_schema(cur, args, start)
+			timings["schema_s"] = round(time.perf_counter() - t, 2)
+			#------------------------------------------------------------------------------#
+			offer_ids = [offer_id for offer_id, _ in schema["offers"]]
+			job = {
+				"schema": args.schema, "seed": args.seed, "users": args.users, "orders": args.orders,
+				"start": start.timestamp(), "end": end.timestamp(), "mix": args.mix, "refunded": args.refunded,
+				"password": hash_password(args.password),
+				"offer_ids": offer_ids,
+				"offer_weights": [1 / rank for rank in range(1, len(offer_ids) + 1)],		# les premières offres se vendent mieux
+				"prices": dict(schema["offers"]),
+			}
+			jobs = [("users", lo, min(lo + args.chunk, args.users + 1)) for lo in range(1, args.users + 1, args.chunk)]
+			jobs += [("orders", lo, min(lo + args.chunk, args.orders + 1)) for lo in range(1, args.orders + 1, args.chunk)]
+			#------------------------------------------------------------------------------#
+			# clés étrangères supprimées : users et orders se chargent en même temps
+			t = time.perf_counter()
+			rows = {"users": 0, "orders": 0, "payments": 0}
+			context = multiprocessing.get_context("spawn")
+			with concurrent.futures.ProcessPoolExecutor(args.workers, mp_context=context) as executor:
+				for counts in executor.map(load_chunk, *zip(*[(job, *j) for j in jobs])):
+					for table, n in counts.items():
+						rows[table] += n
+			timings["copy_s"] = round(time.perf_counter() - t, 2)
+			#------------------------------------------------------------------------------#
+			t = time.perf_counter()
+			for name, definition in schema["indexes"]:
+				# table partitionnée : "ON ONLY" ne créerait que l'index parent, sans les partitions
+				cur.execute(definition.replace(" ON ONLY ", " ON ", 1))
+			for table, name, definition in schema["foreign_keys"]:
+				cur.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+			timings["indexes_s"] = round(time.perf_counter() - t, 2)
+			t = time.perf_counter()
+			for table in COLUMNS:
+				cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT COALESCE(MAX(id), 1) FROM {table}))")
+			cur.execute("BEGIN")
+			sales_stats.rebuild(cur)
+			cur.execute("COMMIT")
+			cur.execute("ANALYZE")
+			timings["finish_s"] = round(time.perf_counter() - t, 2)
+			cur.execute("SELECT status, COUNT(*) FROM orders GROUP BY status ORDER BY status")
+			statuses = dict(cur.fetchall())
+			cur.execute("SELECT pg_size_pretty(SUM(pg_total_relation_size(c.oid))) FROM pg_class c "
+				"WHERE c.relnamespace = %s::regnamespace AND c.relkind IN ('r', 'p')", (args.schema,))
+			size = cur.fetchone()[0]
+	finally:
+		conn.close()
+	total = sum(timings.values())
+	print(json.dumps({
+		"schema": args.schema,
+		"seed": args.seed,
+		"partitioned": args.partitioned,
+		"rows": rows,
+		"orders_by_status": statuses,
+		"size": size,
+		**timings,
+		"rows_per_s": round(sum(rows.values()) / timings["copy_s"]) if timings["copy_s"] else None,
+		"total_s": round(total, 2),
+	}))
+
+if __name__ == "__main__":
+	main()
+#----------------------------------------------------------------------------------------------------------------------#
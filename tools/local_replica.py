@@ -0,0 +1,107 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Réplica local en réplication en flux, pour essayer DATABASE_REPLICA_URLS sur un poste de développement
+#
+#	python tools/local_replica.py create --data ./pg_replica --port 5433	# pg_basebackup -R depuis DATABASE_URL
+#	python tools/local_replica.py start|stop --data ./pg_replica --port 5433
+#	python tools/local_replica.py pause|resume --port 5433		# rejeu du WAL suspendu : simule un réplica en retard
+#	python tools/local_replica.py status --port 5433			# état du réplica et du serveur principal
+#
+# Prérequis : serveur principal avec wal_level=replica (défaut) et une ligne "replication" dans pg_hba.conf, binaires
+# PostgreSQL de la même version dans le PATH (ou --bin), commande lancée par l'utilisateur système qui exécute
+# PostgreSQL. Puis :
+#	DATABASE_REPLICA_URLS=postgresql://postgres@localhost:5433/database_jo uvicorn app:app
+#----------------------------------------------------------------------------------------------------------------------#
+import argparse, json, os, shutil, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psycopg2
+import psycopg2.extensions
+from db_pool import DATABASE_URL, DATABASE_SSLMODE
+from replicas import LAG_SQL
+#----------------------------------------------------------------------------------------------------------------------#
+def parse_args():
+	parser = argparse.ArgumentParser(description="Réplica PostgreSQL local (réplication en flux)")
+	parser.add_argument("command", choices=["create", "start", "stop", "pause", "resume", "status"])
+	parser.add_argument("--data", default="pg_replica", help="répertoire de données du réplica")
+	parser.add_argument("--port", type=int, default=5433)
+	parser.add_argument("--bin", default="", help="répertoire des binaires PostgreSQL (défaut : PATH)")
+	parser.add_argument("--socket-dir", default="", help="répertoire du socket Unix du réplica (défaut de PostgreSQL)")
+	return parser.parse_args()
+#----------------------------------------------------------------------------------------------------------------------#
+def binary(args, name: str) -> str:
+	path = os.path.join(args.bin, name) if args.bin else shutil.which(name)
+	if not path or not os.path.exists(path):
+		sys.exit(f"{name} introuvable (PATH ou --bin)")
+	return path
+
+def replica_dsn(port: int) -> str:
+	params = psycopg2.extensions.parse_dsn(DATABASE_URL)
+	params["port"] = str(port)
+	return psycopg2.extensions.make_dsn(**params)
+#----------------------------------------------------------------------------------------------------------------------#
+def create(args):
+	if os.path.exists(args.data) and os.listdir(args.data):
+		sys.exit(f"{args.data} existe déjà et n'est pas vide")
+	params = psycopg2.extensions.parse_dsn(DATABASE_URL)
+	command = [
+		binary(args, "pg_basebackup"), "--pgdata", args.data, "--write-recovery-conf", "--wal-method=stream",
+		"--checkpoint=fast", "--progress", "--dbname", psycopg2.extensions.make_dsn(
+			host=params.get("host", "localhost"), port=params.get("port", "5432"), user=params.get("user"),
+			password=params.get("password"), sslmode=DATABASE_SSLMODE,
+		),
+	]
+	subprocess.run(command, check=True)
+	print(f"réplica créé dans {args.data} ; démarrage : python tools/local_replica.py start --data {args.data} "
+		  f"--port {args.port}")
+
+def pg_ctl(args, action: str):
+	command = [binary(args, "pg_ctl"), action, "--pgdata", args.data, "--wait"]
+	if action == "start":
+		# port du réplica, et connexions de lecture autorisées pendant le rejeu (défaut de PostgreSQL, rappelé)
+		options = f"-p {args.port} -c hot_standby=on" + (f" -k {args.socket_dir}" if args.socket_dir else "")
+		command += ["--log", os.path.join(args.data, "replica.log"), "-o", options]
+	subprocess.run(command, check=True)
+#----------------------------------------------------------------------------------------------------------------------#
+def replay(args, action: str):
+	with psycopg2.connect(replica_dsn(args.port), sslmode=DATABASE_SSLMODE) as conn:
+		with conn.cursor() as cur:
+			cur.execute(f"SELECT pg_wal_replay_{action}()")
+	status(args)
+
+def status(args):
+	result = {}
+	with psycopg2.connect(replica_dsn(args.port), sslmode=DATABASE_SSLMODE) as conn:
+		with conn.cursor() as cur:
+			cur.execute(LAG_SQL)
+			standby, receiver, lag = cur.fetchone()
+			cur.execute("SELECT pg_is_wal_replay_paused()")
+			paused = cur.fetchone()[0]
+	result["replica"] = {"standby": standby, "receiver": receiver, "lag_s": float(lag), "paused": paused}
+	with psycopg2.connect(DATABASE_URL, sslmode=DATABASE_SSLMODE) as conn:
+		with conn.cursor() as cur:
+			cur.execute("""
+				SELECT application_name, state, pg_wal_lsn_diff(pg_current_wal_lsn(), replay_lsn)
+				FROM pg_stat_replication
+			""")
+			result["primary"] = [
+				{"application_name": name, "state": state, "replay_lag_bytes": int(diff or 0)}
+				for name, state, diff in cur.fetchall()
+			]
+	print(json.dumps(result, indent=2))
+#----------------------------------------------------------------------------------------------------------------------#
+def main():
+	args = parse_args()
+	if args.command == "create":
+		create(args)
+	elif args.command in ("start", "stop"):
+		pg_ctl(args, args.command)
+	elif args.command in ("pause", "resume"):
+		replay(args, args.command)
+	else:
+		status(args)
+
+if __name__ == "__main__":
+	main()
+#----------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,376 @@
+#----------------------------------------------------------------------------------------------------------------------#
+# Salle d'attente virtuelle : admission dans le tunnel d'achat à débit limité (ouverture des ventes)
+#
+# - WAITING_ROOM_RATE admissions/s pour tout le site (0 = salle désactivée), rafale de WAITING_ROOM_BURST ; chaque
+#   worker applique sa part (WAITING_ROOM_RATE / WAITING_ROOM_WORKERS) avec un seau à jetons (algorithme GCRA)
+# - file virtuelle : chaque visiteur reçoit d'abord un ticket signé "hors file" (cookie WAITING_ROOM_COOKIE), sans
+#   toucher au seau : pages d'entrée (ENTRY_PAGES), /queue, /queue/status, requête protégée refusée. Sa première
+#   requête protégée qui présente ce ticket prend une place dans le seau (une seule fois par ticket et par worker :
+#   un ticket rejoué reçoit la même place) et le remplace par un ticket portant l'heure d'admission ; les attentes
+#   se suivent dans l'ordre d'arrivée. Une requête sans cookie n'avance jamais la file
+# - le même ticket sert de laissez-passer, valable WAITING_ROOM_PASS_TTL s après l'heure d'admission ; ensuite
+#   (ou ticket falsifié, clé changée) : nouveau ticket hors file, retour en fin de file à la requête suivante
+# - ticket lié au compte : la première requête protégée d'un visiteur connecté (cookie SESSION_COOKIE) y inscrit son
+#   user_id, signé avec le reste ; présenté ensuite par un autre compte, il est remplacé par un ticket hors file
+#   (laissez-passer non transmissible d'un compte à l'autre). Un visiteur non connecté garde son ticket
+# - seules les requêtes admises passent sur POST /my/cart, /offers/validate, /payments/confirm (création du panier,
+#   paiement) ; les autres sont renvoyées vers /queue (HTML) ou reçoivent un 429 avec Retry-After (JSON)
+# - /queue et /queue/status : position et attente estimée calculées à partir du ticket, sans requête SQL ni place
+#   prise dans la file
+#
+# Plusieurs workers / instances : même WAITING_ROOM_SECRET partout (sinon clé aléatoire par processus et tickets
+# refusés d'un worker à l'autre). Limite : la mémoire des tickets hors file déjà présentés est propre à chaque
+# worker ; le même ticket hors file rejoué en parallèle sur N workers y prend N places (une par worker, toutes pour
+# le même visiteur ou le même compte), ce qui retarde d'autant les suivants sans faire entrer plus de visiteurs.
+#----------------------------------------------------------------------------------------------------------------------#
+import base64, hashlib, hmac, math, os, secrets, threading, time
+from starlette.requests import cookie_parser
+from starlette.responses import RedirectResponse
+from json_api import APIResponse
+import metrics
+#----------------------------------------------------------------------------------------------------------------------#
+WAITING_ROOM_RATE = float(os.getenv("WAITING_ROOM_RATE", "0"))				# admissions/s (site entier), 0 = désactivée
+WAITING_ROOM_BURST = int(os.getenv("WAITING_ROOM_BURST", "20"))				# admissions immédiates d'affilée
+WAITING_ROOM_WORKERS = int(os.getenv("WAITING_ROOM_WORKERS") or os.getenv("WEB_CONCURRENCY") or "1")	# part de chacun
+WAITING_ROOM_SECRET = os.getenv("WAITING_ROOM_SECRET", "")					# clé HMAC des tickets
+WAITING_ROOM_PASS_TTL = int(os.getenv("WAITING_ROOM_PASS_TTL", "900"))		# s de validité après l'admission
+WAITING_ROOM_POLL = int(os.getenv("WAITING_ROOM_POLL", "5"))				# s entre deux appels de /queue/status
+WAITING_ROOM_COOKIE = "wr_ticket"
+SESSION_COOKIE = "user_id"			# visiteur connecté (voir get_current_user_id dans app.py)
+
+# POST protégés -> page où revenir une fois admis
+PROTECTED = {"/offers/validate": "/offers", "/my/cart": "/offers", "/payments/confirm": "/my/orders"}
+# GET qui précèdent une requête protégée : ticket hors file remis au passage (1re validation sans clic perdu)
+ENTRY_PAGES = {"/login", "/offers"}
+SIGNATURE_BYTES = 16
+#----------------------------------------------------------------------------------------------------------------------#
+JOINS = metrics.registry.family(
+	"waiting_room_joins_total", "counter", "Arrivées dans la salle d'attente (admis tout de suite ou mis en file)",
+	("outcome",),
+)
+ADMISSIONS = metrics.registry.family(
+	"waiting_room_admissions_total", "counter", "Tickets admis dans le tunnel d'achat (première requête admise)", (),
+)
+ADMITTED_WAIT = metrics.registry.family(
+	"waiting_room_admitted_wait_seconds_total", "counter", "Attente cumulée des tickets admis (s)", (),
+)
+DENIED = metrics.registry.family(
+	"waiting_room_denied_total", "counter", "Requêtes protégées refusées faute d'admission", ("path",),
+)
+#----------------------------------------------------------------------------------------------------------------------#
+def safe_next(value: str | None, default: str = "/offers") -> str:
+	"""Page de retour après l'attente : chemin local uniquement (pas de redirection vers un autre site)."""
+	if not value or not value.startswith("/") or value.startswith("//") or "\\" in value:
+		return default
+	return value
+#----------------------------------------------------------------------------------------------------------------------#
+class Ticket:
+	__slots__ = ("id", "issued", "admit_at", "expires", "entered", "user")
+
+	def __init__(self, id: str, issued: float, admit_at: float, expires: float, entered: bool = False,
+				 user: str = ""):
+		self.id = id
+		self.issued = issued
+		self.admit_at = admit_at
+		self.expires = expires
+		self.entered = entered		# déjà compté comme admis (waiting_room_admissions_total)
+		self.user = user			# user_id du compte lié, "" = pas encore lié
+
+	@property
+	def pending(self) -> bool:
+		"""Ticket hors file : pas encore de place dans le seau (admit_at = 0)."""
+		return not self.admit_at
+
+	def usable_by(self, user_id: int | None) -> bool:
+		"""Ticket non lié, visiteur non connecté, ou même compte."""
+		return not self.user or user_id is None or self.user == str(user_id)
+#----------------------------------------------------------------------------------------------------------------------#
+class WaitingRoom:
+	def __init__(self, rate: float = WAITING_ROOM_RATE, burst: int = WAITING_ROOM_BURST,
+				 workers: int = WAITING_ROOM_WORKERS, secret: str = WAITING_ROOM_SECRET,
+				 pass_ttl: int = WAITING_ROOM_PASS_TTL, poll: int = WAITING_ROOM_POLL):
+		self.rate = rate
+		self.burst = max(1, burst)
+		self.workers = max(1, workers)
+		self.pass_ttl = pass_ttl
+		self.poll = max(1, poll)
+		self._key = (secret or secrets.token_hex(32)).encode()
+		self._lock = threading.Lock()
+		#------------------------------------------------------------------------------#
+		# GCRA : un jeton toutes les "interval" s pour ce worker, "tolerance" s d'avance = rafale
+		self.interval = self.workers / rate if rate > 0 else 0.0
+		self.tolerance = (self.burst - 1) * self.interval
+		self._tat = 0.0				# heure théorique d'arrivée (theoretical arrival time) du prochain jeton
+		self._joined = {}			# id de ticket hors file -> (ticket en file signé, expiration), ordre d'arrivée
+		#------------------------------------------------------------------------------#
+		self.issued = 0
+		self.joined = 0
+		self.queued = 0
+		self.admitted = 0
+		self.denied = 0
+		self.rejected_tickets = 0	# signature invalide ou format inconnu
+		self.foreign_tickets = 0	# ticket lié à un autre compte que celui du visiteur
+
+	@property
+	def enabled(self) -> bool:
+		return self.rate > 0
+	#------------------------------------------------------------------------------#
+	# Tickets signés : "id.émis.admission.expiration.entré.user_id" (ms) + HMAC-SHA256 tronqué
+	#------------------------------------------------------------------------------#
+	def _signature(self, payload: str) -> str:
+		digest = hmac.new(self._key, payload.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+		return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+	def sign(self, ticket: Ticket) -> str:
+		payload = "%s.%d.%d.%d.%d.%s" % (ticket.id, ticket.issued * 1000, ticket.admit_at * 1000, ticket.expires * 1000,
+										 ticket.entered, ticket.user)
+		return f"{payload}.{self._signature(payload)}"
+
+	def parse(self, value: str | None) -> Ticket | None:
+		if not value:
+			return None
+		payload, _, signature = value.rpartition(".")
+		if not hmac.compare_digest(signature, self._signature(payload)):
+			self.rejected_tickets += 1
+			return None
+		fields = payload.split(".")
+		if len(fields) == 5:
+			fields.append("")		# ticket émis avant la liaison au compte : non lié
+		try:
+			id, issued, admit_at, expires, entered, user = fields
+			return Ticket(id, int(issued) / 1000, int(admit_at) / 1000, int(expires) / 1000, entered == "1", user)
+		except ValueError:
+			self.rejected_tickets += 1
+			return None
+	#------------------------------------------------------------------------------#
+	def issue(self, now: float) -> Ticket:
+		"""Ticket hors file : ne prend pas de place dans le seau."""
+		self.issued += 1
+		return Ticket(secrets.token_urlsafe(9), now, 0.0, now + self.pass_ttl)
+
+	def join(self, pending: Ticket, now: float) -> tuple:
+		"""(ticket en file, valeur signée) pour un ticket hors file : admission immédiate si le seau a un jeton, sinon à
+		la suite du dernier arrivé. Une seule place par ticket : un ticket déjà présenté reçoit la même réponse."""
+		with self._lock:
+			while self._joined:		# expirations croissantes avec l'ordre d'arrivée
+				first = next(iter(self._joined))
+				if self._joined[first][1] > now:
+					break
+				del self._joined[first]
+			if pending.id in self._joined:
+				value = self._joined[pending.id][0]
+				return self.parse(value), value
+			tat = max(self._tat, now)
+			admit_at = max(now, tat - self.tolerance)
+			self._tat = tat + self.interval
+			ticket = Ticket(pending.id, now, admit_at, admit_at + self.pass_ttl)
+			value = self.sign(ticket)
+			self._joined[pending.id] = (value, ticket.expires)
+		self.joined += 1
+		queued = admit_at > now
+		if queued:
+			self.queued += 1
+		JOINS.inc(JOINS.labels("queued" if queued else "admitted"))
+		return ticket, value
+	#------------------------------------------------------------------------------#
+	def peek(self, value: str | None, now: float | None = None, user_id: int | None = None) -> tuple:
+		"""(ticket, nouvelle valeur du cookie ou None) sans place dans la file : /queue, /queue/status, pages d'entrée.
+		Ticket lié à un autre compte que `user_id` (visiteur connecté) : remplacé comme un ticket expiré."""
+		now = time.time() if now is None else now
+		ticket = self.parse(value)
+		if ticket is not None and not ticket.usable_by(user_id):
+			self.foreign_tickets += 1
+			ticket = None
+		if ticket is None or ticket.expires <= now:
+			ticket = self.issue(now)
+			return ticket, self.sign(ticket)
+		return ticket, None
+
+	def check(self, value: str | None, now: float | None = None, user_id: int | None = None) -> tuple:
+		"""(ticket, nouvelle valeur du cookie ou None) pour une requête protégée ; prend la place d'un ticket hors file
+		et lie le ticket au compte `user_id` (visiteur connecté)."""
+		now = time.time() if now is None else now
+		ticket, new_value = self.peek(value, now, user_id)
+		if new_value is not None:
+			return ticket, new_value		# pas de ticket (ou expiré) : hors file, place prise à la requête suivante
+		changed = False
+		if ticket.pending:
+			ticket, new_value = self.join(ticket, now)
+			if not ticket.usable_by(user_id):
+				# ticket hors file déjà présenté par un autre compte : sa place ne se partage pas
+				self.foreign_tickets += 1
+				ticket = self.issue(now)
+				return ticket, self.sign(ticket)
+			changed = new_value != value
+		if user_id is not None and not ticket.user:
+			ticket.user = str(user_id)
+			changed = True
+		if ticket.admit_at <= now and not ticket.entered:
+			ticket.entered = changed = True
+			self.admitted += 1
+			ADMISSIONS.inc(ADMISSIONS.labels())
+			ADMITTED_WAIT.inc(ADMITTED_WAIT.labels(), ticket.admit_at - ticket.issued)
+		if changed:
+			with self._lock:
+				if ticket.id in self._joined:		# ticket hors file rejoué : même réponse (admis, compte lié)
+					self._joined[ticket.id] = (self.sign(ticket), ticket.expires)
+		return ticket, self.sign(ticket) if changed else None
+	#------------------------------------------------------------------------------#
+	def is_admitted(self, ticket: Ticket, now: float | None = None) -> bool:
+		if not self.enabled:
+			return True
+		return not ticket.pending and ticket.admit_at <= (time.time() if now is None else now) < ticket.expires
+	#------------------------------------------------------------------------------#
+	def position(self, ticket: Ticket, now: float) -> int:
+		"""Visiteurs (tous workers) admis avant ce ticket, estimés au débit du site."""
+		return max(0, math.ceil((ticket.admit_at - now) * self.rate))
+
+	def queue_depth(self, now: float | None = None) -> int:
+		"""Tickets de ce worker encore en attente."""
+		if not self.enabled:
+			return 0
+		now = time.time() if now is None else now
+		return max(0, math.ceil((self._tat - self.tolerance - now) / self.interval) - 1)
+
+	def wait_estimate(self, now: float | None = None) -> float:
+		"""Attente d'un visiteur qui arriverait maintenant sur ce worker (s)."""
+		if not self.enabled:
+			return 0.0
+		now = time.time() if now is None else now
+		return max(0.0, self._tat - self.tolerance - now)
+	#------------------------------------------------------------------------------#
+	def status(self, ticket: Ticket, now: float | None = None) -> dict:
+		now = time.time() if now is None else now
+		if ticket.pending:
+			# hors file : attente qu'aurait un visiteur prenant sa place maintenant
+			wait = self.wait_estimate(now)
+			return {
+				"admitted": False,
+				"queued": False,
+				"position": math.ceil(wait * self.rate),
+				"eta_s": math.ceil(wait),
+				"poll_s": self.poll,
+				"expires_in_s": max(0, int(ticket.expires - now)),
+			}
+		admitted = self.is_admitted(ticket, now)
+		return {
+			"admitted": admitted,
+			"queued": True,
+			"position": 0 if admitted else self.position(ticket, now),
+			"eta_s": 0 if admitted else math.ceil(ticket.admit_at - now),
+			"poll_s": self.poll,
+			"expires_in_s": max(0, int(ticket.expires - now)),
+		}
+	#------------------------------------------------------------------------------#
+	def cookie(self, value: str, now: float | None = None) -> str:
+		"""En-tête Set-Cookie du ticket (expire avec le laissez-passer)."""
+		now = time.time() if now is None else now
+		ticket = self.parse(value)
+		max_age = max(1, int(ticket.expires - now)) if ticket else self.pass_ttl
+		return f"{WAITING_ROOM_COOKIE}={value}; Max-Age={max_age}; Path=/; HttpOnly; SameSite=Lax"
+
+	def set_cookie(self, response, value: str | None):
+		if value is not None:
+			response.headers.append("set-cookie", self.cookie(value))
+	#------------------------------------------------------------------------------#
+	def deny(self, path: str):
+		self.denied += 1
+		DENIED.inc(DENIED.labels(path))
+	#------------------------------------------------------------------------------#
+	def stats(self) -> dict:
+		return {
+			"enabled": self.enabled,
+			"rate_per_s": self.rate,
+			"worker_rate_per_s": round(self.rate / self.workers, 3),
+			"burst": self.burst,
+			"queue_depth": self.queue_depth(),
+			"wait_estimate_s": round(self.wait_estimate(), 1),
+			"issued": self.issued,
+			"joined": self.joined,
+			"tracked_tickets": len(self._joined),
+			"queued": self.queued,
+			"admitted": self.admitted,
+			"denied": self.denied,
+			"rejected_tickets": self.rejected_tickets,
+			"foreign_tickets": self.foreign_tickets,
+		}
+#----------------------------------------------------------------------------------------------------------------------#
+class WaitingRoomMiddleware:
+	"""POST du tunnel d'achat (PROTECTED) : ticket admis -> route ; sinon /queue (HTML) ou 429 (JSON).
+	GET des pages d'entrée (ENTRY_PAGES) : ticket hors file remis au visiteur qui n'en a pas."""
+
+	def __init__(self, app, room: "WaitingRoom" = None):
+		self.app = app
+		self.room = room or waiting_room
+	#------------------------------------------------------------------------------#
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http":
+			await self.app(scope, receive, send)
+			return
+		room, now = self.room, time.time()
+		if scope["method"] == "GET" and scope["path"] in ENTRY_PAGES:
+			_, value = room.peek(self._cookie(scope), now, self._user_id(scope))
+			await self._forward(scope, receive, send, value, now)
+			return
+		if scope["method"] != "POST" or scope["path"] not in PROTECTED:
+			await self.app(scope, receive, send)
+			return
+		ticket, value = room.check(self._cookie(scope), now, self._user_id(scope))
+		if room.is_admitted(ticket, now):
+			await self._forward(scope, receive, send, value, now)
+			return
+		#------------------------------------------------------------------------------#
+		# refus : la route (et donc Postgres) n'est pas appelée
+		room.deny(scope["path"])
+		next_url = PROTECTED[scope["path"]]
+		if self._wants_json(scope):
+			status = room.status(ticket, now)
+			# hors file : nouvel essai tout de suite avec le cookie (il prendra la place)
+			retry = 1 if ticket.pending else max(1, min(status["eta_s"], room.poll))
+			response = APIResponse(
+				{"error": "file d'attente", "queue": f"/queue?next={next_url}", **status}, status_code=429,
+				headers={"Retry-After": str(retry), "Cache-Control": "no-store"},
+			)
+		else:
+			response = RedirectResponse(url=f"/queue?next={next_url}", status_code=303)
+		room.set_cookie(response, value)
+		await response(scope, receive, send)
+	#------------------------------------------------------------------------------#
+	async def _forward(self, scope, receive, send, value: str | None, now: float):
+		"""Route appelée ; nouveau ticket éventuel ajouté aux en-têtes de sa réponse."""
+		if value is None:
+			await self.app(scope, receive, send)
+			return
+		header = (b"set-cookie", self.room.cookie(value, now).encode("latin-1"))
+
+		async def send_ticket(message):
+			if message["type"] == "http.response.start":
+				message = {**message, "headers": [*message.get("headers", []), header]}
+			await send(message)
+
+		await self.app(scope, receive, send_ticket)
+	#------------------------------------------------------------------------------#
+	@staticmethod
+	def _cookie(scope, cookie: str = WAITING_ROOM_COOKIE) -> str | None:
+		for name, value in scope["headers"]:
+			if name == b"cookie" and cookie.encode() in value:
+				return cookie_parser(value.decode("latin-1")).get(cookie)
+		return None
+
+	@classmethod
+	def _user_id(cls, scope) -> int | None:
+		value = cls._cookie(scope, SESSION_COOKIE)
+		try:
+			return int(value) if value else None
+		except ValueError:
+			return None
+
+	@staticmethod
+	def _wants_json(scope) -> bool:
+		for name, value in scope["headers"]:
+			if name == b"accept":
+				return b"application/json" in value and b"text/html" not in value
+		return False
+#----------------------------------------------------------------------------------------------------------------------#
+waiting_room = WaitingRoom()
+#----------------------------------------------------------------------------------------------------------------------#